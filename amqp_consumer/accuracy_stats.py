@@ -0,0 +1,324 @@
+"""
+Accuracy statistics per experiment and device, computed from the telemetry as it is committed.
+
+Every (table, experiment_id, device_id) series gets a window with preallocated NumPy buffers
+of ACCURACY_WINDOW_FIXES fixes, which are reused for each following window. A window closes
+after ACCURACY_WINDOW_SECONDS or when its buffer is full. When it closes, its fixes are
+summarized with whole-array operations and one row is queued for the experiment_accuracy table.
+The positions are projected onto a local east/north plane around the window's mean position,
+which is accurate to well below a millimetre over the spread of one receiver's fixes. The row holds:
+
+- the mean position and the number of fixes;
+- the horizontal scatter (2D RMS about the mean) and the vertical scatter (standard deviation of height), in metres;
+- CEP50 and CEP95, the radii around the mean containing 50 % and 95 % of the fixes;
+- the mean hAcc and vAcc the receiver reported (nav_pvt only), in metres;
+- the share of fixes with gnssFixOk / a valid GGA quality, and the share of every fix type or GGA quality.
+
+Every series also keeps the running mean position of all its earlier windows. For experiments
+whose type is 'static', drift_h and drift_v hold how far the window's mean is from that running mean.
+
+Only committed batches are observed, so spooled rows and rows written one by one without batching
+are not included. Under the supervisor each consumer process summarizes the fixes it received itself.
+"""
+
+import math
+import threading
+import time
+import numpy as np
+from config import Config
+from db.db_manager import DBManager
+from logger import setup_logger
+from metrics import Counter, Gauge, register
+
+logger = setup_logger(__name__)
+
+ACCURACY_WINDOWS = register(Counter("amqp_consumer_accuracy_windows_total", "Accuracy windows summarized, by source table", ("table",)))
+ACCURACY_SERIES = register(Gauge("amqp_consumer_accuracy_series", "Experiment and device series with an accuracy window"))
+ACCURACY_DROPPED = register(Counter("amqp_consumer_accuracy_dropped_total", "Accuracy summaries dropped because they could not be written"))
+
+SUMMARY_TABLE = "experiment_accuracy"
+SUMMARY_COLUMNS = (
+    "window_start", "window_end", "experiment_id", "device_id", "source", "samples",
+    "mean_lat", "mean_lon", "mean_height", "h_scatter", "v_scatter", "cep50", "cep95",
+    "mean_hacc", "mean_vacc", "fix_ok_ratio", "fix_ratios", "drift_h", "drift_v",
+)
+DBManager.register_table_columns(SUMMARY_TABLE, SUMMARY_COLUMNS)
+_DRIFT_H = SUMMARY_COLUMNS.index("drift_h")
+
+# Metres per degree of latitude on a sphere with the mean Earth radius
+METRES_PER_DEGREE = 6371008.8 * math.pi / 180
+
+# nav_pvt fixType as written by pyubx2 ("3D") or the UBX decoder ("3")
+NAV_PVT_FIX_LABELS = ("no_fix", "dead_reckoning", "2d", "3d", "gnss_dead_reckoning", "time_only", "other")
+_NAV_PVT_FIX_CODES = {
+    "0": 0, "no fix": 0, "1": 1, "dr": 1, "dead reckoning": 1, "2": 2, "2d": 2, "3": 3, "3d": 3,
+    "4": 4, "gnss+dr": 4, "gnss + dr": 4, "5": 5, "time only": 5,
+}
+# GGA quality indicator 0-8
+GNGGA_FIX_LABELS = ("invalid", "gps", "dgps", "pps", "rtk_fixed", "rtk_float", "dead_reckoning", "manual", "simulation", "other")
+
+# How long an experiment's type is trusted before it is looked up again
+_TYPE_TTL = 300.0
+
+
+def _nav_pvt_reader(columns):
+    index = {column: columns.index(column) for column in (
+        "full_time", "device_id", "experiment_id", "fixType", "gnssFixOk", "lon", "lat", "height", "hAcc", "vAcc",
+    )}
+    i_time, i_device, i_experiment = index["full_time"], index["device_id"], index["experiment_id"]
+    i_fix, i_ok, i_lon, i_lat = index["fixType"], index["gnssFixOk"], index["lon"], index["lat"]
+    i_height, i_hacc, i_vacc = index["height"], index["hAcc"], index["vAcc"]
+    other = len(NAV_PVT_FIX_LABELS) - 1
+    codes = _NAV_PVT_FIX_CODES
+
+    def read(row):
+        lat, lon = row[i_lat], row[i_lon]
+        if lat is None or lon is None or row[i_experiment] is None:
+            return None
+        # Heights and accuracies are in mm as converted by pyubx2, see message_processors/ubx.py
+        return (
+            row[i_experiment], row[i_device], row[i_time],
+            (lat, lon, (row[i_height] or 0.0) * 0.001, (row[i_hacc] or 0.0) * 0.001, (row[i_vacc] or 0.0) * 0.001),
+            codes.get(str(row[i_fix]).strip().lower(), other), bool(row[i_ok]),
+        )
+    return read
+
+
+def _gngga_reader(columns):
+    index = {column: columns.index(column) for column in (
+        "full_time", "device_id", "experiment_id", "lat", "ns", "lon", "ew", "quality", "alt",
+    )}
+    i_time, i_device, i_experiment = index["full_time"], index["device_id"], index["experiment_id"]
+    i_lat, i_ns, i_lon, i_ew = index["lat"], index["ns"], index["lon"], index["ew"]
+    i_quality, i_alt = index["quality"], index["alt"]
+    other = len(GNGGA_FIX_LABELS) - 1
+    nan = float("nan")
+
+    def read(row):
+        lat, lon = row[i_lat], row[i_lon]
+        if lat is None or lon is None or row[i_experiment] is None:
+            return None
+        if row[i_ns] == "S":
+            lat = -lat
+        if row[i_ew] == "W":
+            lon = -lon
+        try:
+            quality = int(row[i_quality])
+        except (TypeError, ValueError):
+            quality = other
+        code = quality if 0 <= quality < other else other
+        return (
+            row[i_experiment], row[i_device], row[i_time],
+            (lat, lon, row[i_alt] or 0.0, nan, nan),
+            code, 0 < quality < other,
+        )
+    return read
+
+
+# Telemetry tables that are summarized, with the reader for their row tuples and their fix labels
+SOURCES = {
+    "nav_pvt": (_nav_pvt_reader, NAV_PVT_FIX_LABELS),
+    "gngga": (_gngga_reader, GNGGA_FIX_LABELS),
+}
+
+
+class _Series:
+    """The open window of one (table, experiment, device) and the running mean of its earlier windows."""
+    __slots__ = ("values", "codes", "ok", "count", "first_time", "last_time", "opened_at", "seen_at", "mean", "mean_samples")
+
+    def __init__(self, capacity):
+        # lat, lon, height, hAcc, vAcc per fix
+        self.values = np.empty((capacity, 5))
+        self.codes = np.empty(capacity, dtype=np.intp)
+        self.ok = np.empty(capacity, dtype=np.bool_)
+        self.count = 0
+        self.first_time = None
+        self.last_time = None
+        self.opened_at = None
+        self.seen_at = None
+        # Running mean lat, lon and height over all closed windows
+        self.mean = None
+        self.mean_samples = 0
+
+
+class AccuracyStats:
+    """Collects the fixes of committed batches into per-series windows and summarizes closed windows.
+
+    Parameters:
+    - window_seconds: Seconds after its first fix a window is closed.
+    - window_fixes: Fixes buffered per series; a full window is closed early.
+    - max_series: Series tracked at once, fixes of further series are ignored.
+    """
+    def __init__(self, window_seconds=None, window_fixes=None, max_series=None):
+        self.window_seconds = window_seconds or Config.ACCURACY_WINDOW_SECONDS
+        self.window_fixes = window_fixes or Config.ACCURACY_WINDOW_FIXES
+        self.max_series = max_series or Config.ACCURACY_MAX_SERIES
+        self._series = {}
+        self._readers = {}
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def _reader(self, table_name):
+        reader = self._readers.get(table_name)
+        if reader is None:
+            columns = DBManager._table_columns.get(table_name)
+            if table_name not in SOURCES or columns is None:
+                return None
+            reader = self._readers[table_name] = SOURCES[table_name][0](columns)
+        return reader
+
+    def observe(self, batches):
+        """Add the fixes of a committed batch, a dict mapping table name to row tuples."""
+        now = time.monotonic()
+        with self._lock:
+            for table_name, rows in batches.items():
+                read = self._reader(table_name)
+                if read is None or not rows or isinstance(rows[0], dict):
+                    continue
+                for row in rows:
+                    fix = read(row)
+                    if fix is not None:
+                        self._add(table_name, fix, now)
+            ACCURACY_SERIES.set(len(self._series))
+
+    def _add(self, table_name, fix, now):
+        experiment_id, device_id, full_time, values, code, ok = fix
+        key = (table_name, experiment_id, device_id)
+        series = self._series.get(key)
+        if series is None:
+            if len(self._series) >= self.max_series:
+                logger.warning("Tracking %d accuracy series already, ignoring %s", len(self._series), key)
+                return
+            series = self._series[key] = _Series(self.window_fixes)
+        index = series.count
+        if not index:
+            series.first_time = full_time
+            series.opened_at = now
+        series.values[index] = values
+        series.codes[index] = code
+        series.ok[index] = ok
+        series.count = index + 1
+        series.last_time = full_time
+        series.seen_at = now
+        if series.count == self.window_fixes:
+            self._close(key, series)
+
+    def _close(self, key, series):
+        table_name, experiment_id, device_id = key
+        self._pending.append(summarize(series, table_name, experiment_id, device_id))
+        series.count = 0
+        ACCURACY_WINDOWS.inc(table_name)
+
+    def close_expired(self, now=None):
+        """Close windows older than window_seconds and forget series without fixes for ten windows."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for key, series in list(self._series.items()):
+                if series.count and now - series.opened_at >= self.window_seconds:
+                    self._close(key, series)
+                elif not series.count and now - series.seen_at >= 10 * self.window_seconds:
+                    del self._series[key]
+            ACCURACY_SERIES.set(len(self._series))
+
+    def take(self):
+        """Return and clear the summary rows of the windows closed so far."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def requeue(self, rows, limit=10000):
+        """Put back summary rows that could not be written, keeping at most limit pending rows."""
+        with self._lock:
+            self._pending[:0] = rows
+            if len(self._pending) > limit:
+                ACCURACY_DROPPED.inc(amount=len(self._pending) - limit)
+                del self._pending[:len(self._pending) - limit]
+
+
+def summarize(series, table_name, experiment_id, device_id):
+    """Summary row in SUMMARY_COLUMNS order for the fixes in a series' window; updates its running mean."""
+    count = series.count
+    lat, lon, height, h_acc, v_acc = series.values[:count].T
+    mean_lat, mean_lon, mean_height = lat.mean(), lon.mean(), height.mean()
+    metres_per_degree_lon = METRES_PER_DEGREE * math.cos(math.radians(mean_lat))
+    north = (lat - mean_lat) * METRES_PER_DEGREE
+    east = (lon - mean_lon) * metres_per_degree_lon
+    radius = np.hypot(east, north)
+    cep50, cep95 = np.percentile(radius, (50, 95))
+    labels = SOURCES[table_name][1]
+    fix_counts = np.bincount(series.codes[:count], minlength=len(labels))
+    drift_h = drift_v = None
+    if series.mean is not None:
+        drift_h = math.hypot(
+            (mean_lon - series.mean[1]) * metres_per_degree_lon,
+            (mean_lat - series.mean[0]) * METRES_PER_DEGREE,
+        )
+        drift_v = float(mean_height - series.mean[2])
+        weight = count / (series.mean_samples + count)
+        series.mean = [previous + (current - previous) * weight for previous, current in zip(series.mean, (mean_lat, mean_lon, mean_height))]
+    else:
+        series.mean = [mean_lat, mean_lon, mean_height]
+    series.mean_samples += count
+    has_accuracy = not np.isnan(h_acc[0])
+    return (
+        series.first_time, series.last_time, experiment_id, device_id, table_name, count,
+        float(mean_lat), float(mean_lon), float(mean_height),
+        float(np.sqrt(np.mean(radius * radius))), float(height.std()), float(cep50), float(cep95),
+        float(h_acc.mean()) if has_accuracy else None, float(v_acc.mean()) if has_accuracy else None,
+        float(series.ok[:count].mean()),
+        {label: round(int(fixes) / count, 4) for label, fixes in zip(labels, fix_counts) if fixes},
+        drift_h, drift_v,
+    )
+
+
+class AccuracyReporter:
+    """Daemon thread that closes expired windows and writes their summaries every ACCURACY_REPORT_INTERVAL seconds.
+
+    Drift is only kept for experiments of type 'static'; the types are looked up in the experiments table.
+    """
+    def __init__(self, stats, writer=None, interval=None):
+        self.stats = stats
+        self.writer = writer or DBManager.insert_batches
+        self.interval = interval or Config.ACCURACY_REPORT_INTERVAL
+        self._types = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="accuracy-reporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def report(self):
+        """Write the summaries of all closed windows; they are retried on the next report if that fails."""
+        self.stats.close_expired()
+        rows = self.stats.take()
+        if not rows:
+            return
+        try:
+            static = self._static_experiments({row[2] for row in rows})
+            rows = [row if row[2] in static else row[:_DRIFT_H] + (None, None) for row in rows]
+            self.writer({SUMMARY_TABLE: rows})
+        except Exception as e:
+            logger.error("Failed to write %d accuracy summaries: %s", len(rows), e)
+            self.stats.requeue(rows)
+            return
+        logger.debug("Wrote %d accuracy summaries", len(rows))
+
+    def _static_experiments(self, experiment_ids):
+        now = time.monotonic()
+        stale = [experiment_id for experiment_id in experiment_ids
+                 if experiment_id not in self._types or now - self._types[experiment_id][1] > _TYPE_TTL]
+        if stale:
+            with DBManager.get_db_cursor() as cur:
+                cur.execute("SELECT id, type FROM experiments WHERE id = ANY(%s)", (stale,))
+                types = dict(cur.fetchall())
+            for experiment_id in stale:
+                self._types[experiment_id] = (types.get(experiment_id), now)
+        return {experiment_id for experiment_id in experiment_ids if self._types[experiment_id][0] == "static"}
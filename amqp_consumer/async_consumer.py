@@ -0,0 +1,299 @@
+"""
+Asyncio consumer engine, selected with CONSUMER_ENGINE=asyncio.
+
+Consumes the same queues as RabbitConsumer over a pika AsyncioConnection. Telemetry rows are
+batched and written through AsyncDBPool, so many deliveries and several DB writes can be in
+flight on one thread, and registration RPCs run their blocking processors in the loop's executor.
+"""
+
+import asyncio
+import functools
+import json
+import time
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+from config import Config
+from db.async_db import AsyncDBPool
+from db.db_manager import DBManager
+from dedupe import RecentKeys
+from delivery_tracker import DeliveryTracker
+from logger import setup_logger
+from message_processors import envelope
+from message_processors.processor_factory import get_binary_processor
+from metrics import BATCH_ROWS, MESSAGES, REDELIVERIES, STAGE_SECONDS, observe_committed_rows
+from rabbit_consumer import RabbitMQConnection
+from retry_policy import PermanentError, RetryPolicy, declare_topology
+from spool import UNAVAILABLE_ERRORS
+
+logger = setup_logger(__name__)
+
+
+class AsyncProcessorAdapter:
+    """Adapts the synchronous processors from processor_factory to the event loop.
+
+    Telemetry processors are encoded on the loop and hand back their row tuples, one per fix of an
+    envelope, so they can be written through the async pool. Other processors use the blocking DBManager and run in the executor.
+    """
+    def __init__(self, processor_factory):
+        self.processor_factory = processor_factory
+
+    async def process(self, message_data, queue_name):
+        """Returns (table_name, rows, None) for telemetry and (None, None, response) otherwise.
+
+        rows holds the valid rows, it is empty if the validator rejected the message.
+        """
+        processor = self.processor_factory(message_data)
+        if envelope.is_envelope(message_data):
+            with STAGE_SECONDS.time("validate"):
+                rows = envelope.encode_fixes(processor, message_data, queue_name)
+            return processor.table_name, rows, None
+        if processor.table_name:
+            with STAGE_SECONDS.time("validate"):
+                row = processor.encode_row(message_data)
+            return processor.table_name, [row] if row else [], None
+        with STAGE_SECONDS.time("process"):
+            response = await asyncio.get_running_loop().run_in_executor(None, processor.process, message_data)
+        return None, None, response
+
+
+class _Batch:
+    def __init__(self):
+        self.rows = {}
+        self.row_count = 0
+        self.delivery_tags = []
+        self.timer = None
+
+
+class AsyncRabbitConsumer:
+    """Consumes messages from RabbitMQ queues on an asyncio event loop."""
+    def __init__(self, processor_factory, db_pool=None, spool=None, accuracy=None):
+        logger.debug("Initializing AsyncRabbitConsumer")
+        self.processor = AsyncProcessorAdapter(processor_factory)
+        self.db_pool = db_pool or AsyncDBPool()
+        self.spool = spool
+        self.accuracy = accuracy
+        self.recent_keys = RecentKeys() if Config.DEDUPE_ENABLED else None
+        self.retry_policy = RetryPolicy()
+        self.connection_handler = RabbitMQConnection(
+            Config.RABBITMQ_HOST,
+            pika.PlainCredentials(Config.RABBITMQ_USER, Config.RABBITMQ_PASS)
+        )
+        self.loop = None
+        self.connection = None
+        self.channels = {}
+        self.trackers = {}
+        self.batches = {}
+        self.queues = {
+            "gnss_data_queue": "basic",
+            "device_registration": "rpc",
+            "experiment_registration": "rpc"
+        }
+        self.queue_policies = {
+            "basic": {"prefetch_count": Config.BASIC_PREFETCH_COUNT, "batch": Config.BATCH_ENABLED},
+            "rpc": {"prefetch_count": Config.RPC_PREFETCH_COUNT, "batch": False},
+        }
+
+    def run(self):
+        """Open the database pools, connect to RabbitMQ and run the event loop forever."""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # Registration processors still go through the blocking DBManager pool
+        DBManager.initialize_connection_pool()
+        self.loop.run_until_complete(self.db_pool.open())
+        self.connect()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.db_pool.close())
+            self.loop.close()
+
+    def is_healthy(self):
+        """True while the connection and every consuming channel are open."""
+        return (
+            self.connection is not None and self.connection.is_open
+            and len(self.channels) == len(self.queues) and all(channel.is_open for channel in self.channels.values())
+        )
+
+    def connect(self):
+        logger.debug("Connecting to RabbitMQ at %s", self.connection_handler.host)
+        self.connection = AsyncioConnection(
+            self.connection_handler.parameters(),
+            on_open_callback=self.on_connection_open,
+            on_open_error_callback=self.on_connection_open_error,
+            on_close_callback=self.on_connection_closed,
+            custom_ioloop=self.loop,
+        )
+
+    def _reconnect(self):
+        self.channels = {}
+        self.trackers = {}
+        for batch in self.batches.values():
+            if batch.timer is not None:
+                batch.timer.cancel()
+            if batch.row_count:
+                logger.warning("Discarding %d buffered rows, they will be redelivered by the broker", batch.row_count)
+        self.batches = {}
+        logger.debug("Reconnecting in %d seconds", self.connection_handler.retry_delay)
+        self.loop.call_later(self.connection_handler.retry_delay, self.connect)
+
+    def on_connection_open_error(self, connection, error):
+        logger.error("Failed to connect to RabbitMQ: %s", error)
+        self._reconnect()
+
+    def on_connection_closed(self, connection, reason):
+        logger.warning("RabbitMQ connection closed: %s", reason)
+        self._reconnect()
+
+    def on_connection_open(self, connection):
+        logger.info("Successfully connected to RabbitMQ")
+        for queue_name in self.queues:
+            connection.channel(on_open_callback=functools.partial(self.on_channel_open, queue_name=queue_name))
+
+    def on_channel_open(self, channel, queue_name):
+        policy = self.queue_policies[self.queues[queue_name]]
+        self.channels[queue_name] = channel
+        self.trackers[queue_name] = DeliveryTracker(channel, queue_name)
+        if len(self.channels) == 1:
+            # Declarations are queued on the channel ahead of basic_qos and basic_consume
+            declare_topology(channel)
+        if policy["batch"]:
+            self.batches[queue_name] = _Batch()
+        channel.basic_qos(
+            prefetch_count=policy["prefetch_count"],
+            callback=functools.partial(self.on_qos_ok, channel=channel, queue_name=queue_name),
+        )
+
+    def on_qos_ok(self, _frame, channel, queue_name):
+        channel.basic_consume(
+            queue=queue_name,
+            on_message_callback=functools.partial(self.on_message, queue_name=queue_name),
+            auto_ack=False,
+        )
+        logger.debug("Queue %s is set for consuming", queue_name)
+
+    def on_message(self, channel, method, properties, body, queue_name):
+        tracker = self.trackers[queue_name]
+        tracker.delivered(method.delivery_tag)
+        if method.redelivered:
+            REDELIVERIES.inc(queue_name)
+        self.loop.create_task(self.handle_message(tracker, queue_name, method, properties, body))
+
+    async def handle_message(self, tracker, queue_name, method, properties, body):
+        logger.debug("Received message: %s", body)
+        binary = get_binary_processor(properties.content_type)
+        if binary is not None:
+            await self.handle_binary(tracker, queue_name, method, properties, body, *binary)
+            return
+        try:
+            with STAGE_SECONDS.time("decode"):
+                message_data = envelope.loads(body, properties.content_type)
+        except Exception as e:
+            logger.error("Failed to parse message: %s", e)
+            self.retry_policy.fail(tracker, queue_name, method.delivery_tag, properties, body, e)
+            return
+        try:
+            table_name, rows, response = await self.processor.process(message_data, queue_name)
+            MESSAGES.inc(queue_name, message_data.get("message_type"))
+            if table_name:
+                if not rows:
+                    raise PermanentError(f"{message_data.get('message_type')} message rejected by its validator")
+                await self._store_rows(tracker, queue_name, method, table_name, rows)
+                return
+            if properties.reply_to and tracker.channel.is_open:
+                tracker.channel.basic_publish(
+                    exchange='',
+                    routing_key=properties.reply_to,
+                    properties=pika.BasicProperties(correlation_id=properties.correlation_id),
+                    body=json.dumps(response),
+                )
+                logger.debug("Published response to RPC queue: %s", properties.reply_to)
+            tracker.ack([method.delivery_tag])
+        except Exception as e:
+            logger.error("Failed to process message: %s", e)
+            self.retry_policy.fail(tracker, queue_name, method.delivery_tag, properties, body, e)
+
+    async def handle_binary(self, tracker, queue_name, method, properties, body, message_type, processor):
+        """Decode a binary message, e.g. raw UBX frames, on the loop and store its rows like JSON telemetry."""
+        try:
+            MESSAGES.inc(queue_name, message_type)
+            with STAGE_SECONDS.time("decode"):
+                rows = processor.decode(body, properties.headers)
+            if not rows:
+                raise PermanentError(f"{properties.content_type} message without any {message_type} frames")
+            await self._store_rows(tracker, queue_name, method, processor.table_name, rows)
+        except Exception as e:
+            logger.error("Failed to process %s message: %s", properties.content_type, e)
+            self.retry_policy.fail(tracker, queue_name, method.delivery_tag, properties, body, e)
+
+    async def _store_rows(self, tracker, queue_name, method, table_name, rows):
+        if self.recent_keys is not None:
+            rows = self.recent_keys.filter(table_name, rows)
+            if not rows:
+                # Every fix is stored already, e.g. a redelivery after the ack was lost
+                tracker.ack([method.delivery_tag])
+                return
+        if queue_name in self.batches and not method.redelivered:
+            self._buffer(tracker, queue_name, table_name, rows, method.delivery_tag)
+        else:
+            # Redelivered rows may come from a failed batch and are written one by one, see RabbitConsumer
+            await self.db_pool.insert_batches({table_name: rows})
+            if self.recent_keys is not None:
+                self.recent_keys.add({table_name: rows})
+            tracker.ack([method.delivery_tag])
+
+    def _buffer(self, tracker, queue_name, table_name, rows, delivery_tag):
+        if self.trackers.get(queue_name) is not tracker:
+            # The delivery belongs to a channel that has since closed and will be redelivered
+            return
+        batch = self.batches[queue_name]
+        batch.rows.setdefault(table_name, []).extend(rows)
+        batch.row_count += len(rows)
+        batch.delivery_tags.append(delivery_tag)
+        if batch.timer is None:
+            batch.timer = self.loop.call_later(Config.BATCH_MAX_DELAY_MS / 1000.0, self._flush, tracker, queue_name)
+        if batch.row_count >= Config.BATCH_MAX_ROWS:
+            self._flush(tracker, queue_name)
+
+    def _flush(self, tracker, queue_name):
+        batch = self.batches.get(queue_name)
+        if batch is None or not batch.row_count:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        self.batches[queue_name] = _Batch()
+        # Batches are written concurrently on separate pool connections; the tracker keeps acks safe
+        self.loop.create_task(self._write(tracker, batch.rows, batch.delivery_tags))
+
+    async def _write(self, tracker, rows, delivery_tags):
+        started = time.perf_counter()
+        try:
+            spooled = await self._write_rows(rows)
+        except Exception as e:
+            logger.error("Failed to write %d deliveries, nacking them: %s", len(delivery_tags), e)
+            tracker.nack(delivery_tags)
+            return
+        if not spooled:
+            STAGE_SECONDS.observe(time.perf_counter() - started, "db")
+            BATCH_ROWS.observe(sum(len(table_rows) for table_rows in rows.values()))
+            observe_committed_rows(rows, DBManager._table_columns)
+            if self.accuracy is not None:
+                self.accuracy.observe(rows)
+            if self.recent_keys is not None:
+                self.recent_keys.add(rows)
+        tracker.ack(delivery_tags)
+
+    async def _write_rows(self, rows):
+        """Write rows through the async pool or, while the database is unavailable, to the spool. Returns True if spooled."""
+        if self.spool is not None and self.spool.diverting:
+            await self.loop.run_in_executor(None, self.spool.append, rows)
+            return True
+        try:
+            await self.db_pool.insert_batches(rows)
+        except UNAVAILABLE_ERRORS as e:
+            if self.spool is None:
+                raise
+            logger.warning("Database unavailable, spooling %d rows: %s", sum(len(table_rows) for table_rows in rows.values()), e)
+            # The append fsyncs, keep it off the event loop
+            await self.loop.run_in_executor(None, self.spool.append, rows)
+            return True
+        return False
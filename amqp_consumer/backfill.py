@@ -0,0 +1,389 @@
+"""
+Parallel bulk backfill of recorded GNSS logs into TimescaleDB, without going through RabbitMQ.
+
+Usage, from the amqp_consumer directory with the POSTGRES_* variables of the consumer:
+    python backfill.py [--format ndjson|ubx|nmea] [--device-id 3] [--experiment-id 7] [--date 2024-05-01]
+                       [--processes 8] [--loaders 4] [--chunk-mb 64] [--batch-rows 50000]
+                       [--checkpoint backfill.checkpoint.json] [--dry-run] LOG [LOG ...]
+
+Formats, taken from the file extension unless --format is given:
+
+- ndjson (.ndjson, .jsonl): one message per line as published to gnss_data_queue, a GNGGA or
+  NAV-PVT message or a batch envelope with a fixes array. --device-id and --experiment-id fill in
+  messages without them. Registration messages are skipped, register the devices first.
+- ubx (.ubx): raw receiver output. NAV-PVT frames with a valid checksum are loaded, other UBX
+  messages, NMEA sentences and garbage between them are skipped. Needs --device-id and
+  --experiment-id.
+- nmea (.nmea, .nma): GGA sentences, dated by the RMC sentences of the log or by --date, see
+  message_processors/nmea.py. Needs --device-id and --experiment-id.
+
+Every file is memory-mapped and split into chunks of about --chunk-mb at record boundaries: the
+next line for ndjson, the next RMC sentence for nmea (the next line if there is none nearby) and
+the next valid NAV-PVT frame for ubx. A process pool parses the chunks. Rows pass the same
+validation as in the consumer: the processor from processor_factory and its row schema,
+envelope.encode_fixes, or the UBX processor's decode. They are written with
+DBManager.insert_batches, by COPY through the natural key staging table, in transactions of
+--batch-rows rows. At most --loaders processes write at the same time, the others keep parsing.
+
+The checkpoint file lists the chunks of every file and the ones that are committed, and is
+replaced atomically after every chunk. A rerun with the same checkpoint skips committed chunks. An
+interrupted chunk is loaded again, and the rows it already committed are skipped through the
+natural key (device_id, full_time), so a rerun never duplicates rows. A file whose size or
+modification time changed is split again and loaded from the start.
+"""
+
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from config import Config
+from db.db_manager import DBManager
+from logger import setup_logger, stop_logging
+from message_processors import envelope, ubx
+from message_processors.nmea import NMEAReader
+from message_processors.processor_factory import get_binary_processor, get_processor
+
+logger = setup_logger(__name__)
+
+FORMATS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".ubx": "ubx", ".nmea": "nmea", ".nma": "nmea"}
+# Bytes searched for an RMC sentence or a NAV-PVT frame past a chunk's nominal end
+BOUNDARY_WINDOW = 64 * 1024
+# Label of amqp_consumer_rejected_fixes_total for envelopes read from logs
+QUEUE_NAME = "backfill"
+
+
+def detect_format(path):
+    log_format = FORMATS.get(os.path.splitext(path)[1].lower())
+    if log_format is None:
+        raise ValueError(f"Cannot tell the format of {path} from its extension, pass --format")
+    return log_format
+
+
+def _line_start(view, offset):
+    """Offset of the first line starting at or after offset, len(view) if there is none."""
+    newline = view.find(b"\n", offset - 1)
+    return len(view) if newline == -1 else newline + 1
+
+
+def next_boundary(view, log_format, offset):
+    """Offset of the first record of log_format starting at or after offset, len(view) if there is none."""
+    size = len(view)
+    if log_format == "ubx":
+        while offset < size:
+            end = min(offset + BOUNDARY_WINDOW, size)
+            frames = ubx.scan_nav_pvt(view, offset, end)
+            if frames:
+                return frames[0]
+            offset = end
+        return size
+    start = _line_start(view, offset)
+    if log_format == "nmea":
+        # A chunk starting at an RMC sentence knows the date of its GGA sentences
+        found = view.find(b"RMC,", start, start + BOUNDARY_WINDOW)
+        while found != -1:
+            sentence = found - 3
+            if sentence >= start and view[sentence] == ord("$") and (sentence == 0 or view[sentence - 1] == ord("\n")):
+                return sentence
+            found = view.find(b"RMC,", found + 1, start + BOUNDARY_WINDOW)
+    return start
+
+
+def plan_chunks(path, log_format, chunk_bytes):
+    """Split a log file into [start, end) byte ranges of about chunk_bytes at record boundaries."""
+    if os.path.getsize(path) == 0:
+        return []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        size = len(view)
+        boundaries = [0]
+        while boundaries[-1] + chunk_bytes < size:
+            boundary = next_boundary(view, log_format, boundaries[-1] + chunk_bytes)
+            if boundary >= size:
+                break
+            boundaries.append(boundary)
+        boundaries.append(size)
+    return [[start, end] for start, end in zip(boundaries, boundaries[1:])]
+
+
+def _line_batches(view, start, end, batch_rows):
+    lines = view[start:end].splitlines()
+    for first in range(0, len(lines), batch_rows):
+        yield lines[first:first + batch_rows]
+
+
+def _parse_ndjson(view, start, end, options, counts):
+    defaults = options["fields"]
+    for lines in _line_batches(view, start, end, options["batch_rows"]):
+        lines = [line for line in lines if line.strip()]
+        try:
+            # One json.loads per batch as for NDJSON envelopes, line by line only if a line is broken
+            messages = json.loads(b"[" + b",".join(lines) + b"]")
+        except ValueError:
+            messages = []
+            for line in lines:
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    counts["rejected"] += 1
+        batches = {}
+        for message in messages:
+            if not isinstance(message, dict):
+                counts["rejected"] += 1
+                continue
+            if defaults:
+                message = {**defaults, **message}
+            try:
+                processor = get_processor(message)
+                if not processor.table_name:
+                    counts["skipped"] += 1
+                    continue
+                if envelope.is_envelope(message):
+                    rows = envelope.encode_fixes(processor, message, QUEUE_NAME)
+                    counts["rejected"] += len(message[envelope.FIXES]) - len(rows)
+                else:
+                    row = processor.encode_row(message)
+                    rows = [row] if row else []
+                    counts["rejected"] += not row
+            except (TypeError, ValueError) as e:
+                logger.debug("Invalid message %s: %s", message, e)
+                counts["rejected"] += 1
+                continue
+            batches.setdefault(processor.table_name, []).extend(rows)
+        yield from batches.items()
+
+
+def _parse_ubx(view, start, end, options, counts):
+    _, processor = get_binary_processor(ubx.CONTENT_TYPE)
+    headers = options["fields"]
+    offsets = ubx.scan_nav_pvt(view, start, end)
+    for first in range(0, len(offsets), options["batch_rows"]):
+        frames = [view[offset:offset + ubx.FRAME_LENGTH] for offset in offsets[first:first + options["batch_rows"]]]
+        try:
+            rows = processor.decode(b"".join(frames), headers)
+        except ValueError:
+            # One frame with an invalid date fails the whole body, so decode them one by one
+            rows = []
+            for frame in frames:
+                try:
+                    rows.extend(processor.decode(frame, headers))
+                except ValueError:
+                    counts["rejected"] += 1
+        yield processor.table_name, rows
+
+
+def _parse_nmea(view, start, end, options, counts):
+    processor = get_processor({"message_type": "GNGGA"})
+    reader = NMEAReader(options["date"], options["fields"])
+    for lines in _line_batches(view, start, end, options["batch_rows"]):
+        rows = []
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(b"$"):
+                continue
+            try:
+                message = reader.read(line)
+                if message is None:
+                    continue
+                row = processor.encode_row(message)
+            except (TypeError, ValueError) as e:
+                logger.debug("Invalid sentence %s: %s", line, e)
+                counts["rejected"] += 1
+                continue
+            if row:
+                rows.append(row)
+            else:
+                counts["rejected"] += 1
+        yield processor.table_name, rows
+
+
+PARSERS = {"ndjson": _parse_ndjson, "ubx": _parse_ubx, "nmea": _parse_nmea}
+
+# State of a worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(loaders, options):
+    _worker["loaders"] = loaders
+    _worker["options"] = options
+    if not options["dry_run"]:
+        # Connections are opened lazily, a worker holds at most one
+        DBManager.initialize_connection_pool(max_retries=3)
+
+
+def _write(batches):
+    if _worker["options"]["dry_run"]:
+        return
+    with _worker["loaders"]:
+        DBManager.insert_batches(batches)
+
+
+def load_chunk(path, log_format, start, end):
+    """Parse and write one chunk in a worker process and return its row counts."""
+    options = _worker["options"]
+    counts = {"rows": 0, "rejected": 0, "skipped": 0}
+    batches = {}
+    buffered = 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        for table_name, rows in PARSERS[log_format](view, start, end, options, counts):
+            if not rows:
+                continue
+            batches.setdefault(table_name, []).extend(rows)
+            buffered += len(rows)
+            if buffered >= options["batch_rows"]:
+                _write(batches)
+                counts["rows"] += buffered
+                batches = {}
+                buffered = 0
+    if buffered:
+        _write(batches)
+        counts["rows"] += buffered
+    return counts
+
+
+class Checkpoint:
+    """The chunks of every log file and the indexes of the committed ones, kept in a JSON file."""
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f)["files"]
+
+    def entry(self, path, log_format, chunk_bytes):
+        """Return the checkpoint entry of a log file, splitting it unless the entry matches the file."""
+        stat = os.stat(path)
+        version = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "format": log_format}
+        entry = self.files.get(path)
+        if entry is not None and any(entry.get(key) != value for key, value in version.items()):
+            logger.warning("%s changed since it was checkpointed, loading it from the start", path)
+            entry = None
+        if entry is None:
+            entry = self.files[path] = {**version, "chunks": plan_chunks(path, log_format, chunk_bytes), "done": []}
+        return entry
+
+    def done(self, path, index):
+        self.files[path]["done"].append(index)
+        self.save()
+
+    def save(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"files": self.files}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+
+def run(args):
+    """Load every chunk of args.logs that the checkpoint does not list as committed; returns the failed chunks."""
+    fields = {}
+    if args.device_id is not None:
+        fields["device_id"] = args.device_id
+    if args.experiment_id is not None:
+        fields["experiment_id"] = args.experiment_id
+    options = {"fields": fields, "date": args.date, "batch_rows": args.batch_rows, "dry_run": args.dry_run}
+
+    checkpoint = Checkpoint(args.checkpoint)
+    tasks = []
+    for path, log_format in args.logs:
+        entry = checkpoint.entry(path, log_format, args.chunk_mb * 1024 * 1024)
+        done = set(entry["done"])
+        tasks.extend(
+            (path, log_format, index, start, end)
+            for index, (start, end) in enumerate(entry["chunks"]) if index not in done
+        )
+    checkpoint.save()
+    total_bytes = sum(end - start for _, _, _, start, end in tasks)
+    logger.info(
+        "Loading %d chunks (%.1f MB) of %d files with %d processes and %d loaders",
+        len(tasks), total_bytes / 1e6, len(args.logs), args.processes, args.loaders,
+    )
+
+    totals = {"rows": 0, "rejected": 0, "skipped": 0}
+    loaded_bytes = 0
+    failed = 0
+    started = time.monotonic()
+    loaders = multiprocessing.Semaphore(args.loaders)
+    with ProcessPoolExecutor(args.processes, initializer=_init_worker, initargs=(loaders, options)) as executor:
+        futures = {
+            executor.submit(load_chunk, path, log_format, start, end): (path, index, end - start)
+            for path, log_format, index, start, end in tasks
+        }
+        try:
+            for completed, future in enumerate(as_completed(futures), 1):
+                path, index, size = futures[future]
+                try:
+                    counts = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    failed += 1
+                    logger.error("Chunk %d of %s failed, it is loaded again on the next run: %s", index, path, e)
+                    continue
+                if not args.dry_run:
+                    checkpoint.done(path, index)
+                for name, value in counts.items():
+                    totals[name] += value
+                loaded_bytes += size
+                logger.info(
+                    "Chunk %d/%d: %d rows, %d rejected, %d skipped from %s (%.1f MB/s)",
+                    completed, len(tasks), counts["rows"], counts["rejected"], counts["skipped"],
+                    os.path.basename(path), loaded_bytes / 1e6 / max(time.monotonic() - started, 1e-9),
+                )
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        "%s %d rows in %.1f s (%.0f rows/s), %d rejected, %d skipped, %d chunks failed",
+        "Validated" if args.dry_run else "Loaded", totals["rows"], elapsed, totals["rows"] / max(elapsed, 1e-9),
+        totals["rejected"], totals["skipped"], failed,
+    )
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("logs", nargs="+", metavar="LOG", help="NDJSON, UBX or NMEA log files")
+    parser.add_argument("--format", choices=sorted(PARSERS), help="format of every log, by default taken from the extension")
+    parser.add_argument("--device-id", type=int, help="device of UBX and NMEA logs, default for NDJSON messages")
+    parser.add_argument("--experiment-id", type=int, help="experiment of UBX and NMEA logs, default for NDJSON messages")
+    parser.add_argument("--date", type=date.fromisoformat, help="date of NMEA GGA sentences before the first RMC sentence")
+    parser.add_argument("--processes", type=int, default=Config.BACKFILL_PROCESSES or os.cpu_count())
+    parser.add_argument("--loaders", type=int, default=Config.BACKFILL_LOADERS, help="processes writing to the database at once")
+    parser.add_argument("--chunk-mb", type=int, default=Config.BACKFILL_CHUNK_MB)
+    parser.add_argument("--batch-rows", type=int, default=Config.BACKFILL_BATCH_ROWS, help="rows per COPY transaction")
+    parser.add_argument("--checkpoint", default="backfill.checkpoint.json", help="file recording the committed chunks")
+    parser.add_argument("--dry-run", action="store_true", help="parse and validate without writing or checkpointing")
+    args = parser.parse_args()
+
+    logs = []
+    for path in args.logs:
+        try:
+            log_format = args.format or detect_format(path)
+        except ValueError as e:
+            parser.error(str(e))
+        if log_format in ("ubx", "nmea") and (args.device_id is None or args.experiment_id is None):
+            parser.error(f"{log_format.upper()} logs need --device-id and --experiment-id")
+        logs.append((os.path.abspath(path), log_format))
+    args.logs = logs
+
+    try:
+        failed = run(args)
+    except BrokenProcessPool:
+        logger.error("A worker process died, check the database connection; committed chunks are kept in %s", args.checkpoint)
+        failed = 1
+    finally:
+        stop_logging()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
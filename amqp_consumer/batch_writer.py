@@ -0,0 +1,173 @@
+import threading
+import time
+import tracing
+from config import Config
+from db.db_manager import DBManager
+from logger import setup_logger
+from metrics import BATCH_ROWS, STAGE_SECONDS, observe_committed_rows
+from spool import UNAVAILABLE_ERRORS
+
+logger = setup_logger(__name__)
+
+
+class BatchWriter:
+    """Buffers validated telemetry rows and writes them to the database in one transaction.
+
+    A batch is flushed when it holds max_rows rows or max_delay_ms after its first row,
+    whichever comes first. After a successful commit the batch's delivery tags are passed to
+    ack, otherwise to nack; a DeliveryTracker turns them into a single multiple=True frame.
+
+    In threaded mode rows are added from worker threads, the flush timer runs on its own
+    thread and ack/nack are expected to marshal back to the connection thread themselves.
+    Otherwise everything runs on the connection thread and the timer uses call_later.
+
+    With a spool, batches the database cannot take are spooled and acked once they are on disk.
+    Committed batches are passed to accuracy, an AccuracyStats, and recent_keys, a RecentKeys, if given.
+    Traces of sampled deliveries are finished once their batch is settled, with the spans of the flush.
+    """
+    def __init__(self, connection, ack, nack, max_rows=None, max_delay_ms=None, writer=None, threaded=False, spool=None, accuracy=None, recent_keys=None):
+        self.connection = connection
+        self.ack = ack
+        self.nack = nack
+        self.max_rows = max_rows or Config.BATCH_MAX_ROWS
+        self.max_delay_ms = max_delay_ms or Config.BATCH_MAX_DELAY_MS
+        self.writer = writer or DBManager.insert_batches
+        self.threaded = threaded
+        self.spool = spool
+        self.accuracy = accuracy
+        self.recent_keys = recent_keys
+        self.rows = {}
+        self.row_count = 0
+        self.delivery_tags = []
+        self.traces = []
+        self._timer = None
+        self._started_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def add(self, table_name, row, delivery_tag):
+        """Buffer a row and flush if the batch is full."""
+        self.add_rows(table_name, (row,), delivery_tag)
+
+    def add_rows(self, table_name, rows, delivery_tag, trace=None):
+        """Buffer all rows of one delivery, e.g. the frames of a binary message."""
+        with self._lock:
+            self.rows.setdefault(table_name, []).extend(rows)
+            self.row_count += len(rows)
+            self.delivery_tags.append(delivery_tag)
+            if trace is not None:
+                self.traces.append(trace)
+            if self._timer is None:
+                self._started_at = time.monotonic()
+                self._timer = self._schedule(self.max_delay_ms / 1000.0)
+            full = self.row_count >= self.max_rows
+        if full:
+            self.flush()
+
+    def _schedule(self, delay):
+        if self.threaded:
+            timer = threading.Timer(delay, self._on_timeout)
+            timer.daemon = True
+            timer.start()
+            return timer
+        return self.connection.call_later(delay, self._on_timeout)
+
+    def _cancel(self, timer):
+        if self.threaded:
+            timer.cancel()
+        else:
+            self.connection.remove_timeout(timer)
+
+    def _on_timeout(self):
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def _take(self):
+        """Detach the buffered batch so new rows start a fresh one."""
+        with self._lock:
+            batch = (self.rows, self.row_count, self.delivery_tags, self.traces, self._started_at)
+            if self._timer is not None:
+                self._cancel(self._timer)
+                self._timer = None
+            self.rows = {}
+            self.row_count = 0
+            self.delivery_tags = []
+            self.traces = []
+            self._started_at = None
+        return batch
+
+    def flush(self):
+        """Write the buffered rows, then ack or nack every delivery in the batch.
+
+        Returns True if the batch was written or spooled (or was empty), False otherwise.
+        """
+        # Batches are written one at a time so they commit in the order they were filled
+        with self._flush_lock:
+            rows, row_count, delivery_tags, traces, started_at = self._take()
+            if not row_count:
+                return True
+            # The spans of the flush are shared by every traced delivery in the batch
+            flush_trace = None
+            if traces:
+                for trace in traces:
+                    trace.wait("batch_wait")
+                flush_trace = tracing.Trace(None, None)
+            write_started = time.perf_counter()
+            try:
+                with tracing.activate(flush_trace):
+                    spooled = self._write(rows, row_count)
+            except Exception as e:
+                logger.error("Failed to write batch of %d rows, nacking its deliveries: %s", row_count, e)
+                self.nack(delivery_tags)
+                self._finish(traces, flush_trace, "nacked")
+                return False
+            if not spooled:
+                STAGE_SECONDS.observe(time.perf_counter() - write_started, "db")
+                BATCH_ROWS.observe(row_count)
+                observe_committed_rows(rows, DBManager._table_columns)
+                if self.accuracy is not None:
+                    self.accuracy.observe(rows)
+                if self.recent_keys is not None:
+                    self.recent_keys.add(rows)
+            with tracing.activate(flush_trace), tracing.span("ack"):
+                self.ack(delivery_tags)
+            self._finish(traces, flush_trace, "spooled" if spooled else "acked")
+            logger.debug("Flushed batch of %d rows after %.1f ms", row_count, (time.monotonic() - started_at) * 1000)
+            return True
+
+    @staticmethod
+    def _finish(traces, flush_trace, outcome):
+        for trace in traces:
+            trace.spans.extend(flush_trace.spans)
+            tracing.finish(trace, outcome)
+
+    def _write(self, rows, row_count):
+        """Write rows to the database or, while it is unavailable, to the spool. Returns True if spooled."""
+        if self.spool is not None and self.spool.diverting:
+            self.spool.append(rows)
+            return True
+        try:
+            self.writer(rows)
+        except UNAVAILABLE_ERRORS as e:
+            if self.spool is None:
+                raise
+            logger.warning("Database unavailable, spooling batch of %d rows: %s", row_count, e)
+            self.spool.append(rows)
+            return True
+        return False
+
+    def discard(self):
+        """Drop buffered rows without settling them; the broker redelivers them after reconnecting."""
+        with self._lock:
+            if self.row_count:
+                logger.warning("Discarding %d buffered rows, they will be redelivered by the broker", self.row_count)
+            if self.threaded and self._timer is not None:
+                self._timer.cancel()
+            # Connection timers die with the connection, so there is nothing else to cancel
+            self._timer = None
+            self.rows = {}
+            self.row_count = 0
+            self.delivery_tags = []
+            self.traces = []
+            self._started_at = None
@@ -2,7 +2,7 @@ import os
 from logger import setup_logger
 
 # Setup logger for config module
-logger = setup_logger(__name__,os.getenv("LOG_LEVEL", "INFO"))
+logger = setup_logger(__name__)
 
 class Config:
     # PostgreSQL configuration
@@ -13,10 +13,115 @@ class Config:
     POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
     POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "password")
 
+    # Connection pool and session settings
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1")) # Connections opened at startup
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10")) # Upper bound of open connections per consumer process
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10")) # Seconds a checkout waits for a free connection
+    DB_POOL_VALIDATE_IDLE = float(os.getenv("DB_POOL_VALIDATE_IDLE", "30")) # Connections idle longer than this are checked with SELECT 1 before reuse
+    DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")) # Seconds after which a connection is closed and replaced
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000")) # Per-statement timeout, 0 disables it
+    DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "amqp_consumer") # Shown in pg_stat_activity
+    DB_PREPARED_STATEMENTS = int(os.getenv("DB_PREPARED_STATEMENTS", "32")) # Prepared single-row INSERTs kept per connection, 0 disables them
+    DB_TELEMETRY_SYNCHRONOUS_COMMIT = os.getenv("DB_TELEMETRY_SYNCHRONOUS_COMMIT", "on").lower() # synchronous_commit for telemetry batches, "off" skips waiting for the WAL flush
+
     # RabbitMQ configuration
     RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
     RABBITMQ_QUEUE = os.getenv("RABBITMQ_QUEUE", "gnss_data_queue")
     RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
     RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
+    BASIC_PREFETCH_COUNT = int(os.getenv("BASIC_PREFETCH_COUNT", "1000")) # Unacked deliveries per telemetry channel, keep above BATCH_MAX_ROWS
+    RPC_PREFETCH_COUNT = int(os.getenv("RPC_PREFETCH_COUNT", "10")) # Unacked deliveries per registration RPC channel
+    WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0")) # Process messages on this many worker threads, 0 processes them on the connection thread
+
+    # Consumer engine: "blocking" uses pika's BlockingConnection, "asyncio" uses AsyncioConnection
+    CONSUMER_ENGINE = os.getenv("CONSUMER_ENGINE", "blocking").lower()
+    ASYNC_DB_CONNECTIONS = int(os.getenv("ASYNC_DB_CONNECTIONS", "4")) # Async database connections used by the asyncio engine
+
+    # Supervisor configuration, more than one process runs the consumers under ConsumerSupervisor
+    CONSUMER_PROCESSES = int(os.getenv("CONSUMER_PROCESSES", "1"))
+    SUPERVISOR_BACKOFF_INITIAL = float(os.getenv("SUPERVISOR_BACKOFF_INITIAL", "1")) # Seconds before restarting a crashed consumer, doubles per crash
+    SUPERVISOR_BACKOFF_MAX = float(os.getenv("SUPERVISOR_BACKOFF_MAX", "60")) # Upper bound for the restart delay in seconds
+    SUPERVISOR_HEARTBEAT_INTERVAL = float(os.getenv("SUPERVISOR_HEARTBEAT_INTERVAL", "5")) # Seconds between consumer heartbeats
+    SUPERVISOR_HEALTH_LOG_INTERVAL = float(os.getenv("SUPERVISOR_HEALTH_LOG_INTERVAL", "60")) # Seconds between aggregated health log lines
+    SUPERVISOR_SHUTDOWN_TIMEOUT = float(os.getenv("SUPERVISOR_SHUTDOWN_TIMEOUT", "20")) # Seconds to wait for consumers to exit on SIGTERM
+
+    # Batching configuration for telemetry written from gnss_data_queue
+    BATCH_ENABLED = os.getenv("BATCH_ENABLED", "true").lower() == "true"
+    BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "500")) # Flush once this many rows are buffered
+    BATCH_MAX_DELAY_MS = int(os.getenv("BATCH_MAX_DELAY_MS", "250")) # Flush at the latest this long after the first buffered row
+    BULK_COPY_FORMAT = os.getenv("BULK_COPY_FORMAT", "binary").lower() # "text", "binary" or "none" for multi-row INSERTs
+
+    # Adaptive flow control of the telemetry queue for the blocking engine, see flow_control.py
+    FLOW_CONTROL_ENABLED = os.getenv("FLOW_CONTROL_ENABLED", "true").lower() == "true"
+    FLOW_CONTROL_INTERVAL = float(os.getenv("FLOW_CONTROL_INTERVAL", "5")) # Seconds between samples
+    FLOW_TARGET_COMMIT_MS = float(os.getenv("FLOW_TARGET_COMMIT_MS", "250")) # Mean batch commit time above which the limits are cut
+    FLOW_TARGET_POOL_WAIT_MS = float(os.getenv("FLOW_TARGET_POOL_WAIT_MS", "50")) # Mean connection checkout wait above which the limits are cut
+    FLOW_DECREASE_FACTOR = float(os.getenv("FLOW_DECREASE_FACTOR", "0.5")) # Multiplicative decrease on congestion
+    FLOW_PREFETCH_MIN = int(os.getenv("FLOW_PREFETCH_MIN", "50"))
+    FLOW_PREFETCH_MAX = int(os.getenv("FLOW_PREFETCH_MAX", "5000"))
+    FLOW_PREFETCH_STEP = int(os.getenv("FLOW_PREFETCH_STEP", "100")) # Additive increase while messages queue up
+    FLOW_IN_FLIGHT_MIN = int(os.getenv("FLOW_IN_FLIGHT_MIN", "10")) # Messages on the worker threads, only with WORKER_THREADS > 0
+    FLOW_IN_FLIGHT_MAX = int(os.getenv("FLOW_IN_FLIGHT_MAX", "5000"))
+    FLOW_IN_FLIGHT_STEP = int(os.getenv("FLOW_IN_FLIGHT_STEP", "100"))
+    FLOW_BATCH_ROWS_MIN = int(os.getenv("FLOW_BATCH_ROWS_MIN", "50")) # Batch size, never above the prefetch limit
+    FLOW_BATCH_ROWS_MAX = int(os.getenv("FLOW_BATCH_ROWS_MAX", "5000"))
+    FLOW_BATCH_ROWS_STEP = int(os.getenv("FLOW_BATCH_ROWS_STEP", "50"))
+
+    # In-memory dedupe of telemetry rows in front of the ON CONFLICT DO NOTHING writes, see dedupe.py
+    DEDUPE_ENABLED = os.getenv("DEDUPE_ENABLED", "true").lower() == "true"
+    DEDUPE_KEYS_PER_DEVICE = int(os.getenv("DEDUPE_KEYS_PER_DEVICE", "256")) # Keys of the last committed rows remembered per device and table
+    DEDUPE_MAX_DEVICES = int(os.getenv("DEDUPE_MAX_DEVICES", "2000")) # Devices remembered before the least recently active is forgotten
+
+    # Disk spool for telemetry batches while the database is unavailable
+    SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "true").lower() == "true"
+    SPOOL_DIR = os.getenv("SPOOL_DIR", "/tmp/amqp_consumer_spool") # Every consumer process spools to its own subdirectory
+    SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024))) # Segment file size before a new one is started
+    SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(1024 * 1024 * 1024))) # Cap per consumer process, batches beyond it are nacked
+    SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "5")) # Seconds between attempts to replay the spool
+    SPOOL_REPLAY_BATCH_ROWS = int(os.getenv("SPOOL_REPLAY_BATCH_ROWS", "5000")) # Rows per transaction when replaying
+
+    # Accuracy statistics per experiment and device, written to the experiment_accuracy table
+    ACCURACY_STATS_ENABLED = os.getenv("ACCURACY_STATS_ENABLED", "true").lower() == "true"
+    ACCURACY_WINDOW_SECONDS = float(os.getenv("ACCURACY_WINDOW_SECONDS", "60")) # Seconds of fixes summarized per window
+    ACCURACY_WINDOW_FIXES = int(os.getenv("ACCURACY_WINDOW_FIXES", "1200")) # Fixes buffered per experiment and device, a full window is summarized early
+    ACCURACY_MAX_SERIES = int(os.getenv("ACCURACY_MAX_SERIES", "10000")) # Experiment and device pairs tracked at once per consumer process
+    ACCURACY_REPORT_INTERVAL = float(os.getenv("ACCURACY_REPORT_INTERVAL", "10")) # Seconds between writes of the closed windows
+
+    # Device registration cache
+    REGISTRATION_CACHE_SIZE = int(os.getenv("REGISTRATION_CACHE_SIZE", "10000")) # Aliases kept before the least recently used is evicted
+    REGISTRATION_CACHE_TTL = float(os.getenv("REGISTRATION_CACHE_TTL", "3600")) # Seconds before a cached registration is written again
+
+    # Retries and dead-lettering, the exchanges and queues are also listed in rabbitmq/definitions.json
+    RETRY_EXCHANGE = os.getenv("RETRY_EXCHANGE", "gnss_retry_exchange")
+    RETRY_DELAYS_MS = [int(delay) for delay in os.getenv("RETRY_DELAYS_MS", "1000,4000,16000,64000").split(",")] # Delay before each retry, the last one repeats
+    RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5")) # Retries of a transiently failing message before it is dead-lettered
+    DEAD_LETTER_EXCHANGE = os.getenv("DEAD_LETTER_EXCHANGE", "gnss_dead_letter_exchange")
+    DEAD_LETTER_QUEUE = os.getenv("DEAD_LETTER_QUEUE", "gnss_dead_letter_queue")
+
+    # Health and metrics HTTP endpoint
+    HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+    HTTP_PORT = int(os.getenv("HTTP_PORT", "8080")) # Serves /health and /metrics, 0 disables it. Supervised consumers use the following ports
+
+    # Read service for Grafana, run with python read_service.py
+    READ_HTTP_PORT = int(os.getenv("READ_HTTP_PORT", "8081")) # Serves the SimpleJSON datasource endpoints, /health and /metrics
+    READ_BUCKET_SECONDS = int(os.getenv("READ_BUCKET_SECONDS", "3600")) # Cached time buckets, aligned to the epoch; keep it a divisor of a day so buckets stay within a chunk
+    READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "1024")) # Buckets kept before the least recently used is evicted
+    READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "600")) # Seconds a cached bucket is reused, rows replayed from a spool show up after it
+    READ_SETTLE_SECONDS = float(os.getenv("READ_SETTLE_SECONDS", "120")) # Buckets that ended less than this ago are not cached, their rows may still arrive
+    READ_MAX_POINTS = int(os.getenv("READ_MAX_POINTS", "5000")) # Upper bound for the points per target
+
+    # Tracing and profiling, see tracing.py and profiler.py
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01")) # Share of deliveries whose spans go to amqp_consumer_span_seconds, 0 disables the histogram
+    SLOW_MESSAGE_MS = float(os.getenv("SLOW_MESSAGE_MS", "1000")) # Deliveries slower than this are logged with their spans, sampled or not, 0 disables the log
+    PROFILE_MODE = os.getenv("PROFILE_MODE", "stack") # What SIGUSR1 captures: stack (samples of every thread), cprofile (the main thread) or off
+    PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30")) # Length of a capture, a second SIGUSR1 ends it early
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5")) # Interval between stack samples
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/amqp_consumer_profiles") # Directory the captures are written to
+
+    # Bulk backfill of recorded logs, run with python backfill.py; the command line flags override these
+    BACKFILL_PROCESSES = int(os.getenv("BACKFILL_PROCESSES", "0")) # Processes parsing and loading chunks, 0 uses one per CPU
+    BACKFILL_LOADERS = int(os.getenv("BACKFILL_LOADERS", "4")) # Chunks written to the database at the same time, each on its own connection
+    BACKFILL_CHUNK_MB = int(os.getenv("BACKFILL_CHUNK_MB", "64")) # Size of the chunks a log file is split into, the unit of the checkpoint
+    BACKFILL_BATCH_ROWS = int(os.getenv("BACKFILL_BATCH_ROWS", "50000")) # Rows per COPY transaction
 
     # Other configurations can be added here
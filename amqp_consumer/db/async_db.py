@@ -0,0 +1,155 @@
+"""
+Non-blocking database access for the asyncio consumer engine.
+
+Uses psycopg2's asynchronous connection mode and drives each connection's poll() from the event
+loop's reader/writer callbacks, so many statements can be in flight without threads. Async
+connections always run in autocommit mode and do not support COPY, so batches are written as
+multi-row INSERTs inside an explicit BEGIN/COMMIT.
+"""
+
+import asyncio
+import time
+import psycopg2
+from psycopg2 import extensions
+from config import Config
+from db.db_manager import DBManager
+from db.pool import POOL_TIMEOUTS, PoolTimeout, session_parameters
+from logger import setup_logger
+from metrics import DUPLICATES, POOL_WAIT_SECONDS
+
+logger = setup_logger(__name__)
+
+
+class AsyncDBPool:
+    """A fixed-size pool of asynchronous psycopg2 connections."""
+    def __init__(self, size=None):
+        self.size = size or Config.ASYNC_DB_CONNECTIONS
+        self._idle = None
+
+    async def open(self, max_retries=10, initial_delay=3):
+        """Open every connection in the pool, retrying like DBManager.initialize_connection_pool."""
+        self._idle = asyncio.Queue()
+        delay_between_retries = initial_delay
+        for attempt in range(1, max_retries + 1):
+            try:
+                for _ in range(self.size - self._idle.qsize()):
+                    self._idle.put_nowait(await self._connect())
+                logger.info("Async database pool with %d connections initialized successfully.", self.size)
+                return
+            except psycopg2.OperationalError as e:
+                logger.error("Attempt %s failed: %s", attempt, e)
+                if attempt == max_retries:
+                    logger.error("All attempts to connect to the database have failed.")
+                    raise
+                await asyncio.sleep(delay_between_retries)
+                delay_between_retries += initial_delay
+
+    async def close(self):
+        while self._idle is not None and not self._idle.empty():
+            connection = self._idle.get_nowait()
+            if connection is not None:
+                connection.close()
+
+    async def _checkout(self):
+        """Take an idle connection, waiting up to DB_POOL_TIMEOUT seconds like ConnectionPool.getconn."""
+        started = time.perf_counter()
+        try:
+            connection = await asyncio.wait_for(self._idle.get(), Config.DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            POOL_TIMEOUTS.inc("async")
+            raise PoolTimeout(f"No database connection became free within {Config.DB_POOL_TIMEOUT:g} s")
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - started, "async")
+        if connection is None:
+            # The slot of a discarded connection, reopened on its next checkout
+            try:
+                connection = await self._connect()
+            except psycopg2.Error:
+                self._idle.put_nowait(None)
+                raise
+        return connection
+
+    def _checkin(self, connection):
+        """Return a connection; a closed one is discarded and its slot reopened on the next checkout."""
+        self._idle.put_nowait(None if connection.closed else connection)
+
+    @staticmethod
+    async def _wait(connection):
+        """Wait until the connection's current operation has completed."""
+        loop = asyncio.get_running_loop()
+        while True:
+            state = connection.poll()
+            if state == extensions.POLL_OK:
+                return
+            future = loop.create_future()
+
+            def ready():
+                if not future.done():
+                    future.set_result(None)
+
+            fd = connection.fileno()
+            if state == extensions.POLL_READ:
+                loop.add_reader(fd, ready)
+                remove = loop.remove_reader
+            elif state == extensions.POLL_WRITE:
+                loop.add_writer(fd, ready)
+                remove = loop.remove_writer
+            else:
+                raise psycopg2.OperationalError(f"Unexpected poll state {state}")
+            try:
+                await future
+            finally:
+                remove(fd)
+
+    async def execute(self, query, params=None, fetch=False):
+        """Run a statement on an idle connection and optionally return all result rows."""
+        connection = await self._checkout()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            await self._wait(connection)
+            result = cursor.fetchall() if fetch else None
+            cursor.close()
+            return result
+        finally:
+            self._checkin(connection)
+
+    async def _connect(self):
+        connection = psycopg2.connect(async_=1, **session_parameters())
+        await self._wait(connection)
+        return connection
+
+    async def insert_batches(self, batches):
+        """Insert buffered rows for several tables in a single transaction.
+
+        Parameters:
+        - batches: Dict mapping table name to a list of row dicts.
+        """
+        connection = await self._checkout()
+        cursor = connection.cursor()
+        try:
+            # Async connections are in autocommit mode, so the transaction is managed explicitly
+            if Config.DB_TELEMETRY_SYNCHRONOUS_COMMIT != "on":
+                cursor.execute(cursor.mogrify("BEGIN; SET LOCAL synchronous_commit TO %s", (Config.DB_TELEMETRY_SYNCHRONOUS_COMMIT,)))
+            else:
+                cursor.execute("BEGIN")
+            await self._wait(connection)
+            for table_name, rows in batches.items():
+                for columns, values in DBManager.group_rows(table_name, rows).items():
+                    template = "(" + ", ".join(["%s"] * len(columns)) + ")"
+                    rendered = b", ".join(cursor.mogrify(template, value) for value in values)
+                    on_conflict = b" ON CONFLICT DO NOTHING" if table_name in DBManager._natural_keys else b""
+                    cursor.execute(f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ".encode() + rendered + on_conflict)
+                    await self._wait(connection)
+                    if on_conflict and cursor.rowcount < len(values):
+                        DUPLICATES.inc(table_name, "db", amount=len(values) - cursor.rowcount)
+            cursor.execute("COMMIT")
+            await self._wait(connection)
+        except psycopg2.Error as e:
+            logger.error("Error inserting batch into %s: %s", ", ".join(batches), e)
+            if not connection.closed:
+                cursor.execute("ROLLBACK")
+                await self._wait(connection)
+            raise
+        finally:
+            cursor.close()
+            self._checkin(connection)
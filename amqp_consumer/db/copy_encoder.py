@@ -0,0 +1,178 @@
+"""
+Encoders that turn row tuples into PostgreSQL COPY FROM STDIN payloads.
+
+The text encoder lets the server parse every value and works for any table. The binary encoder
+needs the column types up front, so it only covers the telemetry tables listed in COPY_COLUMN_TYPES,
+and raises CopyEncodeError for any value it cannot represent so the caller can fall back to text COPY or INSERTs.
+"""
+
+import io
+import json
+import struct
+from datetime import datetime, timezone
+
+# PostgreSQL types of the telemetry table columns, see timescaledb/init-db.sql
+COPY_COLUMN_TYPES = {
+    "gngga": {
+        "full_time": "timestamptz",
+        "lat": "float8",
+        "ns": "text",
+        "lon": "float8",
+        "ew": "text",
+        "quality": "int4",
+        "num_sv": "int4",
+        "hdop": "float8",
+        "alt": "float8",
+        "alt_unit": "text",
+        "sep": "float8",
+        "sep_unit": "text",
+        "diff_age": "int4",
+        "diff_station": "text",
+        "processed_time": "int8",
+        "device_id": "int4",
+        "experiment_id": "int4",
+    },
+    "nav_pvt": {
+        "full_time": "timestamptz",
+        "device_id": "int4",
+        "experiment_id": "int4",
+        "year": "int4",
+        "month": "int4",
+        "day": "int4",
+        "hour": "int4",
+        "min": "int4",
+        "second": "int4",
+        "validDate": "int4",
+        "validTime": "int4",
+        "tAcc": "int8",
+        "fixType": "text",
+        "gnssFixOk": "int4",
+        "numSV": "int4",
+        "lon": "float8",
+        "lat": "float8",
+        "height": "float8",
+        "hMSL": "float8",
+        "hAcc": "float8",
+        "vAcc": "float8",
+        "velN": "float8",
+        "velE": "float8",
+        "velD": "float8",
+        "gSpeed": "float8",
+        "headMot": "float8",
+        "sAcc": "float8",
+        "headAcc": "float8",
+        "pDOP": "float8",
+    },
+}
+
+_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_BINARY_TRAILER = struct.pack(">h", -1)
+_NULL_FIELD = struct.pack(">i", -1)
+_PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+class CopyEncodeError(ValueError):
+    """Raised when a value cannot be represented in the requested COPY format."""
+
+
+def _text_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    if "\x00" in value:
+        raise CopyEncodeError("NUL characters cannot be sent with COPY")
+    return value.translate(_TEXT_ESCAPES)
+
+
+def encode_text(rows):
+    """Encode an iterable of row tuples as a COPY text format buffer."""
+    buffer = io.BytesIO()
+    for row in rows:
+        line = "\t".join([_text_value(value) for value in row]) + "\n"
+        buffer.write(line.encode("utf-8"))
+    buffer.seek(0)
+    return buffer
+
+
+def _parse_timestamp(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise CopyEncodeError(f"Cannot parse timestamp {value!r}")
+    if not isinstance(value, datetime) or value.tzinfo is None:
+        raise CopyEncodeError(f"Timestamp {value!r} must be timezone aware")
+    return value
+
+
+def _binary_timestamptz(value):
+    delta = _parse_timestamp(value) - _PG_EPOCH
+    return struct.pack(">q", (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+def _binary_float8(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise CopyEncodeError(f"Expected a number, got {value!r}")
+    return struct.pack(">d", value)
+
+
+def _binary_integer(fmt):
+    def encode(value):
+        if not isinstance(value, int):
+            raise CopyEncodeError(f"Expected an integer, got {value!r}")
+        try:
+            return struct.pack(fmt, value)
+        except struct.error:
+            raise CopyEncodeError(f"Integer {value!r} is out of range")
+    return encode
+
+
+def _binary_text(value):
+    if not isinstance(value, str) or "\x00" in value:
+        raise CopyEncodeError(f"Expected a string without NUL characters, got {value!r}")
+    return value.encode("utf-8")
+
+
+_BINARY_ENCODERS = {
+    "timestamptz": _binary_timestamptz,
+    "float8": _binary_float8,
+    "int4": _binary_integer(">i"),
+    "int8": _binary_integer(">q"),
+    "text": _binary_text,
+}
+
+
+def binary_encoders(table_name, columns):
+    """Return the per-column binary encoders for a table, or None if any column type is unknown."""
+    column_types = COPY_COLUMN_TYPES.get(table_name)
+    if column_types is None or any(column not in column_types for column in columns):
+        return None
+    return [_BINARY_ENCODERS[column_types[column]] for column in columns]
+
+
+def encode_binary(rows, encoders):
+    """Encode an iterable of row tuples as a COPY binary format buffer."""
+    buffer = io.BytesIO()
+    write = buffer.write
+    write(_BINARY_HEADER)
+    field_count = struct.pack(">h", len(encoders))
+    for row in rows:
+        write(field_count)
+        for encode, value in zip(encoders, row):
+            if value is None:
+                write(_NULL_FIELD)
+                continue
+            data = encode(value)
+            write(struct.pack(">i", len(data)))
+            write(data)
+    write(_BINARY_TRAILER)
+    buffer.seek(0)
+    return buffer
@@ -1,15 +1,54 @@
+import threading
 import time
 import psycopg2
-from psycopg2 import pool
+import tracing
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 from contextlib import contextmanager
 from config import Config
+from db.copy_encoder import CopyEncodeError, binary_encoders, encode_binary, encode_text
+from db.pool import BROKEN_CONNECTION_ERRORS, ConnectionPool
+from db.statement_cache import PooledConnection
 from logger import setup_logger
+from metrics import DUPLICATES
 import os
 
-logger = setup_logger(__name__, level=os.environ.get("LOG_LEVEL", "INFO"))
+logger = setup_logger(__name__)
 
 class DBManager:
     _connection_pool = None
+    # Connection of the transaction() open on the current thread
+    _local = threading.local()
+    # Column order of tables whose rows are passed around as tuples, see message_processors/row_schema.py
+    _table_columns = {}
+    # The same columns as sets, the whitelist for table and column names put into INSERT and COPY statements
+    _table_column_sets = {}
+    # Columns identifying a row; rows repeating a stored key are skipped with ON CONFLICT DO NOTHING
+    _natural_keys = {}
+
+    @classmethod
+    def register_table_columns(cls, table_name, columns, natural_key=None):
+        """Declare the column order of the tuples written to table_name and, optionally, its natural key.
+
+        The natural key needs a unique index on the table, see timescaledb/schema/hypertables.sql.
+        """
+        cls._table_columns[table_name] = tuple(columns)
+        cls._table_column_sets[table_name] = frozenset(columns)
+        if natural_key:
+            cls._natural_keys[table_name] = tuple(natural_key)
+
+    @staticmethod
+    def check_columns(table_name, columns):
+        """Raise ValueError unless table_name is registered and every column is one of its columns.
+
+        Row dicts come from message JSON, so their keys must not reach the SQL text unchecked.
+        """
+        allowed = DBManager._table_column_sets.get(table_name)
+        if allowed is None:
+            raise ValueError(f"Rows cannot be written to table {table_name!r}")
+        unknown = [column for column in columns if column not in allowed]
+        if unknown:
+            raise ValueError(f"Unknown columns for table {table_name}: {', '.join(map(repr, unknown))}")
 
     @classmethod
     def initialize_connection_pool(cls, max_retries=10, initial_delay=3):
@@ -23,13 +62,8 @@ class DBManager:
         delay_between_retries = initial_delay
         for attempt in range(1, max_retries + 1):
             try:
-                cls._connection_pool = pool.SimpleConnectionPool(
-                    1, 10,  # min and max connections
-                    host=Config.POSTGRES_HOST,
-                    database=Config.POSTGRES_DB,
-                    user=Config.POSTGRES_USER,
-                    password=Config.POSTGRES_PASSWORD,
-                )
+                # Sizes, checkout timeout and session settings come from the DB_* settings in Config
+                cls._connection_pool = ConnectionPool()
                 logger.info("Database connection pool initialized successfully.")
                 break  # Exit loop if connection is successful
             except psycopg2.OperationalError as e:
@@ -43,36 +77,127 @@ class DBManager:
 
     @staticmethod
     @contextmanager
-    def get_db_cursor(commit=False):
-        connection = None
+    def _checkout():
+        """Check out a pooled connection; it is rolled back when returned and discarded if it broke."""
         try:
-            connection = DBManager._connection_pool.getconn()
-            cursor = connection.cursor()
-            yield cursor
-            if commit:
-                connection.commit()
+            with tracing.span("checkout"):
+                connection = DBManager._connection_pool.getconn()
         except Exception as e:
-            if connection:
-                connection.rollback()
             logger.error("Database operation failed: %s", e)
             raise
-        finally:
-            if cursor:
+        try:
+            yield connection
+        except Exception as e:
+            logger.error("Database operation failed: %s", e)
+            DBManager._connection_pool.putconn(connection, discard=isinstance(e, BROKEN_CONNECTION_ERRORS))
+            raise
+        DBManager._connection_pool.putconn(connection)
+
+    @staticmethod
+    @contextmanager
+    def get_db_cursor(commit=False):
+        """Yield a cursor on a pooled connection and commit afterwards if commit is set.
+
+        Inside transaction() the cursor runs on the transaction's connection within a savepoint,
+        so a failing helper only undoes its own statements, and the commit is left to the transaction.
+        The checkout, the statements and the commit are spans of the current thread's trace, see tracing.py.
+        """
+        connection = getattr(DBManager._local, "connection", None)
+        if connection is not None:
+            with DBManager._savepoint(connection) as cursor, tracing.span("execute"):
+                yield cursor
+            return
+        with DBManager._checkout() as connection:
+            cursor = connection.cursor()
+            try:
+                with tracing.span("execute"):
+                    yield cursor
+                if commit:
+                    with tracing.span("commit"):
+                        connection.commit()
+            finally:
                 cursor.close()
-            if connection:
-                DBManager._connection_pool.putconn(connection)
+
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """Run the DBManager helpers called inside it in one transaction, committed once at the end."""
+        if getattr(DBManager._local, "connection", None) is not None:
+            # Nested transactions join the outer one
+            yield
+            return
+        with DBManager._checkout() as connection:
+            DBManager._local.connection = connection
+            try:
+                yield
+                with tracing.span("commit"):
+                    connection.commit()
+            finally:
+                DBManager._local.connection = None
+
+    @staticmethod
+    @contextmanager
+    def _savepoint(connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT db_manager")
+            try:
+                yield cursor
+            except Exception:
+                if not connection.closed:
+                    cursor.execute("ROLLBACK TO SAVEPOINT db_manager")
+                    if isinstance(connection, PooledConnection):
+                        connection.forget_pending_temp_tables()
+                raise
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def pool_stats():
+        """Utilisation and counters of the connection pool, or None before it is initialized."""
+        if DBManager._connection_pool is None:
+            return None
+        return DBManager._connection_pool.stats()
+
+    @staticmethod
+    def check_connection():
+        """True if a pooled connection can be checked out and answers a trivial query."""
+        if DBManager._connection_pool is None or DBManager._connection_pool.closed:
+            return False
+        try:
+            with DBManager.get_db_cursor() as cur:
+                cur.execute("SELECT 1")
+                return cur.fetchone() == (1,)
+        except Exception:
+            return False
 
     @staticmethod
     def insert_into_db(table_name, data):
-        """Generic method to insert JSON data into the specified table."""
-    
+        """Insert one row dict into a registered table through a prepared statement.
+
+        The statement for the table and column set is prepared once per connection, see
+        db/statement_cache.py; with DB_PREPARED_STATEMENTS=0 a plain INSERT is sent instead.
+        A row repeating the natural key of a stored row is skipped.
+        """
+        columns = tuple(data)
+        DBManager.check_columns(table_name, columns)
+        values = tuple(data.values())
+        placeholders = ", ".join(["%s"] * len(values))
+        on_conflict = " ON CONFLICT DO NOTHING" if table_name in DBManager._natural_keys else ""
         with DBManager.get_db_cursor(commit=True) as cur:
-            placeholders = ", ".join(["%s"] * len(data))
-            columns = ", ".join(data.keys())
-            values = tuple(data.values())
-            query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+            statements = getattr(cur.connection, "statements", None)
+            if statements is not None and statements.size:
+                name = statements.prepare(cur, (table_name, columns), lambda: (
+                    f"INSERT INTO {table_name} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join(f'${index}' for index in range(1, len(columns) + 1))}){on_conflict}"
+                ))
+                query = f"EXECUTE {name} ({placeholders})"
+            else:
+                query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}){on_conflict}"
             try:
                 cur.execute(query, values)
+                if on_conflict and not cur.rowcount:
+                    DUPLICATES.inc(table_name, "db")
                 logger.debug("Executing query: %s with values %s", query, values)  # Log the query and values
                 logger.debug("Data inserted successfully into %s", table_name)
             except Exception as e:
@@ -80,6 +205,124 @@ class DBManager:
                 logger.error("Failed query: %s with values %s", query, values)  # Log the failed query and values
                 raise
 
+    @staticmethod
+    def copy_into_db(table_name, rows, copy_format=None):
+        """Bulk insert many row dicts into the specified table in one transaction.
+
+        Parameters:
+        - table_name: Name of the table to insert into.
+        - rows: List of row dicts, or tuples in the column order registered with register_table_columns.
+        - copy_format: "text", "binary" or "none" to use multi-row INSERTs. Defaults to Config.BULK_COPY_FORMAT.
+        """
+        with DBManager.get_db_cursor(commit=True) as cur:
+            DBManager._write_rows(cur, table_name, rows, copy_format)
+
+    @staticmethod
+    def insert_batches(batches, copy_format=None):
+        """Insert buffered rows for several tables in a single transaction.
+
+        Parameters:
+        - batches: Dict mapping table name to a list of rows, see copy_into_db.
+        - copy_format: See copy_into_db.
+        """
+        with DBManager.get_db_cursor(commit=True) as cur:
+            if Config.DB_TELEMETRY_SYNCHRONOUS_COMMIT != "on":
+                # Telemetry can trade durability of the last commits on a server crash for commit latency
+                cur.execute("SET LOCAL synchronous_commit TO %s", (Config.DB_TELEMETRY_SYNCHRONOUS_COMMIT,))
+            for table_name, rows in batches.items():
+                DBManager._write_rows(cur, table_name, rows, copy_format)
+
+    @staticmethod
+    def group_rows(table_name, rows):
+        """Map each column tuple to the value tuples that share it."""
+        if table_name in DBManager._table_columns and not isinstance(rows[0], dict):
+            # Encoded rows are tuples in the registered column order
+            return {DBManager._table_columns[table_name]: rows}
+        # Row dicts are grouped by their column set as they may carry optional keys
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row.keys()), []).append(tuple(row.values()))
+        for columns in groups:
+            DBManager.check_columns(table_name, columns)
+        return groups
+
+    @staticmethod
+    def _write_rows(cur, table_name, rows, copy_format=None):
+        copy_format = copy_format or Config.BULK_COPY_FORMAT
+        deduplicate = table_name in DBManager._natural_keys
+        for columns, values in DBManager.group_rows(table_name, rows).items():
+            try:
+                if deduplicate:
+                    DBManager._insert_new_rows(cur, table_name, columns, values, copy_format)
+                elif copy_format == "none" or not DBManager._copy_rows(cur, table_name, columns, values, copy_format):
+                    query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s"
+                    execute_values(cur, query, values, page_size=len(values))
+            except Exception as e:
+                logger.error("Error inserting %d rows into %s: %s", len(values), table_name, e)
+                raise
+        logger.debug("Inserted %d rows into %s", len(rows), table_name)
+
+    @staticmethod
+    def _insert_new_rows(cur, table_name, columns, values, copy_format):
+        """Insert the rows whose natural key is not stored yet and count the others as duplicates.
+
+        COPY cannot skip conflicting rows, so the rows are copied into a temporary staging table
+        and moved over with INSERT ... SELECT ... ON CONFLICT DO NOTHING. The staging table is
+        created once per pooled connection, which remembers it, see statement_cache.py.
+        """
+        column_list = ", ".join(columns)
+        staging = f"{table_name}_staging"
+        copied = False
+        if copy_format != "none":
+            connection = cur.connection
+            remembers = isinstance(connection, PooledConnection)
+            if not (remembers and connection.has_temp_table(staging)):
+                # ON COMMIT DELETE ROWS truncates it at commit, temporary tables are never vacuumed
+                cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+                if remembers:
+                    connection.add_temp_table(staging)
+            copied = DBManager._copy_rows(cur, table_name, columns, values, copy_format, target=staging)
+        if copied:
+            cur.execute(f"INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING")
+            inserted = cur.rowcount
+            # Another group of rows for the same table may follow in this transaction
+            cur.execute(f"DELETE FROM {staging}")
+        else:
+            execute_values(cur, f"INSERT INTO {table_name} ({column_list}) VALUES %s ON CONFLICT DO NOTHING", values, page_size=len(values))
+            inserted = cur.rowcount
+        if inserted < len(values):
+            DUPLICATES.inc(table_name, "db", amount=len(values) - inserted)
+
+    @staticmethod
+    def _copy_rows(cur, table_name, columns, values, copy_format, target=None):
+        """Stream rows through COPY FROM STDIN. Returns False if they have to be inserted another way.
+
+        Binary COPY falls back to text COPY for rows it cannot encode, e.g. timestamps that are
+        not ISO 8601 strings, since the server can still parse those. target is the table copied
+        into if it is not table_name itself, e.g. a staging table with the same columns.
+        """
+        buffer = None
+        if copy_format == "binary":
+            encoders = binary_encoders(table_name, columns)
+            try:
+                if encoders is not None:
+                    buffer = encode_binary(values, encoders)
+            except CopyEncodeError as e:
+                logger.debug("Rows for %s cannot be sent with binary COPY, using text: %s", table_name, e)
+            if buffer is None:
+                copy_format = "text"
+        if buffer is None:
+            try:
+                buffer = encode_text(values)
+            except CopyEncodeError as e:
+                logger.debug("Rows for %s cannot be sent with COPY, falling back to INSERT: %s", table_name, e)
+                return False
+        cur.copy_expert(
+            f"COPY {target or table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT {copy_format})",
+            buffer,
+        )
+        return True
+
 # Additional CRUD Operations for DBManager
 
     @staticmethod
@@ -91,7 +334,7 @@ class DBManager:
         - record_id: ID of the record to fetch.
         """
         with DBManager.get_db_cursor() as cur:
-            query = f"SELECT * FROM {table_name} WHERE id = %s"
+            query = sql.SQL("SELECT * FROM {} WHERE id = %s").format(sql.Identifier(table_name))
             cur.execute(query, (record_id,))
             result = cur.fetchone()
             if result:
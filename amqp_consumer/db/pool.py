@@ -0,0 +1,224 @@
+"""
+Thread-safe pool of blocking psycopg2 connections for DBManager.
+
+psycopg2's own pools fail a checkout at once when every connection is in use, never check whether
+an idle connection still works and put broken connections back. ConnectionPool instead:
+
+- blocks a checkout until a connection is returned or DB_POOL_TIMEOUT seconds have passed, then
+  raises PoolTimeout (a PoolError, so callers treat it as the database being unavailable);
+- validates a connection with SELECT 1 when it has been idle for DB_POOL_VALIDATE_IDLE seconds and
+  replaces it if it is dead;
+- discards connections that are closed, were returned after a connection-level error or are older
+  than DB_POOL_MAX_LIFETIME, and rolls back any transaction left open on the others;
+- opens every connection with the session settings from session_parameters(), so no extra round
+  trip is needed for them.
+
+Wait time, connections in use and idle, waiting threads, timeouts and discarded connections are
+exported as metrics and returned by stats().
+"""
+
+import collections
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions, pool
+from config import Config
+from db.statement_cache import PooledConnection
+from logger import setup_logger
+from metrics import POOL_WAIT_SECONDS, Counter, Gauge, register
+
+logger = setup_logger(__name__)
+
+POOL_CONNECTIONS = register(Gauge("amqp_consumer_db_pool_connections", "Database connections by state: in_use, idle and max", ("pool", "state")))
+POOL_WAITING = register(Gauge("amqp_consumer_db_pool_waiting", "Threads waiting for a database connection", ("pool",)))
+POOL_TIMEOUTS = register(Counter("amqp_consumer_db_pool_timeouts_total", "Checkouts that timed out waiting for a connection", ("pool",)))
+POOL_DISCARDED = register(Counter("amqp_consumer_db_pool_discarded_total", "Connections closed by the pool: broken, stale or expired", ("pool", "reason")))
+
+# Errors after which a connection is not trusted to be reused
+BROKEN_CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PoolTimeout(pool.PoolError):
+    """Raised when no connection is returned to the pool within the checkout timeout."""
+
+
+def session_parameters():
+    """Connection parameters shared by the blocking and async pools, including session settings."""
+    parameters = {
+        "host": Config.POSTGRES_HOST,
+        "database": Config.POSTGRES_DB,
+        "user": Config.POSTGRES_USER,
+        "password": Config.POSTGRES_PASSWORD,
+        "application_name": Config.DB_APPLICATION_NAME,
+    }
+    if Config.DB_STATEMENT_TIMEOUT_MS:
+        parameters["options"] = f"-c statement_timeout={Config.DB_STATEMENT_TIMEOUT_MS}"
+    return parameters
+
+
+class ConnectionPool:
+    """A thread-safe pool of blocking psycopg2 connections with a checkout timeout.
+
+    Parameters:
+    - minconn: Connections opened up front.
+    - maxconn: Upper bound of open connections.
+    - timeout: Seconds a checkout waits for a free connection.
+    - name: Pool label in the metrics.
+    - connect_kwargs: Passed to psycopg2.connect, defaults to session_parameters(). Connections
+      are PooledConnections carrying a prepared statement cache.
+    """
+    def __init__(self, minconn=None, maxconn=None, timeout=None, name="sync", **connect_kwargs):
+        self.minconn = Config.DB_POOL_MIN if minconn is None else minconn
+        self.maxconn = maxconn or Config.DB_POOL_MAX
+        self.timeout = Config.DB_POOL_TIMEOUT if timeout is None else timeout
+        self.validate_idle = Config.DB_POOL_VALIDATE_IDLE
+        self.max_lifetime = Config.DB_POOL_MAX_LIFETIME
+        self.name = name
+        self.connect_kwargs = connect_kwargs or session_parameters()
+        self.closed = False
+        # Idle connections with the time they were returned, the most recently used is reused first
+        self._idle = collections.deque()
+        self._opened_at = {}
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_seconds = 0.0
+        self._cond = threading.Condition()
+        POOL_CONNECTIONS.set(self.maxconn, self.name, "max")
+        for _ in range(self.minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+        self._update_metrics()
+
+    def _connect(self):
+        connection = psycopg2.connect(connection_factory=PooledConnection, **self.connect_kwargs)
+        self._opened_at[connection] = time.monotonic()
+        return connection
+
+    def _update_metrics(self):
+        POOL_CONNECTIONS.set(self._in_use, self.name, "in_use")
+        POOL_CONNECTIONS.set(len(self._idle), self.name, "idle")
+        POOL_WAITING.set(self._waiting, self.name)
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to timeout seconds (default: the pool's timeout)."""
+        started = time.perf_counter()
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise pool.PoolError("connection pool is closed")
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Reserve the slot, the connection is opened outside the lock
+                    connection, returned_at = None, None
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    POOL_TIMEOUTS.inc(self.name)
+                    raise PoolTimeout(f"No database connection became free within {self.timeout:g} s")
+                self._waiting += 1
+                self._update_metrics()
+                self._cond.wait(remaining)
+                self._waiting -= 1
+            self._in_use += 1
+            self._checkouts += 1
+            self._update_metrics()
+        try:
+            if connection is None:
+                connection = self._connect()
+            elif connection.closed or (time.monotonic() - returned_at > self.validate_idle and not self._is_alive(connection)):
+                self._close(connection, "stale")
+                with self._cond:
+                    self._size += 1
+                connection = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._update_metrics()
+                self._cond.notify()
+            raise
+        waited = time.perf_counter() - started
+        with self._cond:
+            self._wait_seconds += waited
+        POOL_WAIT_SECONDS.observe(waited, self.name)
+        return connection
+
+    @staticmethod
+    def _is_alive(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, connection, discard=False):
+        """Return a connection; it is closed instead if discard is set or it cannot be reused."""
+        reason = "broken" if discard or connection.closed else None
+        if reason is None and connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                reason = "broken"
+        if reason is None and (self.closed or time.monotonic() - self._opened_at.get(connection, 0) > self.max_lifetime):
+            reason = "expired"
+        if reason is not None:
+            self._close(connection, reason)
+        with self._cond:
+            if reason is None:
+                self._idle.append((connection, time.monotonic()))
+            self._in_use -= 1
+            self._update_metrics()
+            self._cond.notify()
+
+    def _close(self, connection, reason):
+        self._opened_at.pop(connection, None)
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+        if reason != "expired":
+            logger.warning("Discarded %s database connection", reason)
+        POOL_DISCARDED.inc(self.name, reason)
+
+    def closeall(self):
+        """Close the idle connections; connections still in use are closed when returned."""
+        with self._cond:
+            self.closed = True
+            idle, self._idle = list(self._idle), collections.deque()
+            self._cond.notify_all()
+        for connection, _ in idle:
+            self._opened_at.pop(connection, None)
+            connection.close()
+        with self._cond:
+            self._size -= len(idle)
+            self._update_metrics()
+
+    def stats(self):
+        """Snapshot of the pool's size, utilisation and counters since it was created."""
+        with self._cond:
+            return {
+                "max": self.maxconn,
+                "open": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "utilisation": self._in_use / self.maxconn,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "mean_wait_ms": self._wait_seconds / self._checkouts * 1000 if self._checkouts else 0.0,
+            }
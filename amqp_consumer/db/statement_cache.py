@@ -0,0 +1,86 @@
+"""
+Server-side prepared statements for the single-row insert path.
+
+Without batching every telemetry message is written with its own INSERT, which Postgres parses and
+plans again each time. Every pooled connection instead carries a StatementCache that PREPAREs the
+INSERT for a (table, columns) pair on first use and returns its name, so later rows only send
+EXECUTE with their values. The cache holds DB_PREPARED_STATEMENTS statements per connection and
+DEALLOCATEs the least recently used one beyond that. Prepared statements live as long as their
+session and are not undone by a rollback, so the cache stays valid until the connection is closed.
+
+The connection also remembers the temporary staging tables created in its session, see
+DBManager._insert_new_rows. Unlike a PREPARE, a CREATE TEMP TABLE is undone when its transaction
+or savepoint is rolled back, so a table only counts as created once that transaction committed.
+"""
+
+import itertools
+from collections import OrderedDict
+from psycopg2 import extensions
+from config import Config
+from metrics import Counter, register
+
+PREPARED_STATEMENTS = register(Counter(
+    "amqp_consumer_db_prepared_statements_total",
+    "Prepared statement cache lookups and changes: hit, prepared and evicted",
+    ("event",),
+))
+
+
+class StatementCache:
+    """LRU of the statements prepared on one connection, keyed by (table, columns)."""
+    def __init__(self, size=None):
+        self.size = Config.DB_PREPARED_STATEMENTS if size is None else size
+        self._names = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._names)
+
+    def prepare(self, cursor, key, build_query):
+        """Return the name of the statement prepared for key, preparing build_query() on cursor if needed.
+
+        The query uses $1, $2, ... placeholders.
+        """
+        name = self._names.get(key)
+        if name is not None:
+            self._names.move_to_end(key)
+            PREPARED_STATEMENTS.inc("hit")
+            return name
+        if len(self._names) >= self.size:
+            _, evicted = self._names.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {evicted}")
+            PREPARED_STATEMENTS.inc("evicted")
+        name = f"amqp_consumer_{next(self._ids)}"
+        cursor.execute(f"PREPARE {name} AS {build_query()}")
+        self._names[key] = name
+        PREPARED_STATEMENTS.inc("prepared")
+        return name
+
+
+class PooledConnection(extensions.connection):
+    """psycopg2 connection that carries the statements prepared and the temporary tables created in its session."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = StatementCache()
+        self.temp_tables = set()
+        self._pending_temp_tables = set()
+
+    def has_temp_table(self, name):
+        return name in self.temp_tables or name in self._pending_temp_tables
+
+    def add_temp_table(self, name):
+        """Remember a temporary table created in the current transaction, kept if it commits."""
+        self._pending_temp_tables.add(name)
+
+    def forget_pending_temp_tables(self):
+        """Drop the tables created since the last commit, e.g. after a rollback to a savepoint."""
+        self._pending_temp_tables.clear()
+
+    def commit(self):
+        super().commit()
+        self.temp_tables |= self._pending_temp_tables
+        self._pending_temp_tables.clear()
+
+    def rollback(self):
+        self._pending_temp_tables.clear()
+        super().rollback()
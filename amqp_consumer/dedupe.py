@@ -0,0 +1,91 @@
+"""
+In-memory filter of recently committed telemetry rows.
+
+Redeliveries after a lost ack and devices that resend their buffered backlog repeat fixes that
+are already stored. The database skips them through the natural key (see
+DBManager.register_table_columns), but only after a round trip. RecentKeys remembers the natural
+keys of the last DEDUPE_KEYS_PER_DEVICE committed rows of every device, for the
+DEDUPE_MAX_DEVICES most recently active devices, and drops rows repeating one of them, or an
+earlier row of the same message, before they are buffered.
+
+Keys are only remembered once their rows are committed, so a row of a failed batch is never
+mistaken for a duplicate when it is redelivered. Dropped rows are counted in
+amqp_consumer_duplicates_total with stage="memory".
+"""
+
+import collections
+import threading
+from config import Config
+from db.db_manager import DBManager
+from metrics import DUPLICATES
+
+
+class RecentKeys:
+    """Bounded per-device rings of the natural keys of committed rows. Thread-safe."""
+    def __init__(self, keys_per_device=None, max_devices=None):
+        self.keys_per_device = keys_per_device or Config.DEDUPE_KEYS_PER_DEVICE
+        self.max_devices = max_devices or Config.DEDUPE_MAX_DEVICES
+        # (table, device_id) -> (ring of keys in commit order, the same keys as a set)
+        self._devices = collections.OrderedDict()
+        self._readers = {}
+        self._lock = threading.Lock()
+
+    def _reader(self, table_name):
+        """(device index, other key indexes) in the table's row tuples, or None without a natural key."""
+        if table_name not in self._readers:
+            natural_key = DBManager._natural_keys.get(table_name)
+            columns = DBManager._table_columns.get(table_name)
+            if natural_key is None or columns is None or "device_id" not in natural_key:
+                self._readers[table_name] = None
+            else:
+                self._readers[table_name] = (
+                    columns.index("device_id"),
+                    tuple(columns.index(column) for column in natural_key if column != "device_id"),
+                )
+        return self._readers[table_name]
+
+    def filter(self, table_name, rows):
+        """Return the rows that neither repeat a committed key nor an earlier row in rows."""
+        reader = self._reader(table_name)
+        if reader is None or not rows or isinstance(rows[0], dict):
+            return rows
+        device_index, key_indexes = reader
+        fresh = []
+        batch_keys = set()
+        with self._lock:
+            for row in rows:
+                key = tuple(row[index] for index in key_indexes)
+                entry = self._devices.get((table_name, row[device_index]))
+                if (entry is not None and key in entry[1]) or (row[device_index], key) in batch_keys:
+                    continue
+                batch_keys.add((row[device_index], key))
+                fresh.append(row)
+        if len(fresh) < len(rows):
+            DUPLICATES.inc(table_name, "memory", amount=len(rows) - len(fresh))
+        return fresh
+
+    def add(self, batches):
+        """Remember the keys of committed rows, a dict mapping table name to row tuples."""
+        with self._lock:
+            for table_name, rows in batches.items():
+                reader = self._reader(table_name)
+                if reader is None or not rows or isinstance(rows[0], dict):
+                    continue
+                device_index, key_indexes = reader
+                for row in rows:
+                    device = (table_name, row[device_index])
+                    entry = self._devices.get(device)
+                    if entry is None:
+                        entry = self._devices[device] = (collections.deque(), set())
+                        if len(self._devices) > self.max_devices:
+                            self._devices.popitem(last=False)
+                    else:
+                        self._devices.move_to_end(device)
+                    ring, keys = entry
+                    key = tuple(row[index] for index in key_indexes)
+                    if key in keys:
+                        continue
+                    if len(ring) >= self.keys_per_device:
+                        keys.discard(ring.popleft())
+                    ring.append(key)
+                    keys.add(key)
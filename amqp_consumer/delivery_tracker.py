@@ -0,0 +1,47 @@
+import time
+from logger import setup_logger
+from metrics import ACKS, NACKS, STAGE_SECONDS
+
+logger = setup_logger(__name__)
+
+
+class DeliveryTracker:
+    """Tracks unsettled deliveries on one channel.
+
+    A group of deliveries is settled with a single multiple=True frame when no other unsettled
+    delivery on the channel has a lower tag; otherwise each delivery is settled on its own so
+    messages still being processed elsewhere are never acked by accident.
+    Must only be used from the thread that owns the channel.
+    """
+    def __init__(self, channel, queue_name=""):
+        self.channel = channel
+        self.queue_name = queue_name
+        self.pending = set()
+
+    def delivered(self, delivery_tag):
+        self.pending.add(delivery_tag)
+
+    def ack(self, delivery_tags):
+        if self._settle(delivery_tags, self.channel.basic_ack):
+            ACKS.inc(self.queue_name, amount=len(delivery_tags))
+
+    def nack(self, delivery_tags, requeue=True):
+        if self._settle(delivery_tags, self.channel.basic_nack, requeue=requeue):
+            NACKS.inc(self.queue_name, amount=len(delivery_tags))
+
+    def _settle(self, delivery_tags, settle, **kwargs):
+        if not self.channel.is_open:
+            logger.warning("Channel closed before %d deliveries could be settled, they will be redelivered", len(delivery_tags))
+            return False
+        started = time.perf_counter()
+        last = max(delivery_tags)
+        tags = set(delivery_tags)
+        if len(tags) > 1 and all(tag in tags for tag in self.pending if tag <= last):
+            settle(delivery_tag=last, multiple=True, **kwargs)
+            self.pending = {tag for tag in self.pending if tag > last}
+        else:
+            for tag in sorted(tags):
+                settle(delivery_tag=tag, **kwargs)
+            self.pending -= tags
+        STAGE_SECONDS.observe(time.perf_counter() - started, "ack")
+        return True
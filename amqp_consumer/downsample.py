@@ -0,0 +1,57 @@
+"""
+Downsampling of time series and tracks for the read service.
+
+Both functions return the sorted indices of the points to keep, so every column of a series can
+be thinned the same way, and always keep the first and last point.
+
+- lttb: Largest-Triangle-Three-Buckets. Splits the points into buckets and keeps, per bucket, the
+  point forming the largest triangle with the point kept in the previous bucket and the mean of the
+  next bucket. Keeps the visual shape of a line; x does not have to be time, so a track can be
+  thinned with x/y in metres.
+- min_max: keeps the lowest and highest point of every bucket, so spikes and dropouts survive.
+"""
+
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """Indices of at most threshold points chosen with Largest-Triangle-Three-Buckets."""
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    # threshold - 2 buckets between the fixed first and last point, each holds at least one point
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.intp)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[end:edges[bucket + 2]].mean()
+            next_y = y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Twice the triangle area, the constant factor does not change the argmax
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(area.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def min_max(x, y, threshold):
+    """Indices of at most threshold points, the minimum and maximum of y in threshold // 2 buckets."""
+    count = len(y)
+    if threshold >= count or threshold < 4:
+        return np.arange(count)
+    buckets = threshold // 2 - 1
+    # Bucket of every point except the first and last, which are always kept
+    bucket_of = (np.arange(count - 2) * buckets) // (count - 2)
+    order = np.lexsort((y[1:-1], bucket_of))
+    starts = np.searchsorted(bucket_of, np.arange(buckets))
+    ends = np.append(starts[1:], count - 2)
+    picked = np.concatenate(([0], order[starts] + 1, order[ends - 1] + 1, [count - 1]))
+    return np.unique(picked)
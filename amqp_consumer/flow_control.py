@@ -0,0 +1,149 @@
+"""
+Adaptive flow control for the telemetry queue of the blocking consumer.
+
+Every FLOW_CONTROL_INTERVAL seconds FlowController samples, on the connection thread:
+
+- the mean batch commit time since the last sample (the "db" stage of amqp_consumer_stage_seconds),
+- the mean wait for a pooled database connection (amqp_consumer_db_pool_wait_seconds),
+- the depth of gnss_data_queue, from a passive queue_declare.
+
+It then adjusts three limits with an AIMD policy: when the commit time or the pool wait exceeds
+its target, or the spool has taken over, every limit is multiplied by FLOW_DECREASE_FACTOR;
+when the database keeps up and more messages wait in the queue than are prefetched, every limit
+grows by its step. Otherwise the limits are left alone. The limits are:
+
+- prefetch: the basic_qos prefetch_count of the telemetry channel;
+- in_flight: deliveries on the worker threads or in the batch and not settled yet (only with
+  WORKER_THREADS > 0). It is enforced by the broker: the channel's prefetch_count is the lower
+  of prefetch and in_flight, so the connection thread never blocks on a full pool;
+- batch_rows: the BatchWriter's max_rows, kept at or below the prefetch window so a batch can
+  still fill up.
+
+Each limit stays within its FLOW_*_MIN and FLOW_*_MAX. The limits survive reconnects. Every
+decision is counted in amqp_consumer_flow_decisions_total, the limits and signals are exported as
+gauges, and changes are logged.
+"""
+
+from config import Config
+from logger import setup_logger
+from metrics import POOL_WAIT_SECONDS, STAGE_SECONDS, Counter, Gauge, register
+
+logger = setup_logger(__name__)
+
+FLOW_LIMITS = register(Gauge("amqp_consumer_flow_limit", "Current flow control limits: prefetch, in_flight and batch_rows", ("limit",)))
+FLOW_SIGNALS = register(Gauge("amqp_consumer_flow_signal", "Last flow control samples: commit_ms, pool_wait_ms and queue_depth", ("signal",)))
+FLOW_DECISIONS = register(Counter("amqp_consumer_flow_decisions_total", "Flow control decisions: increase, decrease and hold", ("decision",)))
+
+
+class _Mean:
+    """Mean of a histogram's observations since the previous call."""
+    def __init__(self, histogram, *labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+        self.total, self.count = histogram.totals(*labelvalues)
+
+    def __call__(self):
+        total, count = self.histogram.totals(*self.labelvalues)
+        mean = (total - self.total) / (count - self.count) if count > self.count else None
+        self.total, self.count = total, count
+        return mean
+
+
+class FlowController:
+    """AIMD controller for the prefetch, in-flight and batch size limits of one queue."""
+    def __init__(self, queue_name="gnss_data_queue", spool=None, interval=None):
+        self.queue_name = queue_name
+        self.spool = spool
+        self.interval = interval or Config.FLOW_CONTROL_INTERVAL
+        self.bounds = {
+            "prefetch": (Config.FLOW_PREFETCH_MIN, Config.FLOW_PREFETCH_MAX, Config.FLOW_PREFETCH_STEP),
+            "in_flight": (Config.FLOW_IN_FLIGHT_MIN, Config.FLOW_IN_FLIGHT_MAX, Config.FLOW_IN_FLIGHT_STEP),
+            "batch_rows": (Config.FLOW_BATCH_ROWS_MIN, Config.FLOW_BATCH_ROWS_MAX, Config.FLOW_BATCH_ROWS_STEP),
+        }
+        self.limits = self._bounded({
+            "prefetch": Config.BASIC_PREFETCH_COUNT,
+            "in_flight": Config.BASIC_PREFETCH_COUNT,
+            "batch_rows": Config.BATCH_MAX_ROWS,
+        })
+        self.commit_seconds = _Mean(STAGE_SECONDS, "db")
+        self.pool_wait_seconds = _Mean(POOL_WAIT_SECONDS, "sync")
+        self.connection = None
+        self.channel = None
+        self.batch_writer = None
+        # The in-flight limit only applies with worker threads, set by attach()
+        self.threaded = False
+        self._timer = None
+
+    def _bounded(self, limits):
+        limits = {name: min(max(int(value), self.bounds[name][0]), self.bounds[name][1]) for name, value in limits.items()}
+        limits["batch_rows"] = max(min(limits["batch_rows"], limits["prefetch"]), 1)
+        return limits
+
+    def attach(self, connection, channel, batch_writer=None, threaded=False):
+        """Apply the current limits to a freshly set up connection and start sampling on it."""
+        self.connection = connection
+        self.channel = channel
+        self.batch_writer = batch_writer
+        self.threaded = threaded
+        self.apply()
+        self._timer = connection.call_later(self.interval, self.tick)
+
+    def window(self):
+        """Unsettled deliveries the broker may hand out, the prefetch_count applied to the channel."""
+        if self.threaded:
+            return min(self.limits["prefetch"], self.limits["in_flight"])
+        return self.limits["prefetch"]
+
+    def apply(self):
+        window = self.window()
+        self.channel.basic_qos(prefetch_count=window)
+        if self.batch_writer is not None:
+            self.batch_writer.max_rows = max(min(self.limits["batch_rows"], window), 1)
+        for name, value in self.limits.items():
+            FLOW_LIMITS.set(value, name)
+
+    def tick(self):
+        """Sample, decide and apply; runs as a connection timer and reschedules itself."""
+        try:
+            signals = self.sample()
+            decision, limits = self.decide(signals)
+            FLOW_DECISIONS.inc(decision)
+            if limits != self.limits:
+                logger.info(
+                    "Flow control %s (commit %s ms, pool wait %s ms, queue depth %s): %s",
+                    decision, signals["commit_ms"], signals["pool_wait_ms"], signals["queue_depth"],
+                    ", ".join(f"{name} {self.limits[name]} -> {value}" for name, value in limits.items()),
+                )
+                self.limits = limits
+                self.apply()
+        except Exception as e:
+            logger.warning("Flow control sample failed, keeping the current limits: %s", e)
+        if self.connection is not None and self.connection.is_open:
+            self._timer = self.connection.call_later(self.interval, self.tick)
+
+    def sample(self):
+        commit_seconds = self.commit_seconds()
+        pool_wait_seconds = self.pool_wait_seconds()
+        frame = self.channel.queue_declare(queue=self.queue_name, passive=True)
+        signals = {
+            "commit_ms": round(commit_seconds * 1000, 1) if commit_seconds is not None else None,
+            "pool_wait_ms": round(pool_wait_seconds * 1000, 1) if pool_wait_seconds is not None else None,
+            "queue_depth": frame.method.message_count,
+        }
+        for name, value in signals.items():
+            if value is not None:
+                FLOW_SIGNALS.set(value, name)
+        return signals
+
+    def decide(self, signals):
+        """Return the decision and the new limits for the sampled signals."""
+        congested = (
+            (signals["commit_ms"] is not None and signals["commit_ms"] > Config.FLOW_TARGET_COMMIT_MS)
+            or (signals["pool_wait_ms"] is not None and signals["pool_wait_ms"] > Config.FLOW_TARGET_POOL_WAIT_MS)
+            or (self.spool is not None and self.spool.diverting)
+        )
+        if congested:
+            return "decrease", self._bounded({name: value * Config.FLOW_DECREASE_FACTOR for name, value in self.limits.items()})
+        if signals["queue_depth"] > self.window():
+            return "increase", self._bounded({name: value + self.bounds[name][2] for name, value in self.limits.items()})
+        return "hold", self.limits
@@ -0,0 +1,69 @@
+"""
+Embedded HTTP server for the docker-compose health check and Prometheus scrapes.
+
+GET /health runs the given health check and answers 200 with its JSON result when it reports
+"ok", 503 otherwise. GET /metrics returns metrics.render(). The server runs on a daemon
+thread and never touches the consumer's connection or channels itself.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import metrics
+from config import Config
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Set on the subclass created per server
+    health_check = None
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/health":
+            try:
+                result = self.health_check()
+            except Exception as e:
+                logger.error("Health check failed: %s", e)
+                result = {"ok": False, "error": str(e)}
+            self._reply(200 if result.get("ok") else 503, "application/json", json.dumps(result))
+        elif path == "/metrics":
+            self._reply(200, "text/plain; version=0.0.4; charset=utf-8", metrics.render())
+        else:
+            self._reply(404, "text/plain", "Not found\n")
+
+    def _reply(self, status, content_type, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes and health checks arrive every few seconds, keep them out of the consumer log
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def start_health_server(health_check, port=None, host=None):
+    """Serve /health and /metrics on a daemon thread.
+
+    Parameters:
+    - health_check: Callable returning a dict with a boolean "ok" key plus any details.
+    - port: Port to listen on, defaults to Config.HTTP_PORT. 0 disables the server.
+    - host: Address to bind, defaults to Config.HTTP_HOST.
+
+    Returns the server, or None if it is disabled.
+    """
+    port = Config.HTTP_PORT if port is None else port
+    if not port:
+        return None
+    handler = type("HealthHandler", (_Handler,), {"health_check": staticmethod(health_check)})
+    server = ThreadingHTTPServer((host or Config.HTTP_HOST, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="health-server", daemon=True)
+    thread.start()
+    logger.info("Serving /health and /metrics on port %d", port)
+    return server
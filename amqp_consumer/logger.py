@@ -1,26 +1,118 @@
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 
+# Central log level, every module logger follows it unless a level is passed explicitly
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# At most LOG_RATE_LIMIT_BURST records with the same logger, level and message template are
+# written per LOG_RATE_LIMIT_INTERVAL seconds, the rest are counted and reported with the next one
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "10"))
+LOG_RATE_LIMIT_INTERVAL = float(os.getenv("LOG_RATE_LIMIT_INTERVAL", "10"))
+
+_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_lock = threading.Lock()
+_queue = None
+_listener = None
+_handlers = []
+_hooks_registered = False
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops repeats of the same log call beyond a burst per interval, e.g. one validation error per bad fix."""
+    def __init__(self, burst=LOG_RATE_LIMIT_BURST, interval=LOG_RATE_LIMIT_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.CRITICAL or self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window is not None else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f"{record.msg} (suppressed {suppressed} similar messages)"
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Queues the record as is, so formatting and the stderr write both happen on the listener thread."""
+    def prepare(self, record):
+        return record
 
-def setup_logger(name, level=logging.INFO):
-    """Sets up a logger for a given module."""
-    # Create a logger
-    logger = logging.getLogger(name)
-    logger.setLevel(level)  # Set the logging level
 
-    # Create console handler and set level to debug
-    ch = logging.StreamHandler()
-    ch.setLevel(level)
+def _start_listener():
+    global _queue, _listener
+    _queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(_FORMAT))
+    _listener = QueueListener(_queue, console)
+    _listener.start()
+    for handler in _handlers:
+        handler.queue = _queue
 
-    # Create formatter
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
 
-    # Add formatter to ch
-    ch.setFormatter(formatter)
+def stop_logging():
+    """Write out the queued records and stop the listener thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork, consumer processes need their own
+    global _listener, _lock
+    _lock = threading.Lock()
+    _listener = None
+    if _handlers:
+        _start_listener()
+
+
+def _handler():
+    global _hooks_registered
+    with _lock:
+        if _listener is None:
+            _start_listener()
+        # The listener is started again after stop_logging, the hooks are registered once per process
+        if not _hooks_registered:
+            atexit.register(stop_logging)
+            os.register_at_fork(after_in_child=_restart_after_fork)
+            _hooks_registered = True
+        handler = _DeferredQueueHandler(_queue)
+        handler.addFilter(RateLimitFilter())
+        _handlers.append(handler)
+        return handler
+
+
+def setup_logger(name, level=None):
+    """Sets up a logger for a given module.
+
+    Records are handed to a queue and written to stderr by a background listener thread.
+    The level defaults to the central LOG_LEVEL.
+    """
+    # Create a logger
+    logger = logging.getLogger(name)
+    logger.setLevel(level or LOG_LEVEL)  # Set the logging level
 
-    # Add ch to logger
+    # Add the queue handler once per logger
     if not logger.handlers:
-        logger.addHandler(ch)
+        logger.addHandler(_handler())
+        logger.propagate = False
 
     return logger
@@ -1,41 +1,96 @@
 from db.db_manager import DBManager
 from rabbit_consumer import RabbitConsumer
+from async_consumer import AsyncRabbitConsumer
+from config import Config
+from supervisor import ConsumerSupervisor, start_heartbeat
+from health_server import start_health_server
+from spool import Spool, SpoolReplayer
+from accuracy_stats import AccuracyReporter, AccuracyStats
+from profiler import Profiler
 import os
 from logger import setup_logger
 from message_processors.processor_factory import get_processor
 
 # Setup logger for this module
-logger = setup_logger(__name__, os.environ.get("LOG_LEVEL", "DEBUG"))
+logger = setup_logger(__name__)
 
-def start_consumer_in_thread():
-    logger.debug("Starting consumer in a separate thread")
-    try:
-        # Use the wrapper function instead of a lambda for clarity
-        rabbit_consumer = RabbitConsumer(get_processor)
-        logger.debug("RabbitConsumer instance created")
-        rabbit_consumer.setup_connection()  # Ensure connection is set up
-        logger.info("RabbitMQ connection setup complete")
-        rabbit_consumer.start_consuming()
-    except Exception as e:
-        logger.error("Exception in consumer thread: %s", e)
-        raise
+def consumer_health(consumer):
+    """Health of a consumer process for the /health endpoint.
 
-def main():
-    logger.info("Application started")
-    try:
+    While the database is down the consumer stays healthy as long as its spool takes the batches.
+    """
+    broker_connected = consumer.is_healthy()
+    database_usable = DBManager.check_connection()
+    health = {
+        "ok": broker_connected and database_usable,
+        "broker_connected": broker_connected,
+        "database_usable": database_usable,
+        "db_pool": DBManager.pool_stats(),
+    }
+    if consumer.spool is not None:
+        health["ok"] = broker_connected and (database_usable or not consumer.spool.is_full())
+        health["spool_bytes"] = consumer.spool.bytes
+        health["spool_segments"] = consumer.spool.segments
+    return health
+
+def open_spool(index=None):
+    """Open this process's spool and start replaying it, or return None if spooling is disabled."""
+    if not Config.SPOOL_ENABLED:
+        return None
+    spool = Spool(os.path.join(Config.SPOOL_DIR, f"consumer-{index or 0}"))
+    SpoolReplayer(spool).start()
+    return spool
+
+def open_accuracy_stats():
+    """Start summarizing accuracy per experiment and device, or return None if it is disabled."""
+    if not Config.ACCURACY_STATS_ENABLED:
+        return None
+    accuracy = AccuracyStats()
+    AccuracyReporter(accuracy).start()
+    return accuracy
+
+def run_consumer(heartbeat=None, index=None):
+    """Run one consumer in this process until it stops; errors propagate to the caller.
+
+    Parameters:
+    - heartbeat: Shared value the consumer's health is reported to when running under the supervisor.
+    - index: The consumer's slot under the supervisor, which serves HTTP_PORT itself, so the
+      consumer serves /health and /metrics on HTTP_PORT + 1 + index.
+    """
+    Profiler().install()
+    # A restarted consumer takes over the spool of the process it replaces
+    spool = open_spool(index)
+    accuracy = open_accuracy_stats()
+    if Config.CONSUMER_ENGINE == "asyncio":
+        consumer = AsyncRabbitConsumer(get_processor, spool=spool, accuracy=accuracy)
+    else:
         DBManager.initialize_connection_pool()
         logger.debug("Database connection pool initialized")
-    except Exception as e:
-        logger.error("Failed to initialize database connection pool: %s", e)
+        consumer = RabbitConsumer(get_processor, spool=spool, accuracy=accuracy)
+    if heartbeat is not None:
+        start_heartbeat(consumer, heartbeat)
+    if Config.HTTP_PORT:
+        start_health_server(
+            lambda: consumer_health(consumer),
+            port=Config.HTTP_PORT if index is None else Config.HTTP_PORT + 1 + index,
+        )
+    if Config.CONSUMER_ENGINE == "asyncio":
+        consumer.run()
+    else:
+        consumer.start_consuming()
+
+def main():
+    logger.info("Application started")
+    if Config.CONSUMER_PROCESSES > 1:
+        supervisor = ConsumerSupervisor(run_consumer)
+        start_health_server(supervisor.health)
+        supervisor.run()
         return
 
     try:
-        rabbit_consumer = RabbitConsumer(get_processor)
-        rabbit_consumer.setup_connection()  # Ensure connection is set up
-        rabbit_consumer.start_consuming()
-
+        run_consumer()
     except Exception as e:
-        logger.error("Failed to start consumer thread: %s", e)
+        logger.error("Consumer stopped: %s", e)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
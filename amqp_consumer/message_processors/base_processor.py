@@ -1,6 +1,21 @@
 class BaseProcessor:
-    def __init__(self, data):
-        self.data = data
+    """Stateless message handler, a single registered instance handles every message of its type."""
+    __slots__ = ()
+    # Telemetry processors set the target table and its RowSchema so rows can be batched
+    table_name = None
+    schema = None
 
-    def process(self):
+    def process(self, data):
         raise NotImplementedError("Each processor needs a specific implementation of process()")
+
+    def encode_row(self, data):
+        """Encode the message as a tuple in the table's column order, or None if it is invalid."""
+        return self.schema.encode(data)
+
+    def decode(self, body, headers):
+        """Decode a binary message body into rows in the table's column order.
+
+        Only processors registered with a content_type implement it. Raises ValueError for bodies
+        that cannot be decoded.
+        """
+        raise NotImplementedError("Only processors registered with a content_type decode binary messages")
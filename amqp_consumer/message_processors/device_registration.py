@@ -6,12 +6,16 @@ If the device is not registered, it will be added to the database. If the device
 from logger import setup_logger
 from db.db_manager import DBManager 
 from message_processors.base_processor import BaseProcessor
+from message_processors.registry import register_processor
+from message_processors.registration_cache import registration_cache
 from psycopg2 import DatabaseError
 import json
 
-logger = setup_logger(__name__, level="INFO")
+logger = setup_logger(__name__)
 
 class Hardware:
+    __slots__ = ("alias", "region", "location_desc", "owner_name", "make", "model", "signals", "configuration", "hardware_id", "attributes")
+
     def __init__(self) -> None:
         self.alias = None
         self.region = None
@@ -32,27 +36,45 @@ class Hardware:
             if hasattr(self, key):
                 setattr(self, key, message_data[key])
 
+    def fingerprint(self) -> tuple:
+        """Fields that end up in the hardware and experiment_devices tables, in a comparable form."""
+        return (
+            self.region, self.location_desc, self.owner_name, self.make, self.model, self.signals,
+            json.dumps(self.configuration, sort_keys=True, default=str),
+            self.attributes.get("experiment_id"),
+        )
+
+@register_processor("device_registration")
 class DeviceRegistrationProcessor(BaseProcessor):
-    def __init__(self, message_data: dict) -> None:
-        self.message_data = message_data
-        self.hardware = Hardware()
-        self.hardware_id = None
-        
+    __slots__ = ()
+
+    def process(self, message_data: dict) -> None:
+        logger.debug("Processing device registration message: %s", message_data)
+        hardware = Hardware()
+        hardware.update_from_message_data(message_data)
 
-    def process(self) -> None:
-        logger.info("Processing device registration message: %s", self.message_data)
-        self.hardware.update_from_message_data(self.message_data)
+        fingerprint = hardware.fingerprint()
+        cached_id = registration_cache.get(hardware.alias, fingerprint)
+        if cached_id is not None:
+            # Unchanged re-registration, e.g. after a reboot, nothing to write
+            logger.debug("Device %s unchanged, answering from cache with ID: %s", hardware.alias, cached_id)
+            return json.dumps(cached_id)
 
-        logger.info("Updated device registration message: %s", self.message_data)
-        self.hardware_id = self.create_or_update_device(self.hardware)
-        if self.hardware.attributes.get("experiment_id"):
-            logger.info("Updating experiment_devices table with experiment_id: %s and device_id: %s", self.hardware.attributes.get("experiment_id"), self.hardware_id)
-            self.update_experiment_devices_table(experiment_id=self.hardware.attributes.get("experiment_id"), device_id=self.hardware_id)            
-        else:
-            logger.error("Device could not be processed.")
-        if self.hardware_id:
-            logger.info("Device processed with ID: %s", self.hardware_id)
-            return json.dumps(self.hardware_id)
+        # The device and its experiment link are committed together
+        with DBManager.transaction():
+            hardware.hardware_id = self.create_or_update_device(hardware)
+            if hardware.attributes.get("experiment_id"):
+                logger.debug("Updating experiment_devices table with experiment_id: %s and device_id: %s", hardware.attributes.get("experiment_id"), hardware.hardware_id)
+                linked = self.update_experiment_devices_table(experiment_id=hardware.attributes.get("experiment_id"), device_id=hardware.hardware_id)
+            else:
+                linked = False
+                logger.error("Device could not be processed.")
+        if linked:
+            # Only cached once committed
+            registration_cache.put(hardware.alias, hardware.hardware_id, fingerprint)
+        if hardware.hardware_id:
+            logger.info("Device processed with ID: %s", hardware.hardware_id)
+            return json.dumps(hardware.hardware_id)
 
     def get_hardware_id_from_alias(self, device_alias: str) -> int:
         query = """
@@ -70,7 +92,7 @@ class DeviceRegistrationProcessor(BaseProcessor):
             logger.error("Failed to get device: %s", e)
             return None
         
-    def insert_hardware(self):
+    def insert_hardware(self, hardware):
         query = """
         INSERT INTO hardware (alias, region, location_desc, owner_name, make, model, signals, configuration)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
@@ -78,7 +100,7 @@ class DeviceRegistrationProcessor(BaseProcessor):
         """
         try:
             with DBManager.get_db_cursor(commit=True) as cur:
-                cur.execute(query, (self.hardware.alias, self.hardware.region, self.hardware.location_desc, self.hardware.owner_name, self.hardware.make, self.hardware.model, self.hardware.signals, self.hardware.configuration))
+                cur.execute(query, (hardware.alias, hardware.region, hardware.location_desc, hardware.owner_name, hardware.make, hardware.model, hardware.signals, hardware.configuration))
                 result = cur.fetchone()
                 if result:
                     return result[0]
@@ -0,0 +1,79 @@
+"""
+Batch envelopes: many telemetry fixes in one AMQP delivery.
+
+Loggers that buffer a few seconds of fixes send them as one message instead of one message per
+fix. The fields every fix shares (message_type, device_id, experiment_id, ...) are sent once, in a
+header, and the fixes carry only their own fields:
+
+    {"message_type": "NAV-PVT", "device_id": 7, "experiment_id": 2, "fixes": [{...}, {...}]}
+
+or, with content type application/x-ndjson, the header on the first line and one fix per line:
+
+    {"message_type": "NAV-PVT", "device_id": 7, "experiment_id": 2}
+    {...}
+    {...}
+
+An NDJSON body is decoded with a single json.loads by joining its lines into an array. Every fix is
+encoded with the header fields filled in, a field in the fix overrides the header. The rows of an
+envelope are stored like a single message's row: buffered together in one batch, or written in one
+INSERT, and the delivery is acked once they are committed.
+
+Fixes rejected by the validator or holding unconvertible values are dropped and counted, so one bad fix does not dead-letter the
+whole envelope; an envelope without any valid fix is a permanent failure.
+"""
+
+import json
+from logger import setup_logger
+from metrics import Counter, register
+
+logger = setup_logger(__name__)
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+FIXES = "fixes"
+
+REJECTED_FIXES = register(Counter(
+    "amqp_consumer_rejected_fixes_total",
+    "Fixes of batch envelopes dropped by their validator",
+    ("queue", "message_type"),
+))
+
+
+def loads(body, content_type=None):
+    """Decode a JSON message body, or an NDJSON envelope into the equivalent JSON envelope."""
+    if content_type != NDJSON_CONTENT_TYPE:
+        return json.loads(body)
+    lines = [line for line in body.splitlines() if line.strip()]
+    if not lines:
+        raise ValueError("Empty NDJSON envelope")
+    records = json.loads(b"[" + b",".join(lines) + b"]")
+    header = records[0]
+    if not isinstance(header, dict):
+        raise ValueError("The first line of an NDJSON envelope must be its header object")
+    header[FIXES] = records[1:]
+    return header
+
+
+def is_envelope(message_data):
+    return isinstance(message_data.get(FIXES), list)
+
+
+def encode_fixes(processor, message_data, queue_name):
+    """Encode the fixes of an envelope into row tuples for processor's table, skipping invalid ones."""
+    if not processor.table_name:
+        raise ValueError(f"{message_data.get('message_type')} messages cannot be sent in a batch envelope")
+    shared = {key: value for key, value in message_data.items() if key != FIXES}
+    encode = processor.encode_row
+    rows = []
+    for fix in message_data[FIXES]:
+        try:
+            row = encode({**shared, **fix})
+        except (TypeError, ValueError) as e:
+            logger.debug("Invalid fix %s: %s", fix, e)
+            continue
+        if row:
+            rows.append(row)
+    rejected = len(message_data[FIXES]) - len(rows)
+    if rejected:
+        REJECTED_FIXES.inc(queue_name, message_data.get("message_type"), amount=rejected)
+        logger.warning("Dropped %d of %d fixes of a %s envelope", rejected, len(message_data[FIXES]), message_data.get("message_type"))
+    return rows
@@ -3,16 +3,19 @@ This module is not needed at this time. The Experiments are going to be put into
 """
 
 
-from datetime import datetime
+from datetime import datetime, timezone
 import json
 from logger import setup_logger
 from psycopg2 import DatabaseError
 from message_processors.base_processor import BaseProcessor
+from message_processors.registry import register_processor
 from db.db_manager import DBManager
 
-logger = setup_logger(__name__, level="INFO")
+logger = setup_logger(__name__)
 
 class Experiment:
+    __slots__ = ("alias", "configuration", "description", "end_time", "experiment_id", "experiment_type", "region", "start_time")
+
     def __init__(self) -> None:
         self.alias = None
         self.configuration = None
@@ -31,7 +34,7 @@ class Experiment:
         self.experiment_id = None
         self.experiment_type = 'unknown'
         self.region = None
-        self.start_time = datetime.now('UTC')
+        self.start_time = datetime.now(timezone.utc)
 
     def update_from_message_data(self, message_data: dict) -> None:
         self.alias = message_data.get('alias', self.alias)
@@ -42,16 +45,16 @@ class Experiment:
         self.region = message_data.get('region', self.region)
         self.start_time = message_data.get('start_time', self.start_time)
 
+@register_processor("experiment_registration")
 class ExperimentRegistrationProcessor(BaseProcessor):
-    def __init__(self, message_data: dict) -> None:
-        self.message_data = message_data
-        self.experiment = Experiment()
-        self.experiment._set_default_attributes()
-        self.experiment = self.experiment.update_from_message_data(message_data)
-        logger.info("Processing experiment registration message: %s", message_data)
+    __slots__ = ()
 
-    def process(self) -> int:
-        experiment_id = self.create_experiment_if_not_exists()
+    def process(self, message_data: dict) -> int:
+        logger.debug("Processing experiment registration message: %s", message_data)
+        experiment = Experiment()
+        experiment._set_default_attributes()
+        experiment.update_from_message_data(message_data)
+        experiment_id = self.create_experiment_if_not_exists(experiment)
         return experiment_id
 
     def get_experiment_by_id(self, experiment_id: int) -> Experiment:
@@ -73,18 +76,19 @@ class ExperimentRegistrationProcessor(BaseProcessor):
             return None
         
 
-    def create_experiment_if_not_exists(self):
+    def create_experiment_if_not_exists(self, experiment: Experiment):
         """
         Inserts a new experiment into the experiments table if an experiment with the same alias does not already exist.
         
         Parameters:
-        - alias (str): The unique alias for the experiment.
-        - start_time (datetime): The start time of the experiment.
-        - end_time (datetime): The end time of the experiment. Can be None.
-        - description (str): The description of the experiment.
-        - configuration (jsonb): The JSON configuration of the experiment.
-        - region (str): The region where the experiment is conducted.
-        - experiment_type (str): The type of the experiment ('Static', 'Dynamic', 'Hybrid').
+        - experiment (Experiment): The experiment to create, carrying:
+            - alias (str): The unique alias for the experiment.
+            - start_time (datetime): The start time of the experiment.
+            - end_time (datetime): The end time of the experiment. Can be None.
+            - description (str): The description of the experiment.
+            - configuration (jsonb): The JSON configuration of the experiment.
+            - region (str): The region where the experiment is conducted.
+            - experiment_type (str): The type of the experiment ('Static', 'Dynamic', 'Hybrid').
         
         Returns:
         - experiment_id (int): The ID of the created experiment on success, or None if the experiment already exists or on failure.
@@ -100,11 +104,11 @@ class ExperimentRegistrationProcessor(BaseProcessor):
             UNION ALL
             SELECT id FROM experiments WHERE alias = %s AND NOT EXISTS (SELECT 1 FROM upsert);
         """
-        logger.info("Creating experiment with alias: %s", self.experiment.alias)
+        logger.info("Creating experiment with alias: %s", experiment.alias)
         try:
             with DBManager.get_db_cursor(commit=True) as cur:
                 # Execute the query with parameters for the SELECT and the NOT EXISTS check, including the alias
-                cur.execute(query, (self.experiment.alias, self.experiment.start_time, self.experiment.end_time, self.experiment.description, json.dumps(self.experiment.configuration), self.experiment.region, self.experiment.experiment_type, self.experiment.alias))
+                cur.execute(query, (experiment.alias, experiment.start_time, experiment.end_time, experiment.description, json.dumps(experiment.configuration), experiment.region, experiment.experiment_type, experiment.alias))
                 result = cur.fetchone()
                 if result:
                     experiment_id = result[0]
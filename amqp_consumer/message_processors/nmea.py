@@ -0,0 +1,110 @@
+"""
+Reader for NMEA 0183 logs, turning GGA sentences into GNGGA messages.
+
+A GGA sentence only carries the time of day, so the reader takes the date from the RMC sentences
+of the log, or from the date it was started with, and moves it to the next day when the time of
+day wraps around midnight between two GGA sentences without an RMC in between. Sentences with a
+wrong checksum are rejected, other sentence types are ignored. Any talker (GP, GN, GL, ...) is
+accepted, the messages go to the gngga table like those the devices publish.
+
+The messages hold the same fields as the JSON GNGGA messages: lat and lon in unsigned decimal
+degrees with their ns/ew hemisphere, quality, num_sv and diff_age as integers and the other
+fields as sent. Empty fields are left out, so the row schema's defaults apply.
+"""
+
+from datetime import date, datetime, time, timedelta
+
+# Integer columns of gngga, diff_age is sent with decimals
+INTEGER_FIELDS = ("quality", "num_sv", "diff_age")
+GGA_FIELDS = (
+    "full_time", "lat", "ns", "lon", "ew", "quality", "num_sv", "hdop", "alt", "alt_unit", "sep",
+    "sep_unit", "diff_age", "diff_station",
+)
+
+
+class NMEAError(ValueError):
+    """Raised for sentences that are not well-formed NMEA."""
+
+
+def split_sentence(line):
+    """Return the fields of a sentence, after checking its checksum if it has one."""
+    line = line.strip()
+    if not line.startswith(b"$"):
+        raise NMEAError("NMEA sentences start with $")
+    body, star, checksum = line[1:].partition(b"*")
+    if star:
+        expected = 0
+        for byte in body:
+            expected ^= byte
+        try:
+            sent = int(checksum[:2], 16)
+        except ValueError:
+            raise NMEAError(f"Invalid NMEA checksum {checksum!r}")
+        if sent != expected:
+            raise NMEAError("NMEA checksum mismatch")
+    return body.decode("ascii", "replace").split(",")
+
+
+def _degrees(value):
+    # ddmm.mmmm or dddmm.mmmm
+    point = value.find(".")
+    if point == -1:
+        point = len(value)
+    return float(value[:point - 2] or 0) + float(value[point - 2:]) / 60
+
+
+def _time_of_day(value):
+    hours, minutes, seconds = int(value[0:2]), int(value[2:4]), float(value[4:])
+    return time(hours, minutes, int(seconds), int(round((seconds % 1) * 1e6)) % 1000000)
+
+
+class NMEAReader:
+    """Stateful reader of one log, or of one chunk of it that starts at an RMC sentence.
+
+    Parameters:
+    - start_date: Date of the GGA sentences before the first RMC sentence, None rejects them.
+    - fields: Fields added to every message, such as device_id and experiment_id.
+    """
+    def __init__(self, start_date=None, fields=None):
+        self.date = start_date
+        self.fields = fields or {}
+        self._last_time = None
+
+    def read(self, line):
+        """Return the GNGGA message of a GGA sentence, or None for other sentences.
+
+        Raises ValueError for malformed sentences and for GGA sentences without a known date.
+        """
+        fields = split_sentence(line)
+        kind = fields[0][2:]
+        if kind == "RMC":
+            if len(fields) > 9 and len(fields[9]) == 6:
+                day, month, year = int(fields[9][0:2]), int(fields[9][2:4]), int(fields[9][4:6])
+                self.date = date(2000 + year, month, day)
+                # A GGA sentence after midnight that precedes its RMC sentence is moved to the next day
+                self._last_time = _time_of_day(fields[1]) if fields[1] else None
+            return None
+        if kind != "GGA":
+            return None
+        if len(fields) < 15:
+            raise NMEAError(f"GGA sentence with {len(fields)} fields, expected 15")
+        if self.date is None:
+            raise NMEAError("GGA sentence before the first RMC sentence and no date given")
+        time_of_day = _time_of_day(fields[1])
+        if self._last_time is not None and time_of_day < self._last_time and self._last_time.hour >= 12 > time_of_day.hour:
+            self.date += timedelta(days=1)
+        self._last_time = time_of_day
+        full_time = datetime.combine(self.date, time_of_day)
+        message = {"message_type": "GNGGA", **self.fields}
+        message["full_time"] = full_time.isoformat(timespec="microseconds") + "Z"
+        for name, value in zip(GGA_FIELDS[1:], fields[2:15]):
+            if value:
+                message[name] = value
+        if "lat" in message:
+            message["lat"] = _degrees(message["lat"])
+        if "lon" in message:
+            message["lon"] = _degrees(message["lon"])
+        for name in INTEGER_FIELDS:
+            if name in message:
+                message[name] = int(float(message[name]))
+        return message
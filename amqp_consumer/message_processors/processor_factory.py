@@ -1,26 +1,32 @@
-from message_processors.gngga_processor import GNGGAProcessor
-from message_processors.device_registration import DeviceRegistrationProcessor
-from message_processors.experiment_registration import ExperimentRegistrationProcessor
-from message_processors.pvt_processor import NavPVTProcessor
+import importlib
+import os
+import pkgutil
+from message_processors.registry import lookup, lookup_content_type, registered_types
 from logger import setup_logger
 
-logger = setup_logger(__name__, level="INFO")
+logger = setup_logger(__name__)
+
+
+def _load_processors():
+    """Import every module of this package so their processors register themselves."""
+    for module in pkgutil.iter_modules([os.path.dirname(os.path.abspath(__file__))]):
+        importlib.import_module(f"message_processors.{module.name}")
+    logger.debug("Registered processors for message types: %s", registered_types())
+
+
+_load_processors()
 
 
 def get_processor(message_data: dict):
-    logger.debug("Creating processor for message: %s", message_data)
-    if message_data.get("message_type") == "GNGGA":
-        message_data.pop("message_type")
-        return GNGGAProcessor(message_data)
-    elif message_data.get("message_type") == "device_registration":
-        message_data.pop("message_type")
-        logger.info("Creating DeviceRegistrationProcessor with data: %s", message_data)
-        return DeviceRegistrationProcessor(message_data)
-    elif message_data.get("message_type") == "experiment_registration":
-        message_data.pop("message_type")
-        return ExperimentRegistrationProcessor(message_data)
-    elif message_data.get("message_type") == "NAV-PVT":
-        return NavPVTProcessor(message_data)
-    else:
+    """Return the stateless processor for the message's message_type."""
+    processor = lookup(message_data.get("message_type"))
+    if processor is None:
         raise ValueError(f"Unsupported message type: {message_data.get('message_type')}")
+    return processor
+
 
+def get_binary_processor(content_type):
+    """Return (message_type, processor) for messages of a binary content type, or None for JSON."""
+    if not content_type:
+        return None
+    return lookup_content_type(content_type)
@@ -1,18 +1,25 @@
 from typing import Dict, Optional
 from message_processors.base_processor import BaseProcessor
+from message_processors.registry import register_processor
+from message_processors.row_schema import NAV_PVT_SCHEMA
+from message_processors import ubx
 from db.db_manager import DBManager
 from logger import setup_logger
 
-logger = setup_logger("nav_pvt_processor", level="DEBUG")
+logger = setup_logger("nav_pvt_processor")
 
 
+@register_processor("NAV-PVT", content_type=ubx.CONTENT_TYPE)
 class NavPVTProcessor(BaseProcessor):
-    def process(self):
-        self.data = self.validate(self.data)
-        logger.debug("Validated data: %s", self.data)
-        if self.data:
-            table_name = "nav_pvt"
-            DBManager.insert_into_db(table_name=table_name, data=self.data)
+    __slots__ = ()
+    table_name = "nav_pvt"
+    schema = NAV_PVT_SCHEMA
+
+    def process(self, data):
+        data = self.validate(data)
+        logger.debug("Validated data: %s", data)
+        if data:
+            DBManager.insert_into_db(table_name=self.table_name, data=data)
 
     def validate(self, data: Dict) -> Optional[Dict]:
         """
@@ -23,62 +30,20 @@ class NavPVTProcessor(BaseProcessor):
 
         Returns:
         - Dict with validated and possibly corrected data suitable for SQL insertion, or None if data is invalid.
+          Keys that are not columns of the nav_pvt table, such as message_type, are dropped.
         """
-        # Default values for fields that can be empty or need conversion
-        defaults = {
-            "lat": None,
-            "lon": None,
-            "height": 0.0,
-            "hMSL": 0.0,
-            "hAcc": 0.0,
-            "vAcc": 0.0,
-            "velN": 0.0,
-            "velE": 0.0,
-            "velD": 0.0,
-            "gSpeed": 0.0,
-            "headMot": 0.0,
-            "sAcc": 0.0,
-            "headAcc": 0.0,
-            "pDOP": 0.0,
-            "numSV": 0,
-            "tAcc": 0,
-            "validDate": 0,  # Boolean, will be cast to int
-            "validTime": 0,  # Boolean, will be cast to int
-            "gnssFixOk": 0,  # Boolean, will be cast to int
-            "fixType": "",
-            "year": 2024,
-            "month": 1,
-            "day": 1,
-            "hour": 0,
-            "min": 0,
-            "second": 0,
-        }
-
-        # Remove message_type as it's not part of the table schema
-        data.pop("message_type", None)
-
-        # Validate and correct data
-        for key, default in defaults.items():
-            if not data.get(key) or data[key] == "":
-                data[key] = default
-            elif key in ["lat", "lon", "height", "hMSL", "hAcc", "vAcc", "velN", "velE", "velD", "gSpeed", "headMot", "sAcc", "headAcc", "pDOP"]:
-                try:
-                    data[key] = float(data[key])
-                except ValueError:
-                    logger.error("Invalid value for %s, setting to default %s.", key, default)
-                    data[key] = default
-            elif key in ["validDate", "validTime", "gnssFixOk"]:
-                # Cast boolean values to integer (True to 1, False to 0)
-                data[key] = int(bool(data[key]))
+        row = self.schema.encode(data)
+        return self.schema.to_dict(row) if row is not None else None
 
-        # Ensure mandatory fields like 'full_time', 'device_id', and 'experiment_id' are valid
-        if not data.get("full_time") or not data.get("device_id") or not data.get("experiment_id"):
-            logger.error("Missing mandatory field 'full_time', 'device_id', or 'experiment_id'.")
-            return None
+    def decode(self, body, headers):
+        """Decode raw UBX NAV-PVT frames into nav_pvt rows.
 
-        # Optionally, convert 'full_time' to a timestamp format if it's not already
-        # This step depends on how 'full_time' is represented in your incoming data
-        # and how you want it formatted in your database.
-        # Example conversion could be added here if necessary.
-
-        return data
\ No newline at end of file
+        The frames carry no device or experiment, so both are read from the message headers.
+        """
+        headers = headers or {}
+        try:
+            device_id = int(headers["device_id"])
+            experiment_id = int(headers["experiment_id"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("UBX messages need integer device_id and experiment_id headers")
+        return ubx.decode_nav_pvt(body, device_id, experiment_id)
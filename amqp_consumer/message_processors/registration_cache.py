@@ -0,0 +1,54 @@
+"""
+In-process cache of device registrations.
+
+Maps a device alias to the hardware id returned by the last successful registration and a
+fingerprint of the registered fields. A registration whose fingerprint matches the cached one
+is answered without touching the database. Entries expire after a TTL, so changes made to the
+hardware table by hand are picked up eventually, and the least recently used entries are
+evicted once the cache is full.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+
+class RegistrationCache:
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or Config.REGISTRATION_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else Config.REGISTRATION_CACHE_TTL
+        self._entries = OrderedDict()
+        # Registrations can be processed from worker threads or the asyncio executor
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, alias, fingerprint):
+        """Return the cached hardware id if the alias was registered with the same fingerprint."""
+        with self._lock:
+            entry = self._entries.get(alias)
+            if entry is None or entry[1] != fingerprint or time.monotonic() - entry[2] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(alias)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, alias, hardware_id, fingerprint):
+        with self._lock:
+            self._entries[alias] = (hardware_id, fingerprint, time.monotonic())
+            self._entries.move_to_end(alias)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, alias):
+        with self._lock:
+            self._entries.pop(alias, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+registration_cache = RegistrationCache()
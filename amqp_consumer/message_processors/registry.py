@@ -0,0 +1,48 @@
+"""
+Registry of message handlers keyed by message_type.
+
+Handlers are stateless singletons: a processor class registers itself with the
+register_processor decorator, which instantiates it once, and every message of that type is
+then passed to the same instance. New UBX/NMEA types only need a module in this package that
+registers its processor; processor_factory imports every module here at startup.
+
+A processor that can also decode a binary wire format registers its AMQP content_type, and
+messages with that content_type are passed to its decode() instead of being parsed as JSON.
+"""
+
+_processors = {}
+_binary_processors = {}
+
+
+def register_processor(message_type, content_type=None):
+    """Class decorator that registers a single instance of the processor for message_type.
+
+    Parameters:
+    - message_type: The message_type of JSON messages handled by the processor.
+    - content_type: Optional AMQP content type of binary messages the processor decodes.
+    """
+    def decorator(cls):
+        if message_type in _processors:
+            raise ValueError(f"A processor for message type {message_type} is already registered")
+        if content_type is not None and content_type in _binary_processors:
+            raise ValueError(f"A processor for content type {content_type} is already registered")
+        processor = cls()
+        _processors[message_type] = processor
+        if content_type is not None:
+            _binary_processors[content_type] = (message_type, processor)
+        return cls
+    return decorator
+
+
+def lookup(message_type):
+    """Return the processor registered for message_type, or None."""
+    return _processors.get(message_type)
+
+
+def lookup_content_type(content_type):
+    """Return (message_type, processor) for a binary content type, or None."""
+    return _binary_processors.get(content_type)
+
+
+def registered_types():
+    return sorted(_processors)
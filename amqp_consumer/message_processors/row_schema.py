@@ -0,0 +1,155 @@
+"""
+Row schemas for the telemetry message types.
+
+A RowSchema lists the columns of a telemetry table in table order together with how each value is
+coerced from the decoded JSON. At import time every schema compiles a specialised encode()
+function, so converting a message costs a straight run of dict lookups and conversions with no
+per-message defaults dict, list scans or mutation of the input. encode() returns a tuple in column
+order, or None if a mandatory field is missing.
+
+Column kinds:
+- "float": empty values get the default, anything else is converted with float().
+- "flag": empty values get the default, anything else becomes int(bool(value)).
+- "count": passed through, negative values are replaced by 0.
+- "value": passed through, empty values get the default if the column has one.
+"""
+
+from db.db_manager import DBManager
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_NO_DEFAULT = object()
+
+
+class Column:
+    __slots__ = ("name", "kind", "default")
+
+    def __init__(self, name, kind="value", default=_NO_DEFAULT):
+        self.name = name
+        self.kind = kind
+        self.default = default
+
+
+class RowSchema:
+    __slots__ = ("table_name", "columns", "required", "encode")
+
+    def __init__(self, table_name, columns, required, natural_key=None):
+        self.table_name = table_name
+        self.columns = tuple(column.name for column in columns)
+        self.required = tuple(required)
+        self.encode = self._compile(columns)
+        DBManager.register_table_columns(table_name, self.columns, natural_key)
+
+    def to_dict(self, row):
+        return dict(zip(self.columns, row))
+
+    def _compile(self, columns):
+        namespace = {"logger": logger}
+        lines = ["def encode(data):", "    get = data.get"]
+        for index, name in enumerate(self.required):
+            lines.append(f"    r{index} = get({name!r})")
+        if self.required:
+            missing = " or ".join(f"not r{index}" for index in range(len(self.required)))
+            fields = ", ".join(f"'{name}'" for name in self.required)
+            lines.append(f"    if {missing}:")
+            lines.append(f"        logger.error(\"Missing mandatory field {fields}.\")")
+            lines.append("        return None")
+        names = []
+        for index, column in enumerate(columns):
+            var = f"c{index}"
+            names.append(var)
+            if column.name in self.required:
+                lines.append(f"    {var} = r{self.required.index(column.name)}")
+                continue
+            default = f"d{index}"
+            namespace[default] = None if column.default is _NO_DEFAULT else column.default
+            lines.append(f"    {var} = get({column.name!r})")
+            if column.kind == "float":
+                lines += [
+                    f"    if not {var}:",
+                    f"        {var} = {default}",
+                    "    else:",
+                    "        try:",
+                    f"            {var} = float({var})",
+                    "        except (TypeError, ValueError):",
+                    f"            logger.error(\"Invalid value for %s, setting to default %s.\", {column.name!r}, {default})",
+                    f"            {var} = {default}",
+                ]
+            elif column.kind == "flag":
+                lines.append(f"    {var} = int(bool({var})) if {var} else {default}")
+            elif column.kind == "count":
+                lines += [
+                    f"    if {var} is not None and {var} < 0:",
+                    f"        logger.error(\"Invalid %s %s, setting to default 0.\", {column.name!r}, {var})",
+                    f"        {var} = 0",
+                ]
+            elif column.default is not _NO_DEFAULT:
+                lines.append(f"    if not {var}:")
+                lines.append(f"        {var} = {default}")
+        lines.append(f"    return ({', '.join(names)},)")
+        exec(compile("\n".join(lines), f"<row schema {self.table_name}>", "exec"), namespace)
+        return namespace["encode"]
+
+
+GNGGA_SCHEMA = RowSchema(
+    "gngga",
+    [
+        Column("full_time"),
+        Column("lat", "float", None),
+        Column("ns", default=""),
+        Column("lon", "float", None),
+        Column("ew", default=""),
+        Column("quality", "count"),
+        Column("num_sv", "count"),
+        Column("hdop", "float", None),
+        Column("alt", "float", 0.0),
+        Column("alt_unit", default=""),
+        Column("sep", "float", 0.0),
+        Column("sep_unit", default=""),
+        Column("diff_age", default=-1),
+        Column("diff_station", default=""),
+        Column("processed_time"),
+        Column("device_id"),
+        Column("experiment_id"),
+    ],
+    required=("full_time", "device_id"),
+    natural_key=("device_id", "full_time"),
+)
+
+NAV_PVT_SCHEMA = RowSchema(
+    "nav_pvt",
+    [
+        Column("full_time"),
+        Column("device_id"),
+        Column("experiment_id"),
+        Column("year", default=2024),
+        Column("month", default=1),
+        Column("day", default=1),
+        Column("hour", default=0),
+        Column("min", default=0),
+        Column("second", default=0),
+        Column("validDate", "flag", 0),
+        Column("validTime", "flag", 0),
+        Column("tAcc", default=0),
+        Column("fixType", default=""),
+        Column("gnssFixOk", "flag", 0),
+        Column("numSV", default=0),
+        Column("lon", "float", None),
+        Column("lat", "float", None),
+        Column("height", "float", 0.0),
+        Column("hMSL", "float", 0.0),
+        Column("hAcc", "float", 0.0),
+        Column("vAcc", "float", 0.0),
+        Column("velN", "float", 0.0),
+        Column("velE", "float", 0.0),
+        Column("velD", "float", 0.0),
+        Column("gSpeed", "float", 0.0),
+        Column("headMot", "float", 0.0),
+        Column("sAcc", "float", 0.0),
+        Column("headAcc", "float", 0.0),
+        Column("pDOP", "float", 0.0),
+    ],
+    required=("full_time", "device_id", "experiment_id"),
+    natural_key=("device_id", "full_time"),
+)
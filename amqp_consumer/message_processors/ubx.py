@@ -0,0 +1,204 @@
+"""
+Decoder for raw u-blox UBX NAV-PVT frames.
+
+A frame is the sync chars 0xB5 0x62, class 0x01, id 0x07, a little-endian length of 92, the
+92-byte payload and a two-byte Fletcher checksum over class, id, length and payload. A message
+body may hold any number of frames back to back.
+
+Frames are read through a memoryview with a precompiled struct layout, so the payload is never
+copied. When a body holds only NAV-PVT frames they are viewed as a NumPy structured array instead,
+and checksums, validity checks and scaling run on whole columns at once.
+
+The rows are the nav_pvt rows the JSON path produces from the same fix as converted by pyubx2 on
+the devices: lon/lat in degrees (1e-7 deg scaled), height, hMSL, hAcc and vAcc in mm, velocities
+and sAcc in mm/s, headMot and headAcc in degrees (1e-5 deg scaled) and pDOP scaled by 0.01.
+"""
+
+import struct
+from datetime import datetime, timedelta
+import numpy as np
+
+CONTENT_TYPE = "application/vnd.ublox.ubx"
+
+SYNC = b"\xb5\x62"
+NAV_PVT_CLASS_ID = b"\x01\x07"
+NAV_PVT_LENGTH = 92
+FRAME_LENGTH = 6 + NAV_PVT_LENGTH + 2
+NAV_PVT_HEADER = SYNC + NAV_PVT_CLASS_ID + NAV_PVT_LENGTH.to_bytes(2, "little")
+
+_HEADER = struct.Struct("<2sBBH")
+# iTOW, year, month, day, hour, min, sec, valid, tAcc, nano, fixType, flags, flags2, numSV, lon, lat,
+# height, hMSL, hAcc, vAcc, velN, velE, velD, gSpeed, headMot, sAcc, headAcc, pDOP, flags3, headVeh,
+# magDec, magAcc
+NAV_PVT = struct.Struct("<IHBBBBBBIiBBBBiiiiIIiiiiiIIHH4xihH")
+
+_FRAME_DTYPE = np.dtype([
+    ("sync", "S2"), ("class_id", "S2"), ("length", "<u2"),
+    ("iTOW", "<u4"), ("year", "<u2"), ("month", "u1"), ("day", "u1"), ("hour", "u1"), ("min", "u1"),
+    ("sec", "u1"), ("valid", "u1"), ("tAcc", "<u4"), ("nano", "<i4"), ("fixType", "u1"), ("flags", "u1"),
+    ("flags2", "u1"), ("numSV", "u1"), ("lon", "<i4"), ("lat", "<i4"), ("height", "<i4"), ("hMSL", "<i4"),
+    ("hAcc", "<u4"), ("vAcc", "<u4"), ("velN", "<i4"), ("velE", "<i4"), ("velD", "<i4"), ("gSpeed", "<i4"),
+    ("headMot", "<i4"), ("sAcc", "<u4"), ("headAcc", "<u4"), ("pDOP", "<u2"), ("flags3", "<u2"),
+    ("reserved", "V4"), ("headVeh", "<i4"), ("magDec", "<i2"), ("magAcc", "<u2"),
+    ("ck_a", "u1"), ("ck_b", "u1"),
+])
+assert _FRAME_DTYPE.itemsize == FRAME_LENGTH
+
+# Float columns in table order, and the scale factors from the raw integers to the units the JSON path stores
+FLOAT_COLUMNS = ("lon", "lat", "height", "hMSL", "hAcc", "vAcc", "velN", "velE", "velD", "gSpeed", "headMot", "sAcc", "headAcc", "pDOP")
+SCALES = {"lon": 1e-7, "lat": 1e-7, "headMot": 1e-5, "headAcc": 1e-5, "pDOP": 0.01}
+# Fletcher weights for the 96 checksummed bytes, the first byte counts 96 times in CK_B
+_CK_WEIGHTS = np.arange(FRAME_LENGTH - 4, 0, -1, dtype=np.uint32)
+
+
+class UBXError(ValueError):
+    """Raised for bodies that are not well-formed UBX NAV-PVT frames."""
+
+
+def checksum(data):
+    ck_a = ck_b = 0
+    for byte in data:
+        ck_a = (ck_a + byte) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return ck_a, ck_b
+
+
+def iter_frames(body):
+    """Yield a memoryview of the payload of every NAV-PVT frame, skipping other UBX messages."""
+    view = memoryview(body)
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < 8:
+            raise UBXError(f"Truncated UBX frame at offset {offset}")
+        sync, msg_class, msg_id, length = _HEADER.unpack_from(view, offset)
+        if sync != SYNC:
+            raise UBXError(f"Missing UBX sync chars at offset {offset}")
+        end = offset + 6 + length
+        if end + 2 > len(view):
+            raise UBXError(f"Truncated UBX frame at offset {offset}")
+        if checksum(view[offset + 2:end]) != (view[end], view[end + 1]):
+            raise UBXError(f"UBX checksum mismatch at offset {offset}")
+        if (msg_class, msg_id) == (0x01, 0x07):
+            if length != NAV_PVT_LENGTH:
+                raise UBXError(f"NAV-PVT payload of {length} bytes, expected {NAV_PVT_LENGTH}")
+            yield view[offset + 6:end]
+        offset = end + 2
+
+
+def scan_nav_pvt(buffer, start=0, end=None):
+    """Return the offsets of the NAV-PVT frames with a valid checksum that start in buffer[start:end].
+
+    For raw receiver logs, where NAV-PVT frames sit between other UBX messages, NMEA sentences
+    and garbage. Frames are found by their header and may extend past end. A header inside an
+    accepted frame's payload is not a frame.
+    """
+    end = len(buffer) if end is None else end
+    last = len(buffer) - FRAME_LENGTH
+    candidates = []
+    offset = buffer.find(NAV_PVT_HEADER, start, end)
+    while offset != -1 and offset <= last:
+        candidates.append(offset)
+        offset = buffer.find(NAV_PVT_HEADER, offset + 1, end)
+    if not candidates:
+        return []
+    frames = np.frombuffer(
+        b"".join(buffer[offset:offset + FRAME_LENGTH] for offset in candidates), dtype=np.uint8,
+    ).reshape(len(candidates), FRAME_LENGTH)
+    covered = frames[:, 2:FRAME_LENGTH - 2]
+    valid = (
+        ((covered.sum(axis=1, dtype=np.uint32) & 0xFF) == frames[:, -2])
+        & (((covered @ _CK_WEIGHTS) & 0xFF) == frames[:, -1])
+    )
+    offsets = []
+    for offset in np.asarray(candidates)[valid].tolist():
+        if not offsets or offset >= offsets[-1] + FRAME_LENGTH:
+            offsets.append(offset)
+    return offsets
+
+
+def _row(fields, device_id, experiment_id):
+    (_, year, month, day, hour, minute, sec, valid, t_acc, nano, fix_type, flags, _, num_sv, lon, lat, height,
+     h_msl, h_acc, v_acc, vel_n, vel_e, vel_d, g_speed, head_mot, s_acc, head_acc, p_dop) = fields[:28]
+    # Leap seconds and negative nano are carried over by timedelta
+    full_time = datetime(year, month, day, hour, minute) + timedelta(seconds=sec, microseconds=nano // 1000)
+    return (
+        full_time.isoformat(timespec="microseconds") + "Z", device_id, experiment_id,
+        year, month, day, hour, minute, sec, valid & 0x01, (valid >> 1) & 0x01, t_acc, str(fix_type),
+        flags & 0x01, num_sv, lon * 1e-7, lat * 1e-7, float(height), float(h_msl), float(h_acc), float(v_acc),
+        float(vel_n), float(vel_e), float(vel_d), float(g_speed), head_mot * 1e-5, float(s_acc),
+        head_acc * 1e-5, p_dop * 0.01,
+    )
+
+
+def _decode_frames(body, device_id, experiment_id):
+    rows = []
+    for payload in iter_frames(body):
+        try:
+            rows.append(_row(NAV_PVT.unpack_from(payload), device_id, experiment_id))
+        except ValueError as e:
+            raise UBXError(f"Invalid NAV-PVT date: {e}")
+    return rows
+
+
+def _decode_array(body, device_id, experiment_id):
+    """Decode a body of back-to-back NAV-PVT frames column by column, or return None if it is not one."""
+    frames = np.frombuffer(body, dtype=_FRAME_DTYPE)
+    if not (
+        (frames["sync"] == SYNC).all()
+        and (frames["class_id"] == NAV_PVT_CLASS_ID).all()
+        and (frames["length"] == NAV_PVT_LENGTH).all()
+    ):
+        return None
+    covered = np.frombuffer(body, dtype=np.uint8).reshape(len(frames), FRAME_LENGTH)[:, 2:FRAME_LENGTH - 2]
+    if not (
+        ((covered.sum(axis=1, dtype=np.uint32) & 0xFF) == frames["ck_a"]).all()
+        and (((covered @ _CK_WEIGHTS) & 0xFF) == frames["ck_b"]).all()
+    ):
+        raise UBXError("UBX checksum mismatch")
+    month, day, hour, minute, sec = frames["month"], frames["day"], frames["hour"], frames["min"], frames["sec"]
+    if ((frames["year"] < 1) | (month < 1) | (month > 12) | (day < 1) | (hour > 23) | (minute > 59) | (sec > 60)).any():
+        raise UBXError("Invalid NAV-PVT date")
+    month_start = (
+        (frames["year"].astype(np.int64) - 1970).astype("datetime64[Y]")
+        + (month.astype(np.int64) - 1).astype("timedelta64[M]")
+    )
+    date = month_start.astype("datetime64[D]") + (day.astype(np.int64) - 1).astype("timedelta64[D]")
+    if (date.astype("datetime64[M]") != month_start).any():
+        raise UBXError("Invalid NAV-PVT date")
+    full_time = (
+        date.astype("datetime64[us]")
+        + hour.astype(np.int64).astype("timedelta64[h]")
+        + minute.astype(np.int64).astype("timedelta64[m]")
+        + sec.astype(np.int64).astype("timedelta64[s]")
+        + (frames["nano"].astype(np.int64) // 1000).astype("timedelta64[us]")
+    )
+    count = len(frames)
+    columns = [
+        [f"{stamp}Z" for stamp in np.datetime_as_string(full_time, unit="us").tolist()],
+        [device_id] * count,
+        [experiment_id] * count,
+        frames["year"].tolist(), month.tolist(), day.tolist(), hour.tolist(), minute.tolist(), sec.tolist(),
+        (frames["valid"] & 0x01).tolist(), ((frames["valid"] >> 1) & 0x01).tolist(),
+        frames["tAcc"].tolist(), [str(fix_type) for fix_type in frames["fixType"].tolist()],
+        (frames["flags"] & 0x01).tolist(), frames["numSV"].tolist(),
+    ]
+    for name in FLOAT_COLUMNS:
+        values = frames[name].astype(np.float64)
+        if name in SCALES:
+            values = values * SCALES[name]
+        columns.append(values.tolist())
+    return list(zip(*columns))
+
+
+def decode_nav_pvt(body, device_id, experiment_id):
+    """Decode every NAV-PVT frame in a UBX body into nav_pvt rows in NAV_PVT_SCHEMA column order.
+
+    Parameters:
+    - body: Bytes-like UBX data, one or more frames.
+    - device_id, experiment_id: Taken from the message headers, UBX frames do not carry them.
+    """
+    if len(body) > FRAME_LENGTH and len(body) % FRAME_LENGTH == 0:
+        rows = _decode_array(body, device_id, experiment_id)
+        if rows is not None:
+            return rows
+    return _decode_frames(body, device_id, experiment_id)
@@ -0,0 +1,210 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms are kept in plain dicts keyed by label values and guarded by a lock, so
+recording a sample on the hot path costs a dict lookup and an addition. health_server serves
+render() on /metrics. Every consumer process keeps its own values; under the supervisor each
+consumer serves them on its own port.
+"""
+
+import bisect
+import threading
+import time
+from datetime import datetime
+
+# Bucket bounds in seconds for the per-stage and pool wait histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bucket bounds in seconds from a fix being taken on the device to its row being committed
+DEVICE_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Label values -> [per-bucket counts with a trailing +Inf bucket, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def totals(self, *labelvalues):
+        """Sum and count of the values observed so far for the given label values."""
+        with self._lock:
+            state = self._values.get(labelvalues)
+            return (state[1], state[2]) if state is not None else (0.0, 0)
+
+    def time(self, *labelvalues):
+        """Context manager that observes the time spent in its block."""
+        return _Timer(self, labelvalues)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        label_names = self.labelnames + ("le",)
+        with self._lock:
+            for labelvalues, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(label_names, labelvalues + (_format_value(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, labelvalues)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labelvalues", "started")
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+MESSAGES = _register(Counter("amqp_consumer_messages_total", "Messages received, by queue and message type", ("queue", "message_type")))
+REDELIVERIES = _register(Counter("amqp_consumer_redeliveries_total", "Messages received with the redelivered flag set", ("queue",)))
+ACKS = _register(Counter("amqp_consumer_acks_total", "Deliveries acknowledged", ("queue",)))
+NACKS = _register(Counter("amqp_consumer_nacks_total", "Deliveries negatively acknowledged", ("queue",)))
+STAGE_SECONDS = _register(Histogram("amqp_consumer_stage_seconds", "Time spent per processing stage: decode, validate, process, db and ack", ("stage",)))
+POOL_WAIT_SECONDS = _register(Histogram("amqp_consumer_db_pool_wait_seconds", "Time spent checking out a database connection", ("pool",)))
+BATCH_ROWS = _register(Histogram("amqp_consumer_batch_rows", "Rows per committed batch", buckets=BATCH_SIZE_BUCKETS))
+DUPLICATES = _register(Counter(
+    "amqp_consumer_duplicates_total",
+    "Telemetry rows dropped as duplicates of stored rows: in memory before writing or by the database",
+    ("table", "stage"),
+))
+DEVICE_TO_DB_SECONDS = _register(Histogram(
+    "amqp_consumer_device_to_db_seconds",
+    "Time from a fix's full_time to the commit of its row",
+    ("table",),
+    buckets=DEVICE_LATENCY_BUCKETS,
+))
+
+
+def register(metric):
+    """Add a metric defined elsewhere to the /metrics output."""
+    return _register(metric)
+
+
+def unregister(metric):
+    if metric in _registry:
+        _registry.remove(metric)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.timestamp() if value.tzinfo is not None else None
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return parsed.timestamp() if parsed.tzinfo is not None else None
+    return None
+
+
+def observe_committed_rows(batches, columns_by_table):
+    """Record the device-to-DB latency of rows that have just been committed.
+
+    Only the first and the last row of each table's batch are observed, which bounds the work on
+    the commit path and still covers the oldest and the newest fix of an ordered batch.
+
+    Parameters:
+    - batches: Dict mapping table name to the committed rows, as tuples or dicts.
+    - columns_by_table: Column order of the tuple rows per table, see DBManager.register_table_columns.
+    """
+    now = time.time()
+    for table_name, rows in batches.items():
+        columns = columns_by_table.get(table_name)
+        index = columns.index("full_time") if columns and "full_time" in columns else None
+        for row in (rows[0], rows[-1]) if len(rows) > 1 else rows:
+            full_time = row.get("full_time") if isinstance(row, dict) else (row[index] if index is not None else None)
+            timestamp = _timestamp(full_time)
+            if timestamp is not None:
+                DEVICE_TO_DB_SECONDS.observe(max(0.0, now - timestamp), table_name)
@@ -0,0 +1,144 @@
+"""
+On-demand profiling of a running consumer process, triggered by SIGUSR1.
+
+SIGUSR1 starts a capture of PROFILE_SECONDS, a second SIGUSR1 ends it early. The result is
+written to PROFILE_DIR and its path is logged. PROFILE_MODE selects what is captured:
+
+- stack: a sampler thread records the stacks of every thread each PROFILE_INTERVAL_MS and writes
+  them in the folded format ("thread;function (file:line);... count" per line, line being where
+  the function starts) to profile-<pid>-<time>.folded, for flamegraph.pl or speedscope. It
+  covers the worker, batch and reporter threads, and costs the process nothing between samples.
+  Threads blocked in I/O or waiting for work show up as well, under their waiting frame.
+- cprofile: cProfile of the main thread, which runs the connection and, with WORKER_THREADS=0,
+  every message, written to profile-<pid>-<time>.pstats for pstats or snakeviz. Exact call
+  counts, but it slows the profiled thread down while it runs.
+- off: no handler is installed.
+
+Under the supervisor, SIGUSR1 to the supervisor is passed on to every consumer process.
+"""
+
+import cProfile
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+from config import Config
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def _path(directory, suffix):
+    return os.path.join(directory, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.{suffix}")
+
+
+class _CProfileCapture:
+    def __init__(self, path):
+        self.path = path
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        """Stop profiling and write the stats; must run on the profiled thread."""
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+        logger.info("Wrote cProfile stats to %s", self.path)
+
+
+class _StackCapture:
+    def __init__(self, path, interval, on_done):
+        self.path = path
+        self.interval = interval
+        self.on_done = on_done
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        stacks = collections.Counter()
+        samples = 0
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+        try:
+            with open(self.path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info("Wrote %d stack samples to %s", samples, self.path)
+        except OSError as e:
+            logger.error("Failed to write stack samples to %s: %s", self.path, e)
+        self.on_done(self)
+
+
+class Profiler:
+    """Captures a profile of this process for a while when it receives SIGUSR1."""
+    def __init__(self, mode=None, seconds=None, interval_ms=None, directory=None):
+        self.mode = mode or Config.PROFILE_MODE
+        self.seconds = seconds or Config.PROFILE_SECONDS
+        self.interval = (interval_ms or Config.PROFILE_INTERVAL_MS) / 1000.0
+        self.directory = directory or Config.PROFILE_DIR
+        self._capture = None
+        self._timer = None
+
+    def install(self):
+        """Handle SIGUSR1 in this process; must be called from the main thread."""
+        if self.mode not in ("stack", "cprofile"):
+            return None
+        signal.signal(signal.SIGUSR1, self._on_signal)
+        logger.info("Send SIGUSR1 to pid %d to capture a %s profile of %g s", os.getpid(), self.mode, self.seconds)
+        return self
+
+    def _on_signal(self, signum, frame):
+        # Runs between two bytecodes of the main thread, an exception would end the consumer loop
+        try:
+            if self._capture is None:
+                self.start()
+            else:
+                self.stop()
+        except Exception as e:
+            logger.error("Failed to start or stop profiling: %s", e)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.mode == "cprofile":
+            self._capture = _CProfileCapture(_path(self.directory, "pstats"))
+            # cProfile has to be stopped on the thread it profiles, so the timer signals the main thread
+            self._timer = threading.Timer(self.seconds, self._expire, (self._capture,))
+        else:
+            self._capture = _StackCapture(_path(self.directory, "folded"), self.interval, self._done)
+            self._timer = threading.Timer(self.seconds, self._capture.stop)
+        self._timer.daemon = True
+        self._timer.start()
+        logger.info("Capturing a %s profile for %g s", self.mode, self.seconds)
+
+    def stop(self):
+        capture, self._capture = self._capture, None
+        if capture is None:
+            return
+        self._timer.cancel()
+        capture.stop()
+
+    def _expire(self, capture):
+        if self._capture is capture:
+            os.kill(os.getpid(), signal.SIGUSR1)
+
+    def _done(self, capture):
+        # A stack capture that ran out ends itself; clear it unless a new one has started
+        if self._capture is capture:
+            self._capture = None
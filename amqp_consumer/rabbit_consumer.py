@@ -1,10 +1,22 @@
+import functools
 import pika
 import json
+import tracing
 from config import Config
 from logger import setup_logger
+from batch_writer import BatchWriter
+from db.db_manager import DBManager
+from dedupe import RecentKeys
+from delivery_tracker import DeliveryTracker
+from flow_control import FlowController
+from message_processors import envelope
+from message_processors.processor_factory import get_binary_processor
+from metrics import MESSAGES, REDELIVERIES
+from retry_policy import PermanentError, RetryPolicy, declare_topology
+from worker_pool import WorkerPool
 import time
 
-logger = setup_logger("rabbit_consumer", level="INFO")
+logger = setup_logger("rabbit_consumer")
 
 class RabbitMQConnection:
     """Handles the connection to RabbitMQ."""
@@ -15,20 +27,22 @@ class RabbitMQConnection:
         self.retry_attempts = retry_attempts
         self.retry_delay = retry_delay
 
+    def parameters(self):
+        """Connection parameters shared by the blocking and asyncio engines."""
+        return pika.ConnectionParameters(
+            host=self.host,
+            credentials=self.credentials,
+            heartbeat=600,
+            blocked_connection_timeout=300
+        )
+
     def connect(self):
         """Attempt to connect to RabbitMQ with retries."""
         logger.debug("Attempting to connect to RabbitMQ")
         for attempt in range(self.retry_attempts):
             try:
                 logger.debug("Connection attempt %d to host %s", attempt + 1, self.host)
-                connection = pika.BlockingConnection(
-                    pika.ConnectionParameters(
-                        host=self.host,
-                        credentials=self.credentials,
-                        heartbeat=600,
-                        blocked_connection_timeout=300 
-                    )
-                )
+                connection = pika.BlockingConnection(self.parameters())
                 logger.info("Successfully connected to RabbitMQ on attempt %d", attempt + 1)
                 return connection
             except pika.exceptions.AMQPConnectionError as e:
@@ -42,68 +56,219 @@ class RabbitMQConnection:
 
 class RabbitConsumer:
     """Consumes messages from RabbitMQ queues."""
-    def __init__(self, processor_factory):
+    def __init__(self, processor_factory, spool=None, accuracy=None):
         logger.debug("Initializing RabbitConsumer")
         self.processor_factory = processor_factory
+        self.spool = spool
+        self.accuracy = accuracy
+        self.recent_keys = RecentKeys() if Config.DEDUPE_ENABLED else None
+        self.connection_handler = None
         self.connection = None
-        self.channel = None
+        self.channels = {}
+        self.trackers = {}
+        self.batch_writers = {}
+        self.worker_pool = WorkerPool(Config.WORKER_THREADS) if Config.WORKER_THREADS > 0 else None
+        # Adjusts the telemetry queue's prefetch, in-flight and batch size limits at runtime
+        self.flow_controller = FlowController("gnss_data_queue", spool=spool) if Config.FLOW_CONTROL_ENABLED else None
+        self.retry_policy = RetryPolicy()
         self.queues = {
             "gnss_data_queue": "basic",
             "device_registration": "rpc",
             "experiment_registration": "rpc"
         }
+        # Handling policy per queue kind. Each queue gets its own channel so a telemetry
+        # backlog only holds back its own prefetch window, never the registration RPCs.
+        self.queue_policies = {
+            "basic": {"prefetch_count": Config.BASIC_PREFETCH_COUNT, "batch": Config.BATCH_ENABLED},
+            "rpc": {"prefetch_count": Config.RPC_PREFETCH_COUNT, "batch": False},
+        }
 
     def setup_connection(self):
         logger.debug("Setting up RabbitMQ connection")
-        connection_handler = RabbitMQConnection(
+        self.connection_handler = RabbitMQConnection(
             Config.RABBITMQ_HOST,
             pika.PlainCredentials(Config.RABBITMQ_USER, Config.RABBITMQ_PASS)
         )
-        self.connection = connection_handler.connect()
-        self.channel = self.connection.channel()
-        logger.info("RabbitMQ connection and channel setup complete")
+        self.connection = self.connection_handler.connect()
+        for queue_name, kind in self.queues.items():
+            policy = self.queue_policies[kind]
+            channel = self.connection.channel()
+            channel.basic_qos(prefetch_count=policy["prefetch_count"])
+            self.channels[queue_name] = channel
+            tracker = DeliveryTracker(channel, queue_name)
+            self.trackers[queue_name] = tracker
+            if policy["batch"]:
+                self.batch_writers[queue_name] = BatchWriter(
+                    self.connection,
+                    ack=functools.partial(self._settle, tracker.ack),
+                    nack=functools.partial(self._settle, tracker.nack),
+                    threaded=self.worker_pool is not None,
+                    spool=self.spool,
+                    accuracy=self.accuracy,
+                    recent_keys=self.recent_keys,
+                )
+            logger.debug("Channel %s opened for %s queue %s with prefetch_count %d", channel.channel_number, kind, queue_name, policy["prefetch_count"])
+        declare_topology(next(iter(self.channels.values())))
+        if self.flow_controller is not None:
+            queue_name = self.flow_controller.queue_name
+            self.flow_controller.attach(
+                self.connection, self.channels[queue_name], self.batch_writers.get(queue_name), threaded=self.worker_pool is not None,
+            )
+        logger.info("RabbitMQ connection and channels setup complete")
+
+    def is_healthy(self):
+        """True while the connection and every consuming channel are open."""
+        return (
+            self.connection is not None and self.connection.is_open
+            and bool(self.channels) and all(channel.is_open for channel in self.channels.values())
+        )
 
     def close_connection(self):
-        if self.channel is not None:
+        for batch_writer in self.batch_writers.values():
+            batch_writer.discard()
+        self.batch_writers = {}
+        self.trackers = {}
+        for queue_name, channel in self.channels.items():
             try:
-                self.channel.close()
+                if channel.is_open:
+                    channel.close()
             except Exception as e:
-                logger.error("Failed to close channel: %s", e)
+                logger.error("Failed to close channel for %s: %s", queue_name, e)
+        self.channels = {}
         if self.connection is not None:
             try:
-                self.connection.close()
+                if self.connection.is_open:
+                    self.connection.close()
             except Exception as e:
                 logger.error("Failed to close connection: %s", e)
-        logger.info("Connection and channel closed")
+        logger.info("Connection and channels closed")
 
-    def on_message_callback(self, ch, method, properties, body):
+    def on_message_callback(self, ch, method, properties, body, queue_name="gnss_data_queue"):
         logger.debug("Received message: %s", body)
+        tracker = self.trackers[queue_name]
+        tracker.delivered(method.delivery_tag)
+        trace = tracing.start(queue_name, method.delivery_tag)
+        if method.redelivered:
+            REDELIVERIES.inc(queue_name)
+        batch_writer = self.batch_writers.get(queue_name)
+        binary = get_binary_processor(properties.content_type)
+        if binary is not None:
+            args = (tracker, batch_writer, method, properties, body) + binary + (trace,)
+            if self.worker_pool is None:
+                self.process_binary(*args)
+            else:
+                self.worker_pool.submit((properties.headers or {}).get("device_id"), self.process_binary, *args)
+            return
         try:
-            message_data = json.loads(body)
+            with tracing.stage(trace, "decode"):
+                message_data = envelope.loads(body, properties.content_type)
             logger.debug("Message data parsed: %s", message_data)
         except Exception as e:
             logger.error("Failed to parse message: %s", e)
-            ch.basic_nack(delivery_tag=method.delivery_tag)
+            self.retry_policy.fail(tracker, queue_name, method.delivery_tag, properties, body, e)
+            tracing.finish(trace, "failed")
             return
+        if self.worker_pool is None:
+            self.process_message(tracker, batch_writer, method, properties, message_data, body, trace)
+            return
+        # Messages of one device always go to the same worker to keep them in order
+        ordering_key = message_data.get("device_id") or message_data.get("alias")
+        self.worker_pool.submit(ordering_key, self.process_message, tracker, batch_writer, method, properties, message_data, body, trace)
+
+    def process_message(self, tracker, batch_writer, method, properties, message_data, body, trace=None):
+        """Run a decoded message through its processor, on a worker thread in worker pool mode."""
+        if trace is not None and self.worker_pool is not None:
+            trace.wait("worker_wait")
         try:
             logger.debug("Processing message: %s", message_data)
-            logger.debug("Properties: %s", properties)
             processor = self.processor_factory(message_data)
-            response = processor.process()
+            MESSAGES.inc(tracker.queue_name, message_data.get("message_type"))
+            if envelope.is_envelope(message_data):
+                with tracing.stage(trace, "validate"):
+                    rows = envelope.encode_fixes(processor, message_data, tracker.queue_name)
+                if not rows:
+                    raise PermanentError(f"{message_data.get('message_type')} envelope without any valid fix")
+                self._store_rows(tracker, batch_writer, method, processor.table_name, rows, trace)
+                return
+            if batch_writer is not None and processor.table_name:
+                with tracing.stage(trace, "validate"):
+                    row = processor.encode_row(message_data)
+                if not row:
+                    raise PermanentError(f"{message_data.get('message_type')} message rejected by its validator")
+                self._store_rows(tracker, batch_writer, method, processor.table_name, [row], trace)
+                return
+            with tracing.stage(trace, "process"), tracing.activate(trace):
+                response = processor.process(message_data)
             if properties.reply_to:
                 # Use the dedicated publish_message method
-                self.publish_message(
-                    exchange='',
-                    routing_key=properties.reply_to,
-                    properties=pika.BasicProperties(correlation_id=properties.correlation_id),
-                    body=json.dumps(response)
+                self._settle(
+                    self.publish_message,
+                    '',
+                    properties.reply_to,
+                    pika.BasicProperties(correlation_id=properties.correlation_id),
+                    json.dumps(response),
+                    tracker.channel
                 )
-                logger.info("Processed message successfully response (response, recipeint): %s, %s", response, properties.reply_to)
-                logger.debug("Published response to RPC queue: %s", properties.reply_to)
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+                logger.debug("Published response %s to RPC queue: %s", response, properties.reply_to)
+            self._ack(tracker, method, trace)
         except Exception as e:
             logger.error("Failed to process message: %s", e)
-            ch.basic_nack(delivery_tag=method.delivery_tag)
+            self._settle(self.retry_policy.fail, tracker, tracker.queue_name, method.delivery_tag, properties, body, e)
+            tracing.finish(trace, "failed")
+
+    def process_binary(self, tracker, batch_writer, method, properties, body, message_type, processor, trace=None):
+        """Decode a binary message, e.g. raw UBX frames, and store its rows like JSON telemetry."""
+        if trace is not None and self.worker_pool is not None:
+            trace.wait("worker_wait")
+        try:
+            MESSAGES.inc(tracker.queue_name, message_type)
+            with tracing.stage(trace, "decode"):
+                rows = processor.decode(body, properties.headers)
+            if not rows:
+                raise PermanentError(f"{properties.content_type} message without any {message_type} frames")
+            self._store_rows(tracker, batch_writer, method, processor.table_name, rows, trace)
+        except Exception as e:
+            logger.error("Failed to process %s message: %s", properties.content_type, e)
+            self._settle(self.retry_policy.fail, tracker, tracker.queue_name, method.delivery_tag, properties, body, e)
+            tracing.finish(trace, "failed")
+
+    def _store_rows(self, tracker, batch_writer, method, table_name, rows, trace=None):
+        if self.recent_keys is not None:
+            rows = self.recent_keys.filter(table_name, rows)
+            if not rows:
+                # Every fix is stored already, e.g. a redelivery after the ack was lost
+                self._ack(tracker, method, trace)
+                return
+        if batch_writer is not None and not method.redelivered:
+            # Telemetry rows are acked together once their batch is committed, which finishes the trace
+            batch_writer.add_rows(table_name, rows, method.delivery_tag, trace)
+            return
+        # A failed batch is redelivered as a whole; writing its messages one by one keeps a
+        # single bad row from failing the next batch and lets it be retried on its own
+        with tracing.activate(trace):
+            (batch_writer.writer if batch_writer is not None else DBManager.insert_batches)({table_name: rows})
+        if self.recent_keys is not None:
+            self.recent_keys.add({table_name: rows})
+        self._ack(tracker, method, trace)
+
+    def _ack(self, tracker, method, trace):
+        """Ack a single delivery and finish its trace."""
+        if trace is None:
+            self._settle(tracker.ack, [method.delivery_tag])
+            return
+        with trace.span("ack"):
+            self._settle(tracker.ack, [method.delivery_tag])
+        tracing.finish(trace, "acked")
+
+    def _settle(self, fn, *args):
+        """Run an ack, nack or reply on the connection thread, which owns the channels."""
+        if self.worker_pool is None:
+            fn(*args)
+            return
+        try:
+            self.connection.add_callback_threadsafe(functools.partial(fn, *args))
+        except Exception as e:
+            logger.warning("Connection closed before %s could run, the message will be redelivered: %s", fn.__name__, e)
 
     def start_consuming(self):
         logger.debug("Starting message consumption")
@@ -111,36 +276,40 @@ class RabbitConsumer:
             try:
                 self.setup_connection()
                 logger.info("RabbitMQ consumer started. Waiting for messages...")
-                for queue_name in self.queues:
-                    self.channel.basic_consume(
+                for queue_name, channel in self.channels.items():
+                    channel.basic_consume(
                         queue=queue_name,
-                        on_message_callback=self.on_message_callback,
+                        on_message_callback=functools.partial(self.on_message_callback, queue_name=queue_name),
                         auto_ack=False,
                     )
                     logger.debug("Queue %s is set for consuming", queue_name)
-                self.channel.start_consuming()
+                # Dispatch deliveries for every channel on this connection
+                while True:
+                    self.connection.process_data_events(time_limit=None)
             except Exception as e:
                 logger.error("Error during consumption: %s", e)
                 self.close_connection()
-                logger.debug("Connection closed due to error, attempting to reconnect after %d seconds", self.connection.retry_delay)
-                time.sleep(self.connection.retry_delay)
+                logger.debug("Connection closed due to error, attempting to reconnect after %d seconds", self.connection_handler.retry_delay)
+                time.sleep(self.connection_handler.retry_delay)
 
-    def publish_message(self, exchange, routing_key, properties, body):
+    def publish_message(self, exchange, routing_key, properties, body, channel=None):
         # Adjusted the condition to check only for a missing routing_key
         if not routing_key:
             logger.error("Routing key is missing.")
             return
+        # Replies go out on the channel the request arrived on unless told otherwise
+        channel = channel or next(iter(self.channels.values()))
 
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                self.channel.basic_publish(
+                channel.basic_publish(
                     exchange=exchange,  # It's valid for this to be an empty string for the default exchange
                     routing_key=routing_key,
                     properties=properties,
                     body=body
                 )
-                logger.info("Message published to %s on attempt %d", routing_key, attempt + 1)
+                logger.debug("Message published to %s on attempt %d", routing_key, attempt + 1)
                 break  # Exit the loop on success
             except pika.exceptions.AMQPError as e:
                 logger.error("Failed to publish message on attempt %d due to AMQPError: %s", attempt + 1, e)
@@ -0,0 +1,293 @@
+"""
+Read service that serves downsampled telemetry to Grafana.
+
+Run with python read_service.py next to the consumers. It uses the same DBManager pool and
+speaks the SimpleJSON datasource protocol (the grafana-simple-json-datasource and JSON API
+plugins):
+
+- GET / answers 200 for the datasource test, GET /health and /metrics as in health_server.
+- POST /search lists the targets: "<table>.<column>" for every numeric column of gngga and
+  nav_pvt, plus "<table>.track" for positions.
+- POST /query returns {"target", "datapoints": [[value, time_ms], ...]} per column target and a
+  table with time, lat and lon per track target, each with at most maxDataPoints points
+  (capped at READ_MAX_POINTS). A target selects its device in its data field, e.g.
+  {"device_id": 3, "experiment_id": 7, "downsample": "minmax"}; experiment_id is optional and
+  downsample is "lttb" (the default) or "minmax". Tracks are always thinned with LTTB over their
+  east/north position.
+
+Rows are fetched column by column with array_agg, so a range arrives as one array per column and
+goes straight into NumPy. Ranges are split into READ_BUCKET_SECONDS buckets aligned to the epoch;
+an hour divides the daily hypertable chunks, so every bucket is read from a single chunk. Buckets
+that ended more than READ_SETTLE_SECONDS ago are kept in an LRU cache for READ_CACHE_TTL
+seconds, so dashboard refreshes over overlapping ranges only fetch the buckets they have not
+seen yet. Downsampling runs on the assembled range for every query.
+"""
+
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+import numpy as np
+from psycopg2 import sql
+from config import Config
+from db.copy_encoder import COPY_COLUMN_TYPES
+from db.db_manager import DBManager
+from downsample import lttb, min_max
+from health_server import _Handler
+from logger import setup_logger
+from metrics import Counter, Histogram, register
+
+logger = setup_logger(__name__)
+
+READ_CACHE = register(Counter("amqp_consumer_read_cache_total", "Read service bucket cache lookups: hit and miss", ("event",)))
+READ_SECONDS = register(Histogram("amqp_consumer_read_seconds", "Time spent answering read queries: fetch and downsample", ("stage",)))
+
+DOWNSAMPLERS = {"lttb": lttb, "minmax": min_max}
+
+# Selectable columns of the telemetry tables; unquoted column names are folded to lower case
+_KEY_COLUMNS = ("full_time", "device_id", "experiment_id")
+SERIES_COLUMNS = {
+    table_name: {
+        column: sql.Identifier(column.lower())
+        for column, column_type in column_types.items()
+        if column_type in ("float8", "int4", "int8") and column not in _KEY_COLUMNS
+    }
+    for table_name, column_types in COPY_COLUMN_TYPES.items()
+}
+# Signed latitude and longitude in degrees per table
+TRACK_COLUMNS = {
+    "nav_pvt": (sql.Identifier("lat"), sql.Identifier("lon")),
+    "gngga": (
+        sql.SQL("CASE WHEN ns = 'S' THEN -lat ELSE lat END"),
+        sql.SQL("CASE WHEN ew = 'W' THEN -lon ELSE lon END"),
+    ),
+}
+TRACK = "track"
+
+
+def _time_ms(value):
+    """Milliseconds since the epoch from a Grafana ISO 8601 time or a number of milliseconds."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time {value!r}")
+
+
+class ResultCache:
+    """Thread-safe LRU of fetched buckets that expire ttl seconds after they were stored."""
+    def __init__(self, size=None, ttl=None):
+        self.size = size or Config.READ_CACHE_SIZE
+        self.ttl = Config.READ_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                READ_CACHE.inc("miss")
+                return None
+            self._entries.move_to_end(key)
+        READ_CACHE.inc("hit")
+        return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+class SeriesReader:
+    """Fetches telemetry columns for one device and time range through the bucket cache."""
+    def __init__(self, cache=None, bucket_seconds=None):
+        self.cache = cache or ResultCache()
+        self.bucket_ms = int((bucket_seconds or Config.READ_BUCKET_SECONDS) * 1000)
+
+    def fetch(self, table_name, field, device_id, experiment_id, start_ms, end_ms):
+        """Return (times in ms, [one array per column]) for rows with start_ms <= full_time < end_ms.
+
+        field is a column of SERIES_COLUMNS or TRACK for the lat and lon columns.
+        """
+        if field == TRACK:
+            expressions = TRACK_COLUMNS.get(table_name)
+        else:
+            expressions = SERIES_COLUMNS.get(table_name, {}).get(field)
+            expressions = (expressions,) if expressions is not None else None
+        if expressions is None:
+            raise ValueError(f"Unknown target {table_name}.{field}")
+        settled_ms = (time.time() - Config.READ_SETTLE_SECONDS) * 1000
+        buckets = range(start_ms // self.bucket_ms * self.bucket_ms, end_ms, self.bucket_ms)
+        parts = {}
+        missing = []
+        for bucket in buckets:
+            cached = self.cache.get((table_name, field, device_id, experiment_id, bucket))
+            if cached is None:
+                missing.append(bucket)
+            else:
+                parts[bucket] = cached
+        # One query per run of adjacent missing buckets
+        runs = []
+        for bucket in missing:
+            if runs and runs[-1][1] == bucket:
+                runs[-1][1] = bucket + self.bucket_ms
+            else:
+                runs.append([bucket, bucket + self.bucket_ms])
+        for run_start, run_end in runs:
+            times, columns = self._select(table_name, expressions, device_id, experiment_id, run_start, run_end)
+            for bucket in range(run_start, run_end, self.bucket_ms):
+                low, high = np.searchsorted(times, (bucket, bucket + self.bucket_ms))
+                part = parts[bucket] = (times[low:high], [column[low:high] for column in columns])
+                if bucket + self.bucket_ms <= settled_ms:
+                    self.cache.put((table_name, field, device_id, experiment_id, bucket), part)
+        ordered = [parts[bucket] for bucket in buckets]
+        if not ordered:
+            return np.empty(0), [np.empty(0) for _ in expressions]
+        times = np.concatenate([part[0] for part in ordered])
+        columns = [np.concatenate([part[1][index] for part in ordered]) for index in range(len(expressions))]
+        low, high = np.searchsorted(times, (start_ms, end_ms))
+        return times[low:high], [column[low:high] for column in columns]
+
+    @staticmethod
+    def _select(table_name, expressions, device_id, experiment_id, start_ms, end_ms):
+        conditions = [sql.SQL("device_id = %s"), sql.SQL("full_time >= to_timestamp(%s)"), sql.SQL("full_time < to_timestamp(%s)")]
+        params = [device_id, start_ms / 1000, end_ms / 1000]
+        if experiment_id is not None:
+            conditions.append(sql.SQL("experiment_id = %s"))
+            params.append(experiment_id)
+        query = sql.SQL("SELECT array_agg((extract(epoch FROM full_time) * 1000)::float8 ORDER BY full_time), {} FROM {} WHERE {}").format(
+            sql.SQL(", ").join(sql.SQL("array_agg({} ORDER BY full_time)").format(expression) for expression in expressions),
+            sql.Identifier(table_name),
+            sql.SQL(" AND ").join(conditions),
+        )
+        with READ_SECONDS.time("fetch"), DBManager.get_db_cursor() as cur:
+            cur.execute(query, params)
+            result = cur.fetchone()
+        if result[0] is None:
+            return np.empty(0), [np.empty(0) for _ in expressions]
+        # NULLs become NaN
+        return np.asarray(result[0], dtype=np.float64), [np.asarray(column, dtype=np.float64) for column in result[1:]]
+
+
+class ReadService:
+    """Answers the SimpleJSON /search and /query requests."""
+    def __init__(self, reader=None):
+        self.reader = reader or SeriesReader()
+
+    def search(self, request=None):
+        targets = [f"{table_name}.{column}" for table_name, columns in SERIES_COLUMNS.items() for column in columns]
+        return sorted(targets + [f"{table_name}.{TRACK}" for table_name in TRACK_COLUMNS])
+
+    def query(self, request):
+        try:
+            start_ms = _time_ms(request["range"]["from"])
+            end_ms = _time_ms(request["range"]["to"])
+        except (KeyError, TypeError):
+            raise ValueError("The query needs a range with from and to")
+        max_points = min(int(request.get("maxDataPoints") or Config.READ_MAX_POINTS), Config.READ_MAX_POINTS)
+        results = []
+        for target in request.get("targets") or []:
+            if target.get("hide") or not target.get("target"):
+                continue
+            table_name, _, field = target["target"].partition(".")
+            data = target.get("data") or {}
+            try:
+                device_id = int(data["device_id"])
+                experiment_id = int(data["experiment_id"]) if data.get("experiment_id") is not None else None
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Target {target['target']} needs an integer device_id in its data")
+            times, columns = self.reader.fetch(table_name, field, device_id, experiment_id, start_ms, end_ms)
+            if field == TRACK:
+                results.append(self._track(times, *columns, max_points))
+            else:
+                downsample = DOWNSAMPLERS.get(data.get("downsample", "lttb"))
+                if downsample is None:
+                    raise ValueError(f"Unknown downsample method {data['downsample']!r}")
+                results.append(self._timeserie(target["target"], times, columns[0], max_points, downsample))
+        return results
+
+    @staticmethod
+    def _timeserie(name, times, values, max_points, downsample):
+        keep = np.isfinite(values)
+        times, values = times[keep], values[keep]
+        with READ_SECONDS.time("downsample"):
+            selected = downsample(times, values, max_points)
+        return {"target": name, "datapoints": np.column_stack((values[selected], times[selected])).tolist()}
+
+    @staticmethod
+    def _track(times, lat, lon, max_points):
+        keep = np.isfinite(lat) & np.isfinite(lon)
+        times, lat, lon = times[keep], lat[keep], lon[keep]
+        with READ_SECONDS.time("downsample"):
+            if len(lat):
+                # Degrees to a local east/north plane so both axes weigh the same
+                east = lon * math.cos(math.radians(float(lat.mean())))
+                selected = lttb(east, lat, max_points)
+            else:
+                selected = np.arange(0)
+        return {
+            "type": "table",
+            "columns": [{"text": "time", "type": "time"}, {"text": "lat", "type": "number"}, {"text": "lon", "type": "number"}],
+            "rows": np.column_stack((times[selected], lat[selected], lon[selected])).tolist(),
+        }
+
+
+class _ReadHandler(_Handler):
+    # Set on the subclass created per server
+    service = None
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] == "/":
+            self._reply(200, "text/plain", "OK\n")
+        else:
+            super().do_GET()
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if path == "/search":
+                result = self.service.search(request)
+            elif path == "/query":
+                result = self.service.query(request)
+            elif path == "/annotations":
+                result = []
+            else:
+                self._reply(404, "text/plain", "Not found\n")
+                return
+        except ValueError as e:
+            self._reply(400, "application/json", json.dumps({"error": str(e)}))
+            return
+        except Exception as e:
+            logger.error("Read query on %s failed: %s", path, e)
+            self._reply(500, "application/json", json.dumps({"error": str(e)}))
+            return
+        self._reply(200, "application/json", json.dumps(result))
+
+
+def make_read_server(service=None, port=None, host=None):
+    """Create the read service's HTTP server; call serve_forever() on it to run it."""
+    handler = type("ReadHandler", (_ReadHandler,), {
+        "health_check": staticmethod(lambda: {"ok": DBManager.check_connection()}),
+        "service": service or ReadService(),
+    })
+    server = ThreadingHTTPServer((host or Config.HTTP_HOST, port or Config.READ_HTTP_PORT), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    DBManager.initialize_connection_pool()
+    server = make_read_server()
+    logger.info("Serving Grafana read queries on port %d", server.server_address[1])
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
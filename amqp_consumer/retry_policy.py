@@ -0,0 +1,159 @@
+"""
+Bounded retries through delay queues, and dead-lettering of messages that cannot succeed.
+
+A failed message is classified as permanent (malformed JSON, unsupported message_type, a fix
+rejected by its validator, data the database refuses) or transient (database or broker
+unavailable, anything unexpected). Transient failures are republished to RETRY_EXCHANGE, a
+headers exchange that routes them by their retry-delay-ms header to a delay queue whose TTL is that
+delay; when it expires the broker dead-letters the message through the default exchange straight
+back to its original queue. The x-retry header counts the attempts, and the delay grows with it
+along RETRY_DELAYS_MS. Permanent failures and messages that used up RETRY_MAX_ATTEMPTS go to
+DEAD_LETTER_EXCHANGE with the reason in their headers. Either way the original delivery is acked,
+so a poison message is never redelivered in a tight loop.
+
+The exchanges and queues are listed in rabbitmq/definitions.json and also declared by the
+consumer on startup, which is a no-op when they already exist.
+"""
+
+import pika
+import psycopg2
+from psycopg2 import errors, pool
+from config import Config
+from logger import setup_logger
+from metrics import Counter, register
+
+logger = setup_logger(__name__)
+
+RETRIES = register(Counter("amqp_consumer_retries_total", "Messages republished to a delay queue", ("queue",)))
+DEAD_LETTERS = register(Counter("amqp_consumer_dead_letters_total", "Messages sent to the dead-letter exchange", ("queue", "reason")))
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+EXHAUSTED = "exhausted"
+
+
+class PermanentError(Exception):
+    """A message that will fail the same way however often it is retried."""
+
+
+# Checked before PERMANENT_ERRORS, ForeignKeyViolation covers a fix arriving before its device is registered
+TRANSIENT_ERRORS = (
+    psycopg2.OperationalError,
+    psycopg2.InterfaceError,
+    errors.ForeignKeyViolation,
+    pool.PoolError,
+    pika.exceptions.AMQPError,
+    ConnectionError,
+    TimeoutError,
+)
+# json.JSONDecodeError and the unsupported message type error are ValueErrors
+PERMANENT_ERRORS = (
+    PermanentError,
+    ValueError,
+    TypeError,
+    KeyError,
+    psycopg2.DataError,
+    psycopg2.IntegrityError,
+    psycopg2.ProgrammingError,
+)
+
+
+def classify(error):
+    """Return PERMANENT or TRANSIENT for an exception raised while handling a message."""
+    if isinstance(error, TRANSIENT_ERRORS):
+        return TRANSIENT
+    if isinstance(error, PERMANENT_ERRORS):
+        return PERMANENT
+    return TRANSIENT
+
+
+def delay_queue_name(delay_ms):
+    return f"gnss_retry_{delay_ms}ms"
+
+
+def declare_topology(channel, delays_ms=None):
+    """Declare the retry and dead-letter exchanges and queues on a blocking or asyncio channel."""
+    delays_ms = delays_ms or Config.RETRY_DELAYS_MS
+    channel.exchange_declare(exchange=Config.RETRY_EXCHANGE, exchange_type="headers", durable=True)
+    for delay_ms in delays_ms:
+        queue = delay_queue_name(delay_ms)
+        channel.queue_declare(
+            queue=queue,
+            durable=True,
+            arguments={"x-message-ttl": delay_ms, "x-dead-letter-exchange": ""},
+        )
+        channel.queue_bind(
+            queue=queue,
+            exchange=Config.RETRY_EXCHANGE,
+            routing_key="",
+            arguments={"x-match": "all", "retry-delay-ms": str(delay_ms)},
+        )
+    channel.exchange_declare(exchange=Config.DEAD_LETTER_EXCHANGE, exchange_type="fanout", durable=True)
+    channel.queue_declare(queue=Config.DEAD_LETTER_QUEUE, durable=True)
+    channel.queue_bind(queue=Config.DEAD_LETTER_QUEUE, exchange=Config.DEAD_LETTER_EXCHANGE, routing_key="")
+
+
+class RetryPolicy:
+    """Decides where a failed delivery goes and settles it.
+
+    Must be called on the thread that owns the delivery's channel.
+    """
+    def __init__(self, delays_ms=None, max_attempts=None):
+        self.delays_ms = tuple(delays_ms or Config.RETRY_DELAYS_MS)
+        self.max_attempts = Config.RETRY_MAX_ATTEMPTS if max_attempts is None else max_attempts
+
+    @staticmethod
+    def attempts(properties):
+        headers = getattr(properties, "headers", None) or {}
+        try:
+            return int(headers.get("x-retry", 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def delay_ms(self, attempt):
+        return self.delays_ms[min(attempt, len(self.delays_ms) - 1)]
+
+    def fail(self, tracker, queue_name, delivery_tag, properties, body, error):
+        """Republish the message to a delay queue or the dead-letter exchange, then ack it.
+
+        If the republish fails the delivery is nacked and requeued instead, so it is not lost.
+        """
+        kind = classify(error)
+        attempt = self.attempts(properties)
+        headers = dict(getattr(properties, "headers", None) or {})
+        headers["x-original-queue"] = queue_name
+        if kind == TRANSIENT and attempt < self.max_attempts:
+            delay_ms = self.delay_ms(attempt)
+            headers["x-retry"] = attempt + 1
+            headers["retry-delay-ms"] = str(delay_ms)
+            exchange = Config.RETRY_EXCHANGE
+            logger.warning("Retrying message from %s in %d ms (attempt %d of %d): %s", queue_name, delay_ms, attempt + 1, self.max_attempts, error)
+        else:
+            reason = PERMANENT if kind == PERMANENT else EXHAUSTED
+            headers["x-retry"] = attempt
+            headers["x-failure-reason"] = reason
+            headers["x-error"] = f"{type(error).__name__}: {error}"[:1000]
+            exchange = Config.DEAD_LETTER_EXCHANGE
+            logger.error("Dead-lettering %s message from %s after %d retries: %s", reason, queue_name, attempt, error)
+        try:
+            tracker.channel.basic_publish(
+                exchange=exchange,
+                routing_key=queue_name,
+                properties=pika.BasicProperties(
+                    headers=headers,
+                    content_type=getattr(properties, "content_type", None),
+                    correlation_id=getattr(properties, "correlation_id", None),
+                    reply_to=getattr(properties, "reply_to", None),
+                    delivery_mode=2,
+                ),
+                body=body,
+            )
+        except Exception as e:
+            logger.error("Failed to republish message from %s, requeueing it: %s", queue_name, e)
+            tracker.nack([delivery_tag])
+            return
+        if exchange == Config.RETRY_EXCHANGE:
+            RETRIES.inc(queue_name)
+        else:
+            DEAD_LETTERS.inc(queue_name, headers["x-failure-reason"])
+        tracker.ack([delivery_tag])
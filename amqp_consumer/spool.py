@@ -0,0 +1,299 @@
+"""
+Disk-backed spool for telemetry batches the database cannot take.
+
+When a batch cannot be written because TimescaleDB is unreachable, its rows are appended to a
+local spool and the deliveries are acked once the append is fsynced, so the broker keeps draining
+instead of redelivering the same data until the database is back. While the database is known to be
+down, further batches go straight to the spool without waiting for another failed connection
+attempt.
+
+The spool is a directory of append-only segment files, <sequence>.seg, written sequentially and
+sealed once they reach SPOOL_SEGMENT_BYTES. A segment is a run of records, each a payload length and
+CRC32 followed by the batch as compact JSON ({table: [row, ...]}). SpoolReplayer reads the segments
+oldest first through a memory map, bulk-loads their rows in batches of SPOOL_REPLAY_BATCH_ROWS and
+deletes a segment once all of it is committed. Its progress within a segment is kept in
+<sequence>.offset, the offset of the next record to write and, when a refused batch is written
+row by row, the rows of that record already written, so after a restart replay resumes where it
+stopped and no row is written twice.
+
+Rows the database refuses for good (e.g. a constraint violation) are moved to rejected.jsonl instead
+of blocking the spool. Appends beyond SPOOL_MAX_BYTES raise SpoolFull and the batch is nacked as
+without a spool.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+import psycopg2
+from psycopg2 import pool
+from config import Config
+from db.db_manager import DBManager
+from logger import setup_logger
+from metrics import Counter, Gauge, register
+
+logger = setup_logger(__name__)
+
+SPOOL_BYTES = register(Gauge("amqp_consumer_spool_bytes", "Bytes of telemetry waiting in the spool"))
+SPOOL_SEGMENTS = register(Gauge("amqp_consumer_spool_segments", "Spool segment files waiting to be replayed"))
+SPOOL_ROWS = register(Counter("amqp_consumer_spool_rows_total", "Rows spooled, replayed from the spool or rejected on replay", ("op",)))
+
+# Errors that mean the database is unavailable rather than that it refused the rows
+UNAVAILABLE_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError)
+
+SEGMENT_SUFFIX = ".seg"
+OFFSET_SUFFIX = ".offset"
+REJECTED_FILE = "rejected.jsonl"
+# Payload length and CRC32 of the payload
+_RECORD = struct.Struct("<II")
+
+
+class SpoolFull(Exception):
+    """Raised when an append would grow the spool beyond its size cap."""
+
+
+def _records(view, offset):
+    """Yield (end offset, batches) for every intact record from offset on."""
+    size = len(view)
+    while offset < size:
+        if size - offset < _RECORD.size:
+            logger.warning("Ignoring %d trailing bytes of a torn spool record", size - offset)
+            return
+        length, crc = _RECORD.unpack_from(view, offset)
+        start = offset + _RECORD.size
+        end = start + length
+        payload = view[start:end]
+        if end > size or zlib.crc32(payload) != crc:
+            logger.error("Corrupt spool record at offset %d, skipping the rest of the segment", offset)
+            return
+        yield end, json.loads(payload)
+        offset = end
+
+
+def _skip_rows(record, count):
+    """Drop the first count rows of a record, in the order they are written one by one."""
+    remaining = {}
+    for table_name, rows in record.items():
+        skipped = min(count, len(rows))
+        count -= skipped
+        if rows[skipped:]:
+            remaining[table_name] = rows[skipped:]
+    return remaining
+
+
+class Spool:
+    """Append-only segment files holding telemetry batches until they can be written.
+
+    Parameters:
+    - directory: Directory of this spool, it must not be shared with another consumer process.
+    - segment_bytes: Size at which a segment is sealed and a new one is started.
+    - max_bytes: Cap on the total size of the spool.
+    """
+    def __init__(self, directory, segment_bytes=None, max_bytes=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes or Config.SPOOL_SEGMENT_BYTES
+        self.max_bytes = max_bytes or Config.SPOOL_MAX_BYTES
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                self._sizes[int(name[:-len(SEGMENT_SUFFIX)])] = os.path.getsize(os.path.join(directory, name))
+        self._next_sequence = max(self._sizes, default=0) + 1
+        self._file = None
+        self._file_sequence = None
+        # Set while the database is known to be unavailable, new batches then skip it
+        self.diverting = False
+        if self._sizes:
+            logger.info("Spool %s holds %d segments, %d bytes to replay", directory, len(self._sizes), self.bytes)
+        self._update_metrics()
+
+    @property
+    def bytes(self):
+        return sum(self._sizes.values())
+
+    @property
+    def segments(self):
+        return len(self._sizes)
+
+    def is_full(self):
+        return self.bytes >= self.max_bytes
+
+    def _path(self, sequence, suffix=SEGMENT_SUFFIX):
+        return os.path.join(self.directory, f"{sequence:012d}{suffix}")
+
+    def _update_metrics(self):
+        SPOOL_BYTES.set(self.bytes)
+        SPOOL_SEGMENTS.set(self.segments)
+
+    def append(self, batches):
+        """Durably append a batch ({table: rows}); returns once it is fsynced."""
+        payload = json.dumps(batches, separators=(",", ":")).encode()
+        record = _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self.bytes + len(record) > self.max_bytes:
+                raise SpoolFull(f"Spool {self.directory} is full ({self.bytes} of {self.max_bytes} bytes)")
+            if self._file is None:
+                self._file_sequence = self._next_sequence
+                self._next_sequence += 1
+                self._file = open(self._path(self._file_sequence), "ab")
+                self._sizes[self._file_sequence] = 0
+            self._file.write(record)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._sizes[self._file_sequence] += len(record)
+            if self._sizes[self._file_sequence] >= self.segment_bytes:
+                self._seal()
+            self.diverting = True
+            self._update_metrics()
+        SPOOL_ROWS.inc("spooled", amount=sum(len(rows) for rows in batches.values()))
+
+    def _seal(self):
+        self._file.close()
+        self._file = None
+        self._file_sequence = None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._seal()
+
+    def replay(self, writer, max_rows=None):
+        """Write the oldest segment through writer and delete it.
+
+        Returns False if the spool is empty. Raises one of UNAVAILABLE_ERRORS if the database is
+        still unavailable; the rows committed until then are not written again.
+        """
+        max_rows = max_rows or Config.SPOOL_REPLAY_BATCH_ROWS
+        with self._lock:
+            if not self._sizes:
+                self.diverting = False
+                return False
+            sequence = min(self._sizes)
+            if sequence == self._file_sequence:
+                # Appends continue in a new segment while this one is replayed
+                self._seal()
+        path = self._path(sequence)
+        offset, written = self._read_offset(sequence)
+        try:
+            if self._sizes[sequence] > offset:
+                with open(path, "rb") as segment, mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    self._replay_segment(sequence, view, offset, written, writer, max_rows)
+        except UNAVAILABLE_ERRORS:
+            self.diverting = True
+            raise
+        with self._lock:
+            del self._sizes[sequence]
+            self._update_metrics()
+        os.remove(path)
+        if os.path.exists(self._path(sequence, OFFSET_SUFFIX)):
+            os.remove(self._path(sequence, OFFSET_SUFFIX))
+        return True
+
+    def _replay_segment(self, sequence, view, offset, written, writer, max_rows):
+        # (record offset, rows of the record written before, its remaining rows by table)
+        records = []
+        pending_rows = 0
+        start = offset
+        for end, batches in _records(view, start):
+            record = {table_name: [tuple(row) for row in rows] for table_name, rows in batches.items()}
+            if start == offset and written:
+                record = _skip_rows(record, written)
+            records.append((start, written if start == offset else 0, record))
+            pending_rows += sum(len(rows) for rows in record.values())
+            start = end
+            if pending_rows >= max_rows:
+                self._write(sequence, writer, records, pending_rows)
+                self._write_offset(sequence, end)
+                records = []
+                pending_rows = 0
+        if pending_rows:
+            self._write(sequence, writer, records, pending_rows)
+
+    def _write(self, sequence, writer, records, row_count):
+        batches = {}
+        for _, _, record in records:
+            for table_name, rows in record.items():
+                batches.setdefault(table_name, []).extend(rows)
+        try:
+            writer(batches)
+        except UNAVAILABLE_ERRORS:
+            raise
+        except Exception as e:
+            logger.error("Spooled batch of %d rows refused, writing its rows one by one: %s", row_count, e)
+            self._write_rows_singly(sequence, writer, records)
+        else:
+            logger.info("Replayed %d spooled rows", row_count)
+            SPOOL_ROWS.inc("replayed", amount=row_count)
+        self.diverting = False
+
+    def _write_rows_singly(self, sequence, writer, records):
+        # The offset moves on with every row, so an outage halfway through does not write rows twice
+        for start, written, record in records:
+            for table_name, rows in record.items():
+                for row in rows:
+                    try:
+                        writer({table_name: [row]})
+                    except UNAVAILABLE_ERRORS:
+                        raise
+                    except Exception as e:
+                        self._reject(table_name, row, e)
+                    else:
+                        SPOOL_ROWS.inc("replayed")
+                    written += 1
+                    self._write_offset(sequence, start, written)
+
+    def _reject(self, table_name, row, error):
+        SPOOL_ROWS.inc("rejected")
+        logger.error("Moving a spooled %s row to %s: %s", table_name, REJECTED_FILE, error)
+        record = {"table": table_name, "row": row, "error": f"{type(error).__name__}: {error}"}
+        with open(os.path.join(self.directory, REJECTED_FILE), "a") as rejected:
+            rejected.write(json.dumps(record) + "\n")
+
+    def _read_offset(self, sequence):
+        """Return the offset of the next record to write and how many of its rows are written."""
+        try:
+            with open(self._path(sequence, OFFSET_SUFFIX)) as offset_file:
+                offset, _, written = offset_file.read().partition(" ")
+                return int(offset), int(written or 0)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _write_offset(self, sequence, offset, written=0):
+        path = self._path(sequence, OFFSET_SUFFIX)
+        with open(path + ".tmp", "w") as offset_file:
+            offset_file.write(f"{offset} {written}" if written else str(offset))
+        os.replace(path + ".tmp", path)
+
+
+class SpoolReplayer:
+    """Daemon thread that drains the spool into the database every SPOOL_REPLAY_INTERVAL seconds."""
+    def __init__(self, spool, writer=None, interval=None):
+        self.spool = spool
+        self.writer = writer or DBManager.insert_batches
+        self.interval = interval or Config.SPOOL_REPLAY_INTERVAL
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.drain()
+
+    def drain(self):
+        """Replay segments until the spool is empty or the database fails."""
+        try:
+            while not self._stop.is_set() and self.spool.replay(self.writer):
+                pass
+        except UNAVAILABLE_ERRORS as e:
+            logger.warning("Database still unavailable, %d spooled bytes wait for replay: %s", self.spool.bytes, e)
+        except Exception as e:
+            logger.error("Spool replay failed: %s", e)
@@ -0,0 +1,188 @@
+"""
+Multi-process consumer supervisor, used when CONSUMER_PROCESSES is above 1.
+
+Forks one consumer process per slot. Every child opens its own RabbitMQ connection and database
+pool and reports a heartbeat through shared memory. Crashed children are restarted with
+exponential backoff, and SIGTERM/SIGINT stop all children before the supervisor exits. SIGUSR1 is
+passed on to every child to start a profile capture, see profiler.py.
+"""
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import metrics
+from config import Config
+from logger import setup_logger, stop_logging
+from metrics import Gauge
+
+logger = setup_logger(__name__)
+
+# Only exposed by the supervisor process, see ConsumerSupervisor.run
+PROCESSES_ALIVE = Gauge("amqp_consumer_supervisor_processes_alive", "Consumer processes currently running")
+PROCESSES_HEALTHY = Gauge("amqp_consumer_supervisor_processes_healthy", "Consumer processes with a recent heartbeat")
+RESTARTS = Gauge("amqp_consumer_supervisor_restarts", "Consecutive restarts per consumer slot", ("index",))
+_SUPERVISOR_METRICS = (PROCESSES_ALIVE, PROCESSES_HEALTHY, RESTARTS)
+
+
+def start_heartbeat(consumer, heartbeat, interval=None):
+    """Write the time to the shared heartbeat value while the consumer reports itself healthy."""
+    interval = interval or Config.SUPERVISOR_HEARTBEAT_INTERVAL
+
+    def beat():
+        while True:
+            heartbeat.value = time.time() if consumer.is_healthy() else 0.0
+            time.sleep(interval)
+
+    thread = threading.Thread(target=beat, name="heartbeat", daemon=True)
+    thread.start()
+    return thread
+
+
+def _child_main(target, heartbeat, index):
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    # Children inherit the supervisor's handlers, so restore a plain exit on SIGTERM/SIGINT
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # Ignored until the consumer installs its profiler
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    for metric in _SUPERVISOR_METRICS:
+        metrics.unregister(metric)
+    try:
+        target(heartbeat, index)
+    finally:
+        # multiprocessing skips atexit in children, write out the queued records first
+        stop_logging()
+
+
+class _Child:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.heartbeat = multiprocessing.Value("d", 0.0, lock=False)
+        self.started_at = None
+        self.restarts = 0
+        self.next_start = 0.0
+
+
+class ConsumerSupervisor:
+    """Runs and restarts a fixed number of consumer processes.
+
+    target is called in each child with the shared heartbeat value and the child's index.
+    """
+    def __init__(self, target, processes=None, backoff_initial=None, backoff_max=None):
+        self.target = target
+        self.processes = processes or Config.CONSUMER_PROCESSES
+        self.backoff_initial = backoff_initial or Config.SUPERVISOR_BACKOFF_INITIAL
+        self.backoff_max = backoff_max or Config.SUPERVISOR_BACKOFF_MAX
+        self.children = [_Child(index) for index in range(self.processes)]
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        if Config.PROFILE_MODE in ("stack", "cprofile"):
+            signal.signal(signal.SIGUSR1, self._forward_signal)
+        logger.info("Supervisor starting %d consumer processes", self.processes)
+        for metric in _SUPERVISOR_METRICS:
+            metrics.register(metric)
+        last_report = time.monotonic()
+        while not self._stopping:
+            now = time.monotonic()
+            for child in self.children:
+                self._check(child, now)
+            self._update_metrics()
+            if now - last_report >= Config.SUPERVISOR_HEALTH_LOG_INTERVAL:
+                logger.info("Consumer health: %s", self.summary())
+                last_report = now
+            time.sleep(0.5)
+        self.shutdown()
+
+    def _request_stop(self, signum, frame):
+        logger.info("Received signal %d, stopping consumer processes", signum)
+        self._stopping = True
+
+    def _forward_signal(self, signum, frame):
+        for child in self.children:
+            if child.process is not None and child.process.is_alive():
+                os.kill(child.process.pid, signum)
+
+    def _check(self, child, now):
+        process = child.process
+        if process is not None and process.is_alive():
+            return
+        if process is not None:
+            uptime = now - child.started_at
+            # A child that ran for a while before failing starts again from the initial delay
+            if uptime > self.backoff_max:
+                child.restarts = 0
+            delay = min(self.backoff_max, self.backoff_initial * 2 ** child.restarts)
+            child.restarts += 1
+            child.next_start = now + delay
+            child.process = None
+            child.heartbeat.value = 0.0
+            logger.error("Consumer %d exited with code %s after %.1f s, restarting in %.1f s", child.index, process.exitcode, uptime, delay)
+        if now >= child.next_start:
+            self._start(child, now)
+
+    def _start(self, child, now):
+        child.process = multiprocessing.Process(
+            target=_child_main,
+            args=(self.target, child.heartbeat, child.index),
+            name=f"consumer-{child.index}",
+        )
+        child.process.start()
+        child.started_at = now
+        logger.info("Started consumer %d with pid %d", child.index, child.process.pid)
+
+    def health(self):
+        """Per-child health derived from the process state and heartbeat age."""
+        now = time.time()
+        children = []
+        for child in self.children:
+            alive = child.process is not None and child.process.is_alive()
+            heartbeat_age = now - child.heartbeat.value if child.heartbeat.value else None
+            children.append({
+                "index": child.index,
+                "pid": child.process.pid if alive else None,
+                "alive": alive,
+                "healthy": alive and heartbeat_age is not None and heartbeat_age < 3 * Config.SUPERVISOR_HEARTBEAT_INTERVAL,
+                "restarts": child.restarts,
+            })
+        healthy = sum(child["healthy"] for child in children)
+        return {
+            "ok": healthy == self.processes,
+            "processes": self.processes,
+            "alive": sum(child["alive"] for child in children),
+            "healthy": healthy,
+            "children": children,
+        }
+
+    def _update_metrics(self):
+        health = self.health()
+        PROCESSES_ALIVE.set(health["alive"])
+        PROCESSES_HEALTHY.set(health["healthy"])
+        for child in self.children:
+            RESTARTS.set(child.restarts, str(child.index))
+
+    def summary(self):
+        health = self.health()
+        return "%d/%d alive, %d healthy" % (health["alive"], health["processes"], health["healthy"])
+
+    def shutdown(self, timeout=None):
+        """Send SIGTERM to every child, then kill the ones that do not exit in time."""
+        timeout = timeout or Config.SUPERVISOR_SHUTDOWN_TIMEOUT
+        alive = [child.process for child in self.children if child.process is not None and child.process.is_alive()]
+        for process in alive:
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in alive:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Consumer %s did not stop within %d s, killing it", process.name, timeout)
+                process.kill()
+                process.join()
+        logger.info("All consumer processes stopped")
@@ -0,0 +1,155 @@
+"""
+Per-delivery tracing of the blocking consumer.
+
+While SLOW_MESSAGE_MS is set every delivery gets a Trace, otherwise a share of TRACE_SAMPLE_RATE
+of them. The Trace follows the delivery through on_message_callback and records a span per step,
+in the order they end:
+
+- worker_wait: queued for a worker thread (WORKER_THREADS > 0 only);
+- decode, validate, process: as in amqp_consumer_stage_seconds;
+- batch_wait: buffered in the BatchWriter until its batch is flushed;
+- checkout, execute, commit: pool checkout, the statements and the commit in
+  DBManager.get_db_cursor and DBManager.transaction, for the message's own write or its batch;
+- ack: settling the delivery, or its batch.
+
+When a delivery is settled and took longer than SLOW_MESSAGE_MS it is logged with every span,
+whether it was sampled or not. Only the spans of the sampled share go to
+amqp_consumer_span_seconds, with their whole time as the "total" span. A span costs two
+perf_counter() calls, the stages are timed for STAGE_SECONDS anyway. stage() replaces
+STAGE_SECONDS.time() in the consumer and records both; span() records into the trace activated
+on the current thread, so the database layer needs no trace argument.
+"""
+
+import random
+import threading
+import time
+from config import Config
+from logger import setup_logger
+from metrics import STAGE_SECONDS, Counter, Histogram, register
+
+logger = setup_logger(__name__)
+
+SPAN_SECONDS = register(Histogram(
+    "amqp_consumer_span_seconds",
+    "Time spent per span of traced deliveries, and their total time",
+    ("span",),
+))
+SLOW_MESSAGES = register(Counter("amqp_consumer_slow_messages_total", "Deliveries slower than SLOW_MESSAGE_MS", ("queue",)))
+
+_local = threading.local()
+
+
+class Trace:
+    """The spans of one delivery; only sampled ones are exported as amqp_consumer_span_seconds."""
+    __slots__ = ("queue_name", "delivery_tag", "sampled", "started", "mark", "spans")
+
+    def __init__(self, queue_name, delivery_tag, sampled=True):
+        self.queue_name = queue_name
+        self.delivery_tag = delivery_tag
+        self.sampled = sampled
+        self.started = self.mark = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds))
+        self.mark = time.perf_counter()
+
+    def span(self, name):
+        """Time a block as a span."""
+        return _Span(self, name)
+
+    def wait(self, name):
+        """Record the time since the last span ended, e.g. in a queue, as a span."""
+        now = time.perf_counter()
+        self.spans.append((name, now - self.mark))
+        self.mark = now
+
+
+class _Span:
+    __slots__ = ("trace", "name", "stage", "started")
+
+    def __init__(self, trace, name, stage=False):
+        self.trace = trace
+        self.name = name
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        if self.stage:
+            STAGE_SECONDS.observe(elapsed, self.name)
+        if self.trace is not None:
+            self.trace.add(self.name, elapsed)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Activation:
+    __slots__ = ("trace", "previous")
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.previous = getattr(_local, "trace", None)
+        _local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.trace = self.previous
+
+
+def activate(trace):
+    """Make trace the current thread's trace inside the block, so span() records into it."""
+    return _Activation(trace)
+
+
+def start(queue_name, delivery_tag):
+    """Return a Trace for every delivery while the slow-message log is on, else for sampled ones; None otherwise."""
+    sampled = Config.TRACE_SAMPLE_RATE > 0 and random.random() < Config.TRACE_SAMPLE_RATE
+    if sampled or Config.SLOW_MESSAGE_MS > 0:
+        return Trace(queue_name, delivery_tag, sampled)
+    return None
+
+
+def stage(trace, name):
+    """Time a block as amqp_consumer_stage_seconds stage name and, if trace is set, as its span."""
+    return _Span(trace, name, stage=True)
+
+
+def span(name):
+    """Time a block as a span of the current thread's trace; does nothing without one."""
+    trace = getattr(_local, "trace", None)
+    return _NO_SPAN if trace is None else _Span(trace, name)
+
+
+def finish(trace, outcome):
+    """Record the spans of a settled, sampled delivery and log any delivery that was slow; trace may be None."""
+    if trace is None:
+        return
+    total = time.perf_counter() - trace.started
+    if trace.sampled:
+        for name, seconds in trace.spans:
+            SPAN_SECONDS.observe(seconds, name)
+        SPAN_SECONDS.observe(total, "total")
+    if Config.SLOW_MESSAGE_MS > 0 and total * 1000 >= Config.SLOW_MESSAGE_MS:
+        SLOW_MESSAGES.inc(trace.queue_name)
+        logger.warning(
+            "Slow message %s on %s, %s after %.1f ms: %s",
+            trace.delivery_tag, trace.queue_name, outcome, total * 1000,
+            ", ".join(f"{name} {seconds * 1000:.2f} ms" for name, seconds in trace.spans),
+        )
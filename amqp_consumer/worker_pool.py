@@ -0,0 +1,53 @@
+import queue
+import threading
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_STOP = object()
+
+
+class WorkerPool:
+    """Runs submitted work on a fixed set of threads.
+
+    Every worker owns its own queue and work is routed by hashing an ordering key, so all
+    messages of one device are handled by the same thread in delivery order while different
+    devices are processed in parallel.
+    """
+    def __init__(self, size, name="worker"):
+        self.size = size
+        self.queues = [queue.Queue() for _ in range(size)]
+        self.threads = [
+            threading.Thread(target=self._run, args=(work_queue,), name=f"{name}-{index}", daemon=True)
+            for index, work_queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+        logger.info("Started %d worker threads", size)
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) on the worker that owns the given ordering key."""
+        self.queues[hash(key) % self.size].put((fn, args))
+
+    def backlog(self):
+        """Number of queued work items that have not started yet."""
+        return sum(work_queue.qsize() for work_queue in self.queues)
+
+    def stop(self, timeout=None):
+        """Let the workers finish their queued work and wait for them to exit."""
+        for work_queue in self.queues:
+            work_queue.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+
+    @staticmethod
+    def _run(work_queue):
+        while True:
+            item = work_queue.get()
+            if item is _STOP:
+                return
+            fn, args = item
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error("Unhandled error in worker: %s", e)
@@ -0,0 +1,181 @@
+"""
+In-process stand-ins for the broker and the database used by the ingest benchmark.
+
+FakeConnection and FakeChannel implement the parts of pika's BlockingConnection and channel that
+RabbitConsumer uses, and run timers only when the benchmark asks them to. FakeDBBackend swaps
+DBManager's database access for an in-memory sink, optionally with a simulated write latency, so
+the consumer's own CPU cost can be measured without Postgres.
+"""
+
+import itertools
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+from db.db_manager import DBManager
+
+
+class FakeMethod:
+    __slots__ = ("delivery_tag", "redelivered")
+
+    def __init__(self, delivery_tag, redelivered=False):
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+
+
+class FakeProperties:
+    __slots__ = ("reply_to", "correlation_id", "content_type", "headers")
+
+    def __init__(self, reply_to=None, correlation_id=None, content_type="application/json", headers=None):
+        self.reply_to = reply_to
+        self.correlation_id = correlation_id
+        self.content_type = content_type
+        self.headers = headers
+
+
+class FakeChannel:
+    def __init__(self, channel_number):
+        self.channel_number = channel_number
+        self.is_open = True
+        self.prefetch_count = None
+        self.ack_frames = 0
+        self.nack_frames = 0
+        self.published = 0
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    def exchange_declare(self, exchange, exchange_type="direct", **kwargs):
+        pass
+
+    def queue_declare(self, queue, **kwargs):
+        # Passive declares read the depth from the returned frame, the fake queue is always drained
+        return types.SimpleNamespace(method=types.SimpleNamespace(message_count=0))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        pass
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, **kwargs):
+        return f"ctag-{self.channel_number}"
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.ack_frames += 1
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.nack_frames += 1
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, **kwargs):
+        self.published += 1
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeConnection:
+    def __init__(self):
+        self.is_open = True
+        self.channels = []
+        self._timers = {}
+        self._timer_ids = itertools.count(1)
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def channel(self):
+        channel = FakeChannel(len(self.channels) + 1)
+        self.channels.append(channel)
+        return channel
+
+    def call_later(self, delay, callback):
+        timer_id = next(self._timer_ids)
+        self._timers[timer_id] = (time.monotonic() + delay, callback)
+        return timer_id
+
+    def remove_timeout(self, timer_id):
+        self._timers.pop(timer_id, None)
+
+    def add_callback_threadsafe(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def process_due(self):
+        """Run queued thread-safe callbacks and timers that are due, like process_data_events."""
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        now = time.monotonic()
+        for timer_id, (deadline, callback) in list(self._timers.items()):
+            if deadline <= now and self._timers.pop(timer_id, None) is not None:
+                callback()
+
+    def close(self):
+        self.is_open = False
+
+
+class _FakeCursor:
+    def __init__(self, backend):
+        self.backend = backend
+        self._result = None
+
+    def execute(self, query, params=None):
+        self.backend.statements += 1
+        self._result = (next(self.backend._ids),)
+
+    def fetchone(self):
+        return self._result
+
+    def fetchall(self):
+        return [self._result] if self._result else []
+
+    def close(self):
+        pass
+
+
+class FakeDBBackend:
+    """Replaces DBManager's database access with an in-memory sink while installed.
+
+    Parameters:
+    - write_latency_ms: Time every batch or single-row write sleeps, to emulate a database round trip.
+    """
+    def __init__(self, write_latency_ms=0.0):
+        self.write_latency = write_latency_ms / 1000.0
+        self.rows = 0
+        self.batches = 0
+        self.statements = 0
+        self._ids = itertools.count(1)
+        self._saved = None
+
+    def install(self):
+        self._saved = {name: DBManager.__dict__[name] for name in ("insert_batches", "insert_into_db", "get_db_cursor", "transaction")}
+        DBManager.insert_batches = staticmethod(self.insert_batches)
+        DBManager.insert_into_db = staticmethod(self.insert_into_db)
+        DBManager.get_db_cursor = staticmethod(self.get_db_cursor)
+        DBManager.transaction = staticmethod(self.transaction)
+        return self
+
+    def uninstall(self):
+        for name, attribute in (self._saved or {}).items():
+            setattr(DBManager, name, attribute)
+        self._saved = None
+
+    def _wait(self):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+
+    def insert_batches(self, batches, copy_format=None):
+        self._wait()
+        self.batches += 1
+        self.rows += sum(len(rows) for rows in batches.values())
+
+    def insert_into_db(self, table_name, data):
+        self._wait()
+        self.rows += 1
+
+    @contextmanager
+    def get_db_cursor(self, commit=False):
+        yield _FakeCursor(self)
+
+    @contextmanager
+    def transaction(self):
+        yield
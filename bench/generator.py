@@ -0,0 +1,180 @@
+"""
+Synthetic GNSS traffic for the ingest benchmark.
+
+Every device follows its own random walk around a base position and emits fixes at a fixed rate,
+alternating GNGGA and NAV-PVT messages like the field units do. A small share of messages are
+device and experiment registration RPCs, and error_ratio of all messages are broken in one of the
+ways seen in production: truncated JSON, a missing mandatory field, an unparsable number or an
+unknown message type. With envelope_fixes above 1, telemetry is sent as batch envelopes of that
+many consecutive fixes of one device instead of one message per fix.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+TELEMETRY_QUEUE = "gnss_data_queue"
+ERROR_KINDS = ("truncated_json", "missing_field", "bad_number", "unknown_type")
+ENVELOPE_HEADER = ("message_type", "device_id", "experiment_id")
+
+
+class Message:
+    __slots__ = ("queue_name", "body", "reply_to", "correlation_id", "kind", "fixes")
+
+    def __init__(self, queue_name, body, kind, reply_to=None, correlation_id=None, fixes=0):
+        self.queue_name = queue_name
+        self.body = body
+        self.kind = kind
+        self.fixes = fixes
+        self.reply_to = reply_to
+        self.correlation_id = correlation_id
+
+
+class _Device:
+    def __init__(self, device_id, experiment_id, rng, start):
+        self.device_id = device_id
+        self.experiment_id = experiment_id
+        self.alias = f"bench-device-{device_id:05d}"
+        self.lat = 40.0 + rng.uniform(-0.5, 0.5)
+        self.lon = -86.9 + rng.uniform(-0.5, 0.5)
+        self.height = 150.0 + rng.uniform(-20.0, 20.0)
+        self.time = start + timedelta(milliseconds=rng.randrange(1000))
+
+    def step(self, rng, interval):
+        self.lat += rng.gauss(0.0, 2e-6)
+        self.lon += rng.gauss(0.0, 2e-6)
+        self.height += rng.gauss(0.0, 0.01)
+        self.time += interval
+
+
+class PayloadGenerator:
+    """Produces Message objects with JSON bodies as the consumer receives them.
+
+    Parameters:
+    - devices: Number of simulated devices.
+    - experiments: Number of experiments the devices are spread over.
+    - fix_rate_hz: Fixes per second and device, sets the spacing of full_time.
+    - error_ratio: Share of messages that are malformed.
+    - registration_ratio: Share of messages that are device or experiment registrations.
+    - seed: Seed for reproducible payloads.
+    - envelope_fixes: Fixes per telemetry message, above 1 they are sent as batch envelopes.
+    """
+    def __init__(self, devices=50, experiments=5, fix_rate_hz=10, error_ratio=0.01, registration_ratio=0.01, seed=1, envelope_fixes=1):
+        self.rng = random.Random(seed)
+        start = datetime.now(timezone.utc).replace(microsecond=0)
+        self.devices = [_Device(index + 1, index % experiments + 1, self.rng, start) for index in range(devices)]
+        self.experiments = experiments
+        self.interval = timedelta(seconds=1.0 / fix_rate_hz)
+        self.error_ratio = error_ratio
+        self.registration_ratio = registration_ratio
+        self.envelope_fixes = envelope_fixes
+        self._sequence = 0
+
+    def messages(self, count):
+        for _ in range(count):
+            yield self.next()
+
+    def next(self):
+        self._sequence += 1
+        rng = self.rng
+        if rng.random() < self.registration_ratio:
+            message = self._registration()
+        else:
+            device = rng.choice(self.devices)
+            fix = self._gngga if self._sequence % 2 else self._nav_pvt
+            if self.envelope_fixes > 1:
+                payload = self._envelope(device, fix)
+                message = Message(TELEMETRY_QUEUE, payload, f"{payload['message_type']}-envelope", fixes=self.envelope_fixes)
+            else:
+                device.step(rng, self.interval)
+                payload = fix(device)
+                message = Message(TELEMETRY_QUEUE, payload, payload["message_type"], fixes=1)
+        if rng.random() < self.error_ratio:
+            self._corrupt(message)
+        if isinstance(message.body, dict):
+            message.body = json.dumps(message.body).encode()
+        return message
+
+    @staticmethod
+    def _full_time(device):
+        return device.time.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+    def _gngga(self, device):
+        rng = self.rng
+        return {
+            "message_type": "GNGGA", "full_time": self._full_time(device),
+            "lat": f"{device.lat:.7f}", "ns": "N", "lon": f"{abs(device.lon):.7f}", "ew": "W",
+            "quality": rng.choice((1, 2, 4, 4, 4, 5)), "num_sv": rng.randint(8, 30), "hdop": f"{rng.uniform(0.5, 2.0):.1f}",
+            "alt": f"{device.height + 33.9:.1f}", "alt_unit": "M", "sep": "-33.9", "sep_unit": "M",
+            "diff_age": rng.randint(0, 3), "diff_station": "0000",
+            "processed_time": int(device.time.timestamp() * 1000), "device_id": device.device_id,
+            "experiment_id": device.experiment_id,
+        }
+
+    def _nav_pvt(self, device):
+        rng = self.rng
+        t = device.time
+        return {
+            "message_type": "NAV-PVT", "full_time": self._full_time(device), "device_id": device.device_id,
+            "experiment_id": device.experiment_id, "year": t.year, "month": t.month, "day": t.day, "hour": t.hour,
+            "min": t.minute, "second": t.second, "validDate": True, "validTime": True, "tAcc": rng.randint(10, 40),
+            "fixType": "3D", "gnssFixOk": True, "numSV": rng.randint(8, 30), "lon": f"{device.lon:.7f}",
+            "lat": f"{device.lat:.7f}", "height": f"{device.height:.3f}", "hMSL": f"{device.height + 33.9:.3f}",
+            "hAcc": f"{rng.uniform(0.01, 0.05):.3f}", "vAcc": f"{rng.uniform(0.01, 0.08):.3f}",
+            "velN": f"{rng.gauss(0, 0.005):.3f}", "velE": f"{rng.gauss(0, 0.005):.3f}", "velD": f"{rng.gauss(0, 0.005):.3f}",
+            "gSpeed": f"{rng.uniform(0, 0.01):.3f}", "headMot": f"{rng.uniform(0, 360):.1f}",
+            "sAcc": f"{rng.uniform(0.02, 0.1):.2f}", "headAcc": f"{rng.uniform(20, 180):.1f}", "pDOP": f"{rng.uniform(0.8, 2.5):.1f}",
+        }
+
+    def _envelope(self, device, fix):
+        fixes = []
+        for _ in range(self.envelope_fixes):
+            device.step(self.rng, self.interval)
+            fixes.append(fix(device))
+        envelope = {key: fixes[0][key] for key in ENVELOPE_HEADER}
+        for payload in fixes:
+            for key in ENVELOPE_HEADER:
+                del payload[key]
+        envelope["fixes"] = fixes
+        return envelope
+
+    def _registration(self):
+        rng = self.rng
+        correlation_id = f"bench-{self._sequence}"
+        if rng.random() < 0.8:
+            device = rng.choice(self.devices)
+            body = {
+                "message_type": "device_registration", "alias": device.alias, "region": "us-central",
+                "location_desc": "bench field", "owner_name": "bench", "make": "u-blox", "model": "ZED-F9P",
+                "signals": "GPS,GLONASS,Galileo,BeiDou", "configuration": {"rate_hz": 10},
+                "experiment_id": device.experiment_id,
+            }
+            return Message("device_registration", body, "device_registration", "bench.replies", correlation_id)
+        experiment = rng.randint(1, self.experiments)
+        body = {
+            "message_type": "experiment_registration", "alias": f"bench-experiment-{experiment}",
+            "description": "Synthetic benchmark experiment", "configuration": {"devices": len(self.devices)},
+            "region": "us-central", "type": "static",
+        }
+        return Message("experiment_registration", body, "experiment_registration", "bench.replies", correlation_id)
+
+    def _corrupt(self, message):
+        kind = self.rng.choice(ERROR_KINDS)
+        body = message.body
+        if kind in ("missing_field", "bad_number") and "fixes" in body:
+            # Only the first fix of an envelope is broken, the rest are stored
+            body = body["fixes"][0]
+        if kind == "truncated_json":
+            encoded = json.dumps(body).encode()
+            message.body = encoded[: len(encoded) // 2]
+        elif kind == "missing_field":
+            body.pop("full_time" if "full_time" in body else "alias", None)
+        elif kind == "bad_number":
+            for key in ("lat", "hdop", "hAcc"):
+                if key in body:
+                    body[key] = "n/a"
+        else:
+            body["message_type"] = "UNKNOWN"
+        # Fixes that should end up stored
+        message.fixes = max(message.fixes - 1, 0) if body is not message.body else 0
+        message.kind = f"error:{kind}"
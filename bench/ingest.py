@@ -0,0 +1,331 @@
+"""
+End-to-end ingest benchmark of RabbitConsumer with in-process broker and database stand-ins.
+
+Synthetic GNGGA, NAV-PVT and registration messages from generator.py are fed to
+RabbitConsumer.on_message_callback through the fakes in fakes.py, exactly as pika would deliver
+them on the connection thread. With --db fake (the default) writes go to an in-memory sink, with
+--db postgres they go to the database configured by the POSTGRES_* variables, so use a local,
+disposable instance.
+
+Reports throughput, p50/p99 latency of the whole callback and per stage (from every sample the
+consumer records in its metrics) and allocations per message from a separate tracemalloc pass,
+and writes the results as JSON. --compare prints the change against an earlier result file.
+
+Usage, from the repository root:
+    python bench/ingest.py [--messages 50000] [--devices 50] [--rate 0] [--error-ratio 0.01]
+                           [--envelope-fixes 1] [--db fake|postgres] [--output bench/results/run.json] [--compare old.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "amqp_consumer"))
+
+# The consumer reads its configuration at import time
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("HTTP_PORT", "0")
+os.environ.setdefault("WORKER_THREADS", "0")
+
+import metrics  # noqa: E402
+import rabbit_consumer  # noqa: E402
+import retry_policy  # noqa: E402
+from config import Config  # noqa: E402
+from db.db_manager import DBManager  # noqa: E402
+from message_processors.processor_factory import get_processor  # noqa: E402
+from fakes import FakeConnection, FakeDBBackend, FakeMethod, FakeProperties  # noqa: E402
+from generator import PayloadGenerator  # noqa: E402
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class StageRecorder:
+    """Keeps every sample observed by metrics.STAGE_SECONDS, whose buckets are too coarse for microsecond stages."""
+    def __init__(self):
+        self.samples = {}
+        self._observe = metrics.STAGE_SECONDS.observe
+
+    def install(self):
+        metrics.STAGE_SECONDS.observe = self.observe
+        return self
+
+    def uninstall(self):
+        del metrics.STAGE_SECONDS.observe
+
+    def observe(self, value, stage):
+        self.samples.setdefault(stage, []).append(value)
+        self._observe(value, stage)
+
+    def summary(self):
+        stages = {}
+        for stage, values in self.samples.items():
+            values = sorted(values)
+            stages[stage] = {
+                "count": len(values),
+                "p50_us": percentile(values, 0.5) * 1e6,
+                "p99_us": percentile(values, 0.99) * 1e6,
+            }
+        return stages
+
+
+def reset_metrics():
+    for metric in metrics._registry:
+        with metric._lock:
+            metric._values.clear()
+
+
+def build_consumer():
+    """A RabbitConsumer whose setup_connection opened fake channels instead of connecting."""
+    consumer = rabbit_consumer.RabbitConsumer(get_processor)
+    connect = rabbit_consumer.RabbitMQConnection.connect
+    rabbit_consumer.RabbitMQConnection.connect = lambda self: FakeConnection()
+    try:
+        consumer.setup_connection()
+    finally:
+        rabbit_consumer.RabbitMQConnection.connect = connect
+    return consumer
+
+
+def prepare(messages):
+    deliveries = []
+    for tag, message in enumerate(messages, start=1):
+        deliveries.append((
+            message.queue_name,
+            FakeMethod(tag),
+            FakeProperties(message.reply_to, message.correlation_id),
+            message.body,
+        ))
+    return deliveries
+
+
+def drive(consumer, deliveries, rate=0.0, latencies=None):
+    """Deliver every message to the consumer, pacing them at rate messages per second if set."""
+    connection = consumer.connection
+    callback = consumer.on_message_callback
+    channels = consumer.channels
+    interval = 1.0 / rate if rate else 0.0
+    started = time.perf_counter()
+    for index, (queue_name, method, properties, body) in enumerate(deliveries):
+        if interval:
+            delay = started + index * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        before = time.perf_counter()
+        callback(channels[queue_name], method, properties, body, queue_name=queue_name)
+        if latencies is not None:
+            latencies.append(time.perf_counter() - before)
+        if index % 64 == 0:
+            connection.process_due()
+    for batch_writer in consumer.batch_writers.values():
+        batch_writer.flush()
+    connection.process_due()
+    return time.perf_counter() - started
+
+
+def measure_allocations(consumer, deliveries):
+    """Memory allocated while handling each message, traced with tracemalloc.
+
+    transient_peak_bytes is the high-water mark above the memory in use before the message, i.e.
+    what the message needed at once; retained bytes and blocks are what stayed allocated after it.
+    """
+    for batch_writer in consumer.batch_writers.values():
+        batch_writer.flush()
+    callback = consumer.on_message_callback
+    channels = consumer.channels
+    peaks = []
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    start_bytes, _ = tracemalloc.get_traced_memory()
+    for queue_name, method, properties, body in deliveries:
+        current, _ = tracemalloc.get_traced_memory()
+        # reset_peak is only available from Python 3.9
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        callback(channels[queue_name], method, properties, body, queue_name=queue_name)
+        if hasattr(tracemalloc, "reset_peak"):
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    end_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks_after = sys.getallocatedblocks()
+    count = len(deliveries)
+    peaks.sort()
+    return {
+        "messages": count,
+        "transient_peak_bytes_p50": percentile(peaks, 0.5),
+        "transient_peak_bytes_mean": sum(peaks) / len(peaks) if peaks else None,
+        "retained_bytes_per_message": (end_bytes - start_bytes) / count,
+        "retained_blocks_per_message": (blocks_after - blocks_before) / count,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    if args.db == "postgres":
+        DBManager.initialize_connection_pool(max_retries=1)
+        backend = None
+    else:
+        backend = FakeDBBackend(args.db_latency_ms).install()
+
+    generator = PayloadGenerator(
+        devices=args.devices,
+        experiments=args.experiments,
+        error_ratio=args.error_ratio,
+        registration_ratio=args.registration_ratio,
+        seed=args.seed,
+        envelope_fixes=args.envelope_fixes,
+    )
+    kinds = {}
+    fixes = 0
+    messages = list(generator.messages(args.warmup + args.messages + args.alloc_messages))
+    for message in messages[args.warmup:args.warmup + args.messages]:
+        kinds[message.kind] = kinds.get(message.kind, 0) + 1
+        fixes += message.fixes
+    deliveries = prepare(messages)
+    warmup = deliveries[:args.warmup]
+    timed = deliveries[args.warmup:args.warmup + args.messages]
+    allocation_pass = deliveries[args.warmup + args.messages:]
+
+    consumer = build_consumer()
+    drive(consumer, warmup)
+    reset_metrics()
+
+    latencies = []
+    recorder = StageRecorder().install()
+    elapsed = drive(consumer, timed, args.rate, latencies)
+    recorder.uninstall()
+    latencies.sort()
+    stages = recorder.summary()
+    acks = sum(metrics.ACKS._values.values())
+    nacks = sum(metrics.NACKS._values.values())
+    retries = sum(retry_policy.RETRIES._values.values())
+    dead_letters = sum(retry_policy.DEAD_LETTERS._values.values())
+    batch_state = metrics.BATCH_ROWS._values.get(())
+
+    allocations = measure_allocations(consumer, allocation_pass) if allocation_pass else None
+    if backend is not None:
+        backend.uninstall()
+
+    return {
+        "label": args.label,
+        "git_commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": {
+            "messages": args.messages,
+            "devices": args.devices,
+            "experiments": args.experiments,
+            "rate": args.rate,
+            "error_ratio": args.error_ratio,
+            "registration_ratio": args.registration_ratio,
+            "seed": args.seed,
+            "envelope_fixes": args.envelope_fixes,
+            "db": args.db,
+            "db_latency_ms": args.db_latency_ms,
+            "batch_enabled": Config.BATCH_ENABLED,
+            "batch_max_rows": Config.BATCH_MAX_ROWS,
+            "batch_max_delay_ms": Config.BATCH_MAX_DELAY_MS,
+        },
+        "message_kinds": kinds,
+        "results": {
+            "elapsed_s": elapsed,
+            "messages_per_s": len(timed) / elapsed,
+            "fixes_per_s": fixes / elapsed,
+            "callback_p50_us": percentile(latencies, 0.5) * 1e6,
+            "callback_p99_us": percentile(latencies, 0.99) * 1e6,
+            "callback_max_us": latencies[-1] * 1e6,
+            "stages": stages,
+            "acks": acks,
+            "nacks": nacks,
+            "retries": retries,
+            "dead_letters": dead_letters,
+            "mean_batch_rows": batch_state[1] / batch_state[2] if batch_state else None,
+            "allocations": allocations,
+        },
+    }
+
+
+def compare(result, baseline):
+    print(f"\nCompared with {baseline.get('label') or baseline.get('git_commit')} ({baseline.get('timestamp')}):")
+    for key in ("messages_per_s", "fixes_per_s", "callback_p50_us", "callback_p99_us"):
+        before, after = baseline["results"].get(key), result["results"].get(key)
+        if before and after is not None:
+            print(f"  {key:<24} {before:12.1f} -> {after:12.1f} ({(after - before) / before * 100:+.1f}%)")
+    before_allocations = baseline["results"].get("allocations") or {}
+    after_allocations = result["results"].get("allocations") or {}
+    key = "transient_peak_bytes_mean"
+    if before_allocations.get(key) and after_allocations.get(key) is not None:
+        before, after = before_allocations[key], after_allocations[key]
+        print(f"  {key:<24} {before:12.1f} -> {after:12.1f} ({(after - before) / before * 100:+.1f}%)")
+
+
+def report(result):
+    results = result["results"]
+    print(f"{result['parameters']['messages']} messages in {results['elapsed_s']:.2f} s: {results['messages_per_s']:.0f} msgs/s, {results['fixes_per_s']:.0f} fixes/s")
+    print(f"callback latency p50 {results['callback_p50_us']:.1f} us, p99 {results['callback_p99_us']:.1f} us, max {results['callback_max_us']:.1f} us")
+    for stage, values in results["stages"].items():
+        print(f"  {stage:<9} n={values['count']:<8} p50 {values['p50_us']:9.1f} us   p99 {values['p99_us']:9.1f} us")
+    print(
+        f"acks {results['acks']}, nacks {results['nacks']}, retries {results['retries']}, "
+        f"dead letters {results['dead_letters']}, mean batch rows {results['mean_batch_rows']}"
+    )
+    if results["allocations"]:
+        allocations = results["allocations"]
+        print(
+            f"allocations per message: transient peak p50 {allocations['transient_peak_bytes_p50']} B, "
+            f"{allocations['retained_bytes_per_message']:.1f} B and {allocations['retained_blocks_per_message']:.2f} blocks retained"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=50000, help="timed messages")
+    parser.add_argument("--warmup", type=int, default=2000, help="untimed messages delivered first")
+    parser.add_argument("--alloc-messages", type=int, default=2000, help="messages in the tracemalloc pass, 0 skips it")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--experiments", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=0.0, help="messages per second, 0 delivers as fast as possible")
+    parser.add_argument("--error-ratio", type=float, default=0.01, help="share of malformed messages")
+    parser.add_argument("--registration-ratio", type=float, default=0.01, help="share of registration RPCs")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--envelope-fixes", type=int, default=1, help="fixes per telemetry message, above 1 sends batch envelopes")
+    parser.add_argument("--db", choices=("fake", "postgres"), default="fake")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="simulated write latency of the fake database")
+    parser.add_argument("--label", help="name stored with the results")
+    parser.add_argument("--output", help="result file, defaults to bench/results/ingest-<commit>-<time>.json")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    args = parser.parse_args()
+
+    result = run(args)
+    report(result)
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"ingest-{result['git_commit'] or 'unknown'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Microbenchmark of the per-message CPU cost of turning a decoded fix into a database row.
+
+Compares the dict-based validators the processors used before (kept here verbatim as the
+baseline) with the compiled RowSchema encoders in message_processors/row_schema.py.
+
+Usage, from the repository root:
+    python bench/row_encoders.py [--number 200000]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "amqp_consumer"))
+
+from message_processors.row_schema import GNGGA_SCHEMA, NAV_PVT_SCHEMA  # noqa: E402
+
+GNGGA_MESSAGE = {
+    "message_type": "GNGGA", "full_time": "2024-05-01T12:00:00.100Z", "lat": "40.4237054", "ns": "N",
+    "lon": "-86.9212022", "ew": "W", "quality": 4, "num_sv": 18, "hdop": "0.6", "alt": "187.3", "alt_unit": "M",
+    "sep": "-33.9", "sep_unit": "M", "diff_age": 1, "diff_station": "0000", "processed_time": 1714564800100,
+    "device_id": 12, "experiment_id": 3,
+}
+
+NAV_PVT_MESSAGE = {
+    "message_type": "NAV-PVT", "full_time": "2024-05-01T12:00:00.100Z", "device_id": 12, "experiment_id": 3,
+    "year": 2024, "month": 5, "day": 1, "hour": 12, "min": 0, "second": 0, "validDate": True, "validTime": True,
+    "tAcc": 21, "fixType": "3D", "gnssFixOk": True, "numSV": 18, "lon": "-86.9212022", "lat": "40.4237054",
+    "height": "153.412", "hMSL": "187.301", "hAcc": "0.014", "vAcc": "0.021", "velN": "0.002", "velE": "-0.001",
+    "velD": "0.003", "gSpeed": "0.002", "headMot": "0.0", "sAcc": "0.05", "headAcc": "180.0", "pDOP": "1.1",
+}
+
+
+def legacy_validate_gngga(data):
+    defaults = {
+        "lat": None, "lon": None, "alt": 0.0, "sep": 0.0, "ns": "", "ew": "", "alt_unit": "", "sep_unit": "",
+        "diff_age": -1, "diff_station": "",
+    }
+    if "message_type" in data:
+        data.pop("message_type")
+    for key, default in defaults.items():
+        if not data.get(key) or data[key] == "":
+            data[key] = default
+        elif key in ["lat", "lon", "hdop", "alt", "sep"]:
+            try:
+                data[key] = float(data[key])
+            except ValueError:
+                data[key] = default
+    if not data.get("full_time") or not data.get("device_id"):
+        return None
+    if data["quality"] < 0 or data["num_sv"] < 0:
+        data["quality"], data["num_sv"] = 0, 0
+    return data
+
+
+def legacy_validate_nav_pvt(data):
+    defaults = {
+        "lat": None, "lon": None, "height": 0.0, "hMSL": 0.0, "hAcc": 0.0, "vAcc": 0.0, "velN": 0.0, "velE": 0.0,
+        "velD": 0.0, "gSpeed": 0.0, "headMot": 0.0, "sAcc": 0.0, "headAcc": 0.0, "pDOP": 0.0, "numSV": 0, "tAcc": 0,
+        "validDate": 0, "validTime": 0, "gnssFixOk": 0, "fixType": "", "year": 2024, "month": 1, "day": 1,
+        "hour": 0, "min": 0, "second": 0,
+    }
+    data.pop("message_type", None)
+    for key, default in defaults.items():
+        if not data.get(key) or data[key] == "":
+            data[key] = default
+        elif key in ["lat", "lon", "height", "hMSL", "hAcc", "vAcc", "velN", "velE", "velD", "gSpeed", "headMot",
+                     "sAcc", "headAcc", "pDOP"]:
+            try:
+                data[key] = float(data[key])
+            except ValueError:
+                data[key] = default
+        elif key in ["validDate", "validTime", "gnssFixOk"]:
+            data[key] = int(bool(data[key]))
+    if not data.get("full_time") or not data.get("device_id") or not data.get("experiment_id"):
+        return None
+    return data
+
+
+def legacy_row(validate, message):
+    # The validators mutate their input, and insert_into_db then rebuilt columns and values from the keys
+    data = validate(dict(message))
+    return ", ".join(data.keys()), tuple(data.values())
+
+
+def measure(label, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    per_message = seconds / number * 1e9
+    print(f"{label:<28} {per_message:8.0f} ns/msg")
+    return per_message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=200000, help="messages per timing run")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    for name, message, legacy, schema in (
+        ("GNGGA", GNGGA_MESSAGE, legacy_validate_gngga, GNGGA_SCHEMA),
+        ("NAV-PVT", NAV_PVT_MESSAGE, legacy_validate_nav_pvt, NAV_PVT_SCHEMA),
+    ):
+        before = measure(f"{name} dict validator", lambda: legacy_row(legacy, message), args.number)
+        after = measure(f"{name} compiled encoder", lambda: schema.encode(message), args.number)
+        print(f"{name} speedup: {before / after:.1f}x\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+-- Enable TimescaleDB for the gngga and nav_pvt hypertables
+CREATE EXTENSION IF NOT EXISTS timescaledb;
+
 -- Create hardware table
 CREATE TABLE hardware (
     id SERIAL PRIMARY KEY,
@@ -33,8 +36,7 @@ CREATE TABLE experiment_devices (
 );
 
 CREATE TABLE gngga (
-    id SERIAL PRIMARY KEY,
-    full_time TIMESTAMP WITH TIME ZONE,
+    full_time TIMESTAMP WITH TIME ZONE NOT NULL,
     lat DOUBLE PRECISION,
     ns TEXT,
     lon DOUBLE PRECISION,
@@ -55,13 +57,7 @@ CREATE TABLE gngga (
     FOREIGN KEY (experiment_id) REFERENCES experiments(id) ON DELETE CASCADE
 );
 
--- Indexes for optimizing queries on gngga table
-CREATE INDEX idx_gngga_full_time ON gngga (full_time);
-CREATE INDEX idx_gngga_device_id ON gngga (device_id);
-CREATE INDEX idx_gngga_experiment_id ON gngga (experiment_id);
-
 CREATE TABLE nav_pvt (
-    id SERIAL PRIMARY KEY,
     full_time TIMESTAMP WITH TIME ZONE NOT NULL,
     device_id INTEGER NOT NULL,
     experiment_id INTEGER NOT NULL,
@@ -95,10 +91,14 @@ CREATE TABLE nav_pvt (
     FOREIGN KEY (experiment_id) REFERENCES experiments(id) ON DELETE CASCADE
 );
 
--- Indexes for optimizing queries on nav_pvt table
-CREATE INDEX idx_nav_pvt_full_time ON nav_pvt (full_time);
-CREATE INDEX idx_nav_pvt_experiment_id ON nav_pvt (experiment_id);
-CREATE INDEX idx_nav_pvt_device_id ON nav_pvt (device_id);
+-- Hypertables, indexes, compression, retention and continuous aggregates are shared with the migrations
+\ir schema/hypertables.sql
+
+-- Unique (device_id, full_time) keys that make redelivered fixes idempotent
+\ir schema/natural_keys.sql
+
+-- Accuracy summaries per experiment and device
+\ir schema/experiment_accuracy.sql
 
 INSERT INTO experiments (start_time, end_time, alias, description, region, type)
 VALUES ('2024-01-01T00:00:00+00', NULL, 'sandbox', 'generic sandbox experiment', 'global', 'unknown')
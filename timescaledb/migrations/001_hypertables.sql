@@ -0,0 +1,39 @@
+-- Converts gngga and nav_pvt of an existing deployment into hypertables.
+-- Run once with psql from this directory, preferably while the consumers are stopped:
+--   psql -h <host> -U postgres -d postgres -f 001_hypertables.sql
+-- Existing rows are moved into chunks, which locks both tables for the duration of the migration.
+
+CREATE EXTENSION IF NOT EXISTS timescaledb;
+
+BEGIN;
+
+-- Unique constraints on a hypertable must include the time column, so the SERIAL keys go away
+ALTER TABLE gngga DROP CONSTRAINT IF EXISTS gngga_pkey;
+ALTER TABLE gngga DROP COLUMN IF EXISTS id;
+ALTER TABLE nav_pvt DROP CONSTRAINT IF EXISTS nav_pvt_pkey;
+ALTER TABLE nav_pvt DROP COLUMN IF EXISTS id;
+
+-- gngga.full_time used to be nullable, rows without a timestamp cannot be placed in a chunk
+DELETE FROM gngga WHERE full_time IS NULL;
+ALTER TABLE gngga ALTER COLUMN full_time SET NOT NULL;
+
+-- Replaced by the composite (device_id, full_time) and (experiment_id, full_time) indexes
+DROP INDEX IF EXISTS idx_gngga_full_time;
+DROP INDEX IF EXISTS idx_gngga_device_id;
+DROP INDEX IF EXISTS idx_gngga_experiment_id;
+DROP INDEX IF EXISTS idx_nav_pvt_full_time;
+DROP INDEX IF EXISTS idx_nav_pvt_experiment_id;
+DROP INDEX IF EXISTS idx_nav_pvt_device_id;
+
+COMMIT;
+
+-- Continuous aggregates cannot be created inside a transaction block
+\ir ../schema/hypertables.sql
+
+-- Materialize the history that existed before the migration
+CALL refresh_continuous_aggregate('gngga_1s', NULL, NULL);
+CALL refresh_continuous_aggregate('gngga_1m', NULL, NULL);
+CALL refresh_continuous_aggregate('gngga_1h', NULL, NULL);
+CALL refresh_continuous_aggregate('nav_pvt_1s', NULL, NULL);
+CALL refresh_continuous_aggregate('nav_pvt_1m', NULL, NULL);
+CALL refresh_continuous_aggregate('nav_pvt_1h', NULL, NULL);
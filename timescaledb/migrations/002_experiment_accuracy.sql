@@ -0,0 +1,5 @@
+-- Adds the experiment_accuracy table the consumers write their accuracy summaries to.
+-- Run once with psql from this directory before starting consumers with ACCURACY_STATS_ENABLED=true:
+--   psql -h <host> -U postgres -d postgres -f 002_experiment_accuracy.sql
+
+\ir ../schema/experiment_accuracy.sql
@@ -0,0 +1,29 @@
+-- Enforces the natural key (device_id, full_time) of gngga and nav_pvt on an existing deployment.
+-- The table already implies the message type, so the key needs no message_type column.
+-- Run once with psql from this directory after 001_hypertables.sql, preferably while the consumers are stopped:
+--   psql -h <host> -U postgres -d postgres -f 003_natural_keys.sql
+-- Unique indexes cannot be built over compressed chunks, so every chunk is decompressed first;
+-- the compression policy compresses them again on its next run.
+
+SELECT decompress_chunk(chunk, if_compressed => true) FROM show_chunks('gngga') AS chunk;
+SELECT decompress_chunk(chunk, if_compressed => true) FROM show_chunks('nav_pvt') AS chunk;
+
+BEGIN;
+
+-- Keep one row of every duplicated fix; duplicates share full_time and therefore their chunk
+DELETE FROM gngga a USING gngga b
+WHERE a.device_id = b.device_id AND a.full_time = b.full_time AND a.ctid > b.ctid;
+DELETE FROM nav_pvt a USING nav_pvt b
+WHERE a.device_id = b.device_id AND a.full_time = b.full_time AND a.ctid > b.ctid;
+
+\ir ../schema/natural_keys.sql
+
+COMMIT;
+
+-- The continuous aggregates counted the removed duplicates
+CALL refresh_continuous_aggregate('gngga_1s', NULL, NULL);
+CALL refresh_continuous_aggregate('gngga_1m', NULL, NULL);
+CALL refresh_continuous_aggregate('gngga_1h', NULL, NULL);
+CALL refresh_continuous_aggregate('nav_pvt_1s', NULL, NULL);
+CALL refresh_continuous_aggregate('nav_pvt_1m', NULL, NULL);
+CALL refresh_continuous_aggregate('nav_pvt_1h', NULL, NULL);
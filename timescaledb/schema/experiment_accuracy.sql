@@ -0,0 +1,32 @@
+-- Accuracy summaries written by the consumers, see amqp_consumer/accuracy_stats.py.
+-- One row per experiment, device and source table for every summary window.
+-- Distances are in metres; drift is only filled in for experiments of type 'static'.
+
+CREATE TABLE IF NOT EXISTS experiment_accuracy (
+    window_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    window_end TIMESTAMP WITH TIME ZONE NOT NULL,
+    experiment_id INTEGER NOT NULL,
+    device_id INTEGER NOT NULL,
+    source TEXT NOT NULL, -- Telemetry table the fixes came from, gngga or nav_pvt
+    samples INTEGER NOT NULL,
+    mean_lat DOUBLE PRECISION,
+    mean_lon DOUBLE PRECISION,
+    mean_height DOUBLE PRECISION,
+    h_scatter DOUBLE PRECISION, -- 2D RMS distance from the mean position
+    v_scatter DOUBLE PRECISION, -- Standard deviation of the height
+    cep50 DOUBLE PRECISION,
+    cep95 DOUBLE PRECISION,
+    mean_hacc DOUBLE PRECISION, -- Mean accuracy estimates reported by the receiver, nav_pvt only
+    mean_vacc DOUBLE PRECISION,
+    fix_ok_ratio REAL, -- Share of fixes with gnssFixOk or a GGA quality above 0
+    fix_ratios JSONB, -- Share of every fix type (nav_pvt) or GGA quality (gngga) present in the window
+    drift_h DOUBLE PRECISION, -- Horizontal distance of the window mean from the running mean of earlier windows
+    drift_v DOUBLE PRECISION, -- Height of the window mean above the running mean of earlier windows
+    FOREIGN KEY (device_id) REFERENCES hardware(id) ON DELETE CASCADE,
+    FOREIGN KEY (experiment_id) REFERENCES experiments(id) ON DELETE CASCADE
+);
+
+SELECT create_hypertable('experiment_accuracy', 'window_start', chunk_time_interval => INTERVAL '30 days', if_not_exists => true);
+
+CREATE INDEX IF NOT EXISTS idx_experiment_accuracy_experiment_id_window_start ON experiment_accuracy (experiment_id, window_start DESC);
+CREATE INDEX IF NOT EXISTS idx_experiment_accuracy_device_id_window_start ON experiment_accuracy (device_id, window_start DESC);
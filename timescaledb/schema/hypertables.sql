@@ -0,0 +1,202 @@
+-- TimescaleDB layout for the telemetry tables, shared by init-db.sql and the migrations.
+-- Expects gngga and nav_pvt to exist as plain tables whose full_time column is NOT NULL.
+
+-- One chunk per day keeps a day of fixes for a few hundred receivers in memory
+SELECT create_hypertable('gngga', 'full_time', chunk_time_interval => INTERVAL '1 day', migrate_data => true, if_not_exists => true);
+SELECT create_hypertable('nav_pvt', 'full_time', chunk_time_interval => INTERVAL '1 day', migrate_data => true, if_not_exists => true);
+
+-- Dashboards filter by device or experiment over a time range
+CREATE INDEX IF NOT EXISTS idx_gngga_device_id_full_time ON gngga (device_id, full_time DESC);
+CREATE INDEX IF NOT EXISTS idx_gngga_experiment_id_full_time ON gngga (experiment_id, full_time DESC);
+CREATE INDEX IF NOT EXISTS idx_nav_pvt_device_id_full_time ON nav_pvt (device_id, full_time DESC);
+CREATE INDEX IF NOT EXISTS idx_nav_pvt_experiment_id_full_time ON nav_pvt (experiment_id, full_time DESC);
+
+-- Native compression, segmented by device so per-device range scans only decompress their own segments
+ALTER TABLE gngga SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'device_id',
+    timescaledb.compress_orderby = 'full_time DESC'
+);
+ALTER TABLE nav_pvt SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'device_id',
+    timescaledb.compress_orderby = 'full_time DESC'
+);
+SELECT add_compression_policy('gngga', INTERVAL '7 days', if_not_exists => true);
+SELECT add_compression_policy('nav_pvt', INTERVAL '7 days', if_not_exists => true);
+
+-- Raw fixes are kept for a year, the continuous aggregates below outlive them
+SELECT add_retention_policy('gngga', INTERVAL '365 days', if_not_exists => true);
+SELECT add_retention_policy('nav_pvt', INTERVAL '365 days', if_not_exists => true);
+
+-- Continuous aggregates per device and experiment for the dashboards
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS gngga_1s
+WITH (timescaledb.continuous) AS
+SELECT
+    time_bucket(INTERVAL '1 second', full_time) AS bucket,
+    device_id,
+    experiment_id,
+    count(*) AS samples,
+    avg(lat) AS lat,
+    avg(lon) AS lon,
+    avg(alt) AS alt,
+    avg(hdop) AS hdop,
+    max(hdop) AS max_hdop,
+    avg(num_sv) AS num_sv,
+    min(quality) AS min_quality,
+    max(quality) AS max_quality
+FROM gngga
+GROUP BY bucket, device_id, experiment_id
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('gngga_1s',
+    start_offset => INTERVAL '10 minutes',
+    end_offset => INTERVAL '2 seconds',
+    schedule_interval => INTERVAL '10 seconds',
+    if_not_exists => true);
+
+SELECT add_retention_policy('gngga_1s', INTERVAL '90 days', if_not_exists => true);
+
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS gngga_1m
+WITH (timescaledb.continuous) AS
+SELECT
+    time_bucket(INTERVAL '1 minute', full_time) AS bucket,
+    device_id,
+    experiment_id,
+    count(*) AS samples,
+    avg(lat) AS lat,
+    avg(lon) AS lon,
+    avg(alt) AS alt,
+    avg(hdop) AS hdop,
+    max(hdop) AS max_hdop,
+    avg(num_sv) AS num_sv,
+    min(quality) AS min_quality,
+    max(quality) AS max_quality
+FROM gngga
+GROUP BY bucket, device_id, experiment_id
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('gngga_1m',
+    start_offset => INTERVAL '2 hours',
+    end_offset => INTERVAL '1 minute',
+    schedule_interval => INTERVAL '1 minute',
+    if_not_exists => true);
+
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS gngga_1h
+WITH (timescaledb.continuous) AS
+SELECT
+    time_bucket(INTERVAL '1 hour', full_time) AS bucket,
+    device_id,
+    experiment_id,
+    count(*) AS samples,
+    avg(lat) AS lat,
+    avg(lon) AS lon,
+    avg(alt) AS alt,
+    avg(hdop) AS hdop,
+    max(hdop) AS max_hdop,
+    avg(num_sv) AS num_sv,
+    min(quality) AS min_quality,
+    max(quality) AS max_quality
+FROM gngga
+GROUP BY bucket, device_id, experiment_id
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('gngga_1h',
+    start_offset => INTERVAL '3 days',
+    end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '30 minutes',
+    if_not_exists => true);
+
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS nav_pvt_1s
+WITH (timescaledb.continuous) AS
+SELECT
+    time_bucket(INTERVAL '1 second', full_time) AS bucket,
+    device_id,
+    experiment_id,
+    count(*) AS samples,
+    avg(lat) AS lat,
+    avg(lon) AS lon,
+    avg(height) AS height,
+    avg(hMSL) AS hmsl,
+    avg(hAcc) AS hacc,
+    max(hAcc) AS max_hacc,
+    avg(vAcc) AS vacc,
+    max(vAcc) AS max_vacc,
+    avg(gSpeed) AS gspeed,
+    avg(numSV) AS numsv,
+    avg(pDOP) AS pdop,
+    sum(gnssFixOk) AS fix_ok_samples
+FROM nav_pvt
+GROUP BY bucket, device_id, experiment_id
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('nav_pvt_1s',
+    start_offset => INTERVAL '10 minutes',
+    end_offset => INTERVAL '2 seconds',
+    schedule_interval => INTERVAL '10 seconds',
+    if_not_exists => true);
+
+SELECT add_retention_policy('nav_pvt_1s', INTERVAL '90 days', if_not_exists => true);
+
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS nav_pvt_1m
+WITH (timescaledb.continuous) AS
+SELECT
+    time_bucket(INTERVAL '1 minute', full_time) AS bucket,
+    device_id,
+    experiment_id,
+    count(*) AS samples,
+    avg(lat) AS lat,
+    avg(lon) AS lon,
+    avg(height) AS height,
+    avg(hMSL) AS hmsl,
+    avg(hAcc) AS hacc,
+    max(hAcc) AS max_hacc,
+    avg(vAcc) AS vacc,
+    max(vAcc) AS max_vacc,
+    avg(gSpeed) AS gspeed,
+    avg(numSV) AS numsv,
+    avg(pDOP) AS pdop,
+    sum(gnssFixOk) AS fix_ok_samples
+FROM nav_pvt
+GROUP BY bucket, device_id, experiment_id
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('nav_pvt_1m',
+    start_offset => INTERVAL '2 hours',
+    end_offset => INTERVAL '1 minute',
+    schedule_interval => INTERVAL '1 minute',
+    if_not_exists => true);
+
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS nav_pvt_1h
+WITH (timescaledb.continuous) AS
+SELECT
+    time_bucket(INTERVAL '1 hour', full_time) AS bucket,
+    device_id,
+    experiment_id,
+    count(*) AS samples,
+    avg(lat) AS lat,
+    avg(lon) AS lon,
+    avg(height) AS height,
+    avg(hMSL) AS hmsl,
+    avg(hAcc) AS hacc,
+    max(hAcc) AS max_hacc,
+    avg(vAcc) AS vacc,
+    max(vAcc) AS max_vacc,
+    avg(gSpeed) AS gspeed,
+    avg(numSV) AS numsv,
+    avg(pDOP) AS pdop,
+    sum(gnssFixOk) AS fix_ok_samples
+FROM nav_pvt
+GROUP BY bucket, device_id, experiment_id
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('nav_pvt_1h',
+    start_offset => INTERVAL '3 days',
+    end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '30 minutes',
+    if_not_exists => true);
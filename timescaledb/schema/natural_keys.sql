@@ -0,0 +1,9 @@
+-- (device_id, full_time) is the natural key of a fix; the table already implies its message type.
+-- The consumers insert with ON CONFLICT DO NOTHING, so a redelivered or resent fix is stored once.
+-- The unique indexes replace the plain (device_id, full_time) indexes from hypertables.sql.
+-- Expects the tables to hold no duplicates, see migrations/003_natural_keys.sql.
+
+DROP INDEX IF EXISTS idx_gngga_device_id_full_time;
+DROP INDEX IF EXISTS idx_nav_pvt_device_id_full_time;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_gngga_device_id_full_time ON gngga (device_id, full_time DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_nav_pvt_device_id_full_time ON nav_pvt (device_id, full_time DESC);